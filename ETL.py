@@ -2,174 +2,509 @@
 #DONE: resolved conflict on updating duplicate values
 #DONE: Added progress bar for cli output
 #DONE: handled negative and zero values in database
-from connectdb import connect_db
+from connectdb import connect_db, new_connection
 from extract_data import *
+from loader import BulkLoader, infile_options, upsert_query, df_to_rows
+from dimension_cache import DimensionCache
+from rollup import refresh_daily_rollup, refresh_latest_readings, record_load
+from snapshot import export_snapshot
+from metrics import metrics, write_json, write_prometheus
 from pathlib import Path
-from wakepy import keep
-import psutil
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import cProfile
+import csv
+import datetime
+import io
+import os
+import pstats
+import queue
+import threading
+import time
 import logging
 
-from tqdm import tqdm	#library for progress bar in CLI
-
 #establish path to current directory
 path = Path(__file__).parent
 
-#setup logger and config log level and output format
 #options for logger are: logger.debug(), info(), warning(), error()
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-                filename=path/'etl.log',
-                level=logging.INFO,
-                format='%(asctime)s || %(levelname)s: %(message)s',
-                force=True
-                )   
 
 #Call import for location ids. For testing use short list, later full list
 #use pathlib notation for defining path. static is directory in current dir.
-filename = 'locations list.csv'
-filepath = path/'static'/filename
-# filename = 'failed_locations.csv'
-# filepath = path/'dev'/filename
-with filepath.open(mode='r') as f:
+LOCATIONS_FILE = path/'static'/'locations list.csv'
+# LOCATIONS_FILE = path/'dev'/'failed_locations.csv'
+
+# start date of every sensor when the aqi table is still empty. Override with ETL_START_DATE env variable
+START_DATE = os.getenv('ETL_START_DATE', '2024-01-01')
+
+# run state, filled in by init_run when a run starts. Importing ETL reads no files and opens no connection,
+# so its helpers can be imported by tests, benchmarks and workers
+location_ids = []
+sensor_windows = {}	#location_id -> [(sensor_id, date_from, date_to)] of failed sensor windows fetched again as recorded
+cnx, curs = None, None
+date_from = None	#start date for sensors that have no data in the db yet
+watermarks = {}		#(location_id, pollutant_id) -> newest datetime loaded
+date_to = None
+
+#setup logger and config log level and output format. Only the CLI does this, an importer keeps its own logging
+def setup_logging():
+	logging.basicConfig(
+		filename=path/'etl.log',
+		level=logging.INFO,
+		format='%(asctime)s || %(levelname)s: %(message)s',
+		force=True
+		)
+
+def read_location_ids(filepath=LOCATIONS_FILE):
+	with filepath.open(mode='r') as f:
 		reader = csv.reader(f)
-		location_ids  = list(reader)[0]
+		return list(reader)[0]
 
-#Establish connection and cursor with database as IAM user
-cnx, curs = connect_db()
-	
-#date_from is the most recent (or max) date from the datetime column. Returns as datetime object
-curs.execute('SELECT MAX(datetime) FROM aqi')
-date_from = curs.fetchone()[0] - datetime.timedelta(days=1)
-date_from = date_from.date().isoformat() 
+#take the run's connection and read where each sensor left off. locations defaults to the locations list csv,
+#windows are the sensor windows to fetch besides them (see sensor_windows)
+def init_run(connection, cursor, locations=None, windows=None):
+	global location_ids, sensor_windows, cnx, curs, date_from, watermarks, date_to
+	location_ids = read_location_ids() if locations is None else list(locations)
+	sensor_windows = windows or {}
+	cnx, curs = connection, cursor
+
+	#date_from is the most recent (or max) date from the datetime column. Returns as datetime object
+	#only used as the start date for sensors that have no data in the db yet
+	curs.execute('SELECT MAX(datetime) FROM aqi')
+	newest = curs.fetchone()[0]
+	#an empty database (a first run, or a rebuild with --cache-mode replay) starts every sensor from START_DATE
+	date_from = (newest - datetime.timedelta(days=1)).date().isoformat() if newest is not None else START_DATE
+
+	#per (location, pollutant) high-water marks, the newest timestamp loaded for each, in one grouped query. Each sensor
+	#fetches from its own mark: healthy sensors skip the overlap and sensors that went quiet get their gap refilled
+	curs.execute('SELECT location_id, pollutant_id, MAX(datetime) FROM aqi GROUP BY location_id, pollutant_id')
+	watermarks = {(location_id, pollutant_id): newest for location_id, pollutant_id, newest in curs.fetchall()}
 
-#define date ranges for getting aqi data: date_to is todays date.
-date_to = datetime.date.today().isoformat()
+	#define date ranges for getting aqi data: date_to is todays date.
+	date_to = datetime.date.today().isoformat()
 
 # initalize counters for summary
 locations_success = set()
 total_aqi_inserts = 0
 table_exceptions = { 'countries': 0, 'pollutants': 0, 'locations': 0, 'sensors': 0,   'aqi': 0  }             
+failed_loads = set()	# locations whose load raised outside the per-table inserts, so their rows may not have landed
+
+# dates that got aqi rows this run. Only these are refreshed in the aqi_daily rollup
+touched_dates = set()
+
+# number of locations fetched concurrently. Override with --workers or ETL_WORKERS env variable
+WORKERS = int(os.getenv('ETL_WORKERS', 4))
+
+# max fetched locations waiting to be loaded. Override with --queue-size or ETL_QUEUE_SIZE env variable
+QUEUE_SIZE = int(os.getenv('ETL_QUEUE_SIZE', 16))
+
+# per stage counters for the run summary. extract stats are written by several workers, so guarded by stats_lock
+stats_lock = threading.Lock()
+stage_stats = {
+	'extract': {'items': 0, 'seconds': 0.0, 'blocked': 0.0},
+	'load': {'items': 0, 'seconds': 0.0, 'idle': 0.0},
+	'queue': {'max_depth': 0, 'depth_sum': 0, 'samples': 0},
+}
+
+# how rows are written: 'location' commits each location on its own, 'bulk' batches multi-row upserts across
+# locations, 'infile' batches too but loads aqi rows with LOAD DATA LOCAL INFILE. Override with --load-mode
+LOAD_MODE = os.getenv('ETL_LOAD_MODE', 'bulk')
+FLUSH_ROWS = int(os.getenv('ETL_FLUSH_ROWS', 50000))	#flush a bulk batch at this many rows...
+FLUSH_MB = float(os.getenv('ETL_FLUSH_MB', 16))			#...or at this many megabytes, whichever comes first
+bulk_loader = None	#set by main when load mode is bulk or infile
+
+# existing countries, pollutants, locations and sensors, loaded by main so unchanged dimension rows are not re-upserted
+dimension_cache = DimensionCache()
+
+# run metrics are written here as JSON at the end of every run, and as a Prometheus textfile if a path is given.
+# Override with --metrics-json / --prometheus, or the ETL_METRICS_JSON / ETL_PROM_FILE env variables
+METRICS_JSON = os.getenv('ETL_METRICS_JSON', str(path/'etl_metrics.json'))
+PROM_FILE = os.getenv('ETL_PROM_FILE')
 
 # Establish parent process (specifically if run in background by launchd or not). If not, progress bar from tqdm library will be used.
 from_launchd = os.getenv('RUNNING_FROM_LAUNCHD')
 	
 #main ETL script
-def main():
+#locations defaults to the locations list csv, or a subset such as the dead-lettered locations of an earlier run.
+#windows are dead-lettered sensor windows, {location_id: [(sensor_id, date_from, date_to)]}
+def main(workers=WORKERS, queue_size=QUEUE_SIZE, load_mode=LOAD_MODE, flush_rows=FLUSH_ROWS, flush_mb=FLUSH_MB, snapshot=True, locations=None,
+		windows=None):
+	#Establish connection and cursor with database as IAM user. The run holds one pooled connection and hands it back
+	#when it ends or fails
+	with connect_db() as (connection, cursor):
+		init_run(connection, cursor, locations, windows)
+		run(workers, queue_size, load_mode, flush_rows, flush_mb, snapshot)
+
+def run(workers, queue_size, load_mode, flush_rows, flush_mb, snapshot):
+	global bulk_loader
+
 	#log program start info
 	logger.info('%s: ETL main started.', datetime.datetime.now().ctime())
-	logger.info(f'Fetching AQI data from {date_from} to {date_to}.')
-
-	#progress bar wrapper for iterating over ETL process
-	# if from_launchd:
-	# with tqdm(total=len(location_ids), desc='Processing...', ncols=100, leave=False) as pbar: 
-	for loc_id in location_ids:
-			# send location endpoint request and return json object of response
-			loc_response = get_location_response(loc_id, to_print=False)
-			
-			if loc_response is None: # or loc_response.results[0]:
-				# pbar.update(1)
-				# sys.stdout.flush()
-				continue
-
-			sensor_ids, dfs = location_res_to_dfs(loc_response)
-
-			#unpack dataframes from dfs
-			locations_df, countries_df, sensors_df, pollutants_df = dfs
-			#get dataframe of all sensor aqi data at location at loc_id
-			aqi_df = multi_aqi_request_to_df(sensor_ids, loc_id, date_from, date_to)
-
-			if aqi_df.empty:	
-				# pbar.update(1)
-				# sys.stdout.flush()
-				continue
-
-			#Prepare tables, column headers and data frames for inserting into sql
-			tables = ['countries', 'pollutants', 'locations', 'sensors', 'aqi']	#table names in SQL 
-			dataframes = [countries_df, pollutants_df, locations_df, sensors_df, aqi_df]	#dataframes in the same order
-
-			# check if sensor already in DB: if so, sensor, pollutant, location, and country insert is redundant. redefine tables and dfs as aqi info only
-			if sensor_in_db(curs, sensor_id=sensors_df.loc[0]['id']):
-				tables = tables[-1]
-				dataframes = dataframes[-1]
-
-			lines_commited = 0
-			for tablename, df in zip(tables, dataframes):	#zip so each table and source dataframe can be associated with eachother. 
-				#insert to all 5 tables in db
-				insert_df_to_db(curs, tablename, df)
-				lines_commited += df.shape[0]	
-
-			#commit changes to sql. (like save)
-			cnx.commit()
-			logger.info(f'{lines_commited} lines commited for location {loc_id}')
-			# tqdm.write(f'{lines_commited} lines inserted for location {loc_id}')
-			# pbar.update(1)
-			# sys.stdout.flush()
+	logger.info(f'Fetching AQI data to {date_to} from each sensor\'s watermark ({len(watermarks)} known, '
+		f'{min(watermarks.values(), default=date_from)} oldest), new sensors from {date_from}, with {workers} worker(s).')
+
+	#read existing dimension ids once, instead of checking the db per location
+	dimension_cache.load(curs)
+
+	#extraction and loading run as two stages joined by a bounded queue, so the database is written while the API
+	#is still being read. When the queue is full, fetch workers block until the loader catches up (backpressure).
+	ready = queue.Queue(maxsize=queue_size)
+	if load_mode == 'infile':	#own connection, the only one allowed to read local files, and only from the staging dir
+		bulk_loader = BulkLoader(new_connection(**infile_options()), mode='infile',
+			max_rows=flush_rows, max_bytes=int(flush_mb*1024**2), dimensions=dimension_cache)
+	elif load_mode != 'location':
+		bulk_loader = BulkLoader(cnx, mode='insert', max_rows=flush_rows, max_bytes=int(flush_mb*1024**2),
+			dimensions=dimension_cache)
+	loader = threading.Thread(target=load_stage, args=(ready,), name='loader')
+	loader.start()
+
+	run_start = time.monotonic()
+	#fetch workers share the rate limit budget in extract_data, so more workers only helps until the API quota is the bottleneck
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		for loc_id in location_ids:
+			pool.submit(extract_stage, loc_id, ready)
+		#locations only in this run for their failed sensor windows
+		listed = set(location_ids)
+		for loc_id in sensor_windows:
+			if loc_id not in listed:
+				pool.submit(extract_stage, loc_id, ready, False)
+
+	#all producers done. sentinel tells the loader to stop once the queue is drained
+	ready.put(None)
+	loader.join()
+
+	#bring the dashboard rollup up to date for the days this run loaded, then the latest readings of their countries
+	with metrics.timer('finish_seconds', step='rollup'):
+		refresh_daily_rollup(cnx, touched_dates)
+	with metrics.timer('finish_seconds', step='latest'):
+		refresh_latest_readings(cnx, locations_success)
+	record_load(cnx, 'etl', total_aqi_inserts)
+
+	#refresh the local parquet snapshot for the months this run loaded. The data is already committed, so a failed
+	#export is only logged and the next run rewrites those months
+	if snapshot:
+		try:
+			with metrics.timer('finish_seconds', step='snapshot'):
+				export_snapshot(cnx, touched_dates)
+		except Exception as e:
+			logger.warning('Snapshot export failed: %s', e)
+	stage_stats['elapsed'] = time.monotonic() - run_start
 	return
 
-#helper function for inserting a df to associated table in aqi database 
-def insert_df_to_db(curs, tablename, df):
-	global total_aqi_inserts  # Add this line to modify the global variable
+#producer: fetch one location in a worker thread and hand it to the loader
+def extract_stage(loc_id, ready, from_watermarks=True):
+	start = time.monotonic()
+	try:
+		result = fetch_location(loc_id, from_watermarks)
+	except Exception as e:
+		logger.warning(f'Fetch failed for location {loc_id}: %s', e)
+		result = None
+	fetched = time.monotonic()
+
+	if result is not None:
+		ready.put((loc_id, *result))	#blocks while the queue is full
+	
+	metrics.observe('stage_seconds', fetched - start, stage='extract')
+	metrics.observe('queue_blocked_seconds', time.monotonic() - fetched)
+	with stats_lock:
+		stage_stats['extract']['items'] += 1
+		stage_stats['extract']['seconds'] += fetched - start
+		stage_stats['extract']['blocked'] += time.monotonic() - fetched
+
+#consumer: single loader thread, owns the cursor. Drains the queue until the sentinel arrives
+def load_stage(ready):
+	while True:
+		depth = ready.qsize()
+		stage_stats['queue']['max_depth'] = max(stage_stats['queue']['max_depth'], depth)
+		stage_stats['queue']['depth_sum'] += depth
+		stage_stats['queue']['samples'] += 1
+
+		wait_start = time.monotonic()
+		item = ready.get()
+		stage_stats['load']['idle'] += time.monotonic() - wait_start
+		if item is None:
+			break
 
-	# extract column headers from dataframe
-	head = df.columns.to_list()
+		start = time.monotonic()
+		try:
+			load_location(*item)
+		except Exception as e:	#loader must not die, or the producers block forever on a full queue
+			logger.warning(f'Load failed for location {item[0]}: %s', e)
+			failed_loads.add(item[0])
+		metrics.observe('stage_seconds', time.monotonic() - start, stage='load')
+		stage_stats['load']['items'] += 1
+		stage_stats['load']['seconds'] += time.monotonic() - start
 
-	#make string of '%s' pollutants for each value that will be inserted in each row. One per column in a dataframe. Use # of pollutants in the header list.
-	placeholder = ', '.join(['%s']*len(head))
+	#write the last partial batch, then fold bulk counters into the run summary
+	if bulk_loader is not None:
+		finish_bulk_load()
 
-	#convert header list to a tuple, all in a string. also change single quotes to backticks.
-	head = str(tuple(head)).replace("'","`")
+def finish_bulk_load():
+	global total_aqi_inserts
+	start = time.monotonic()
+	bulk_loader.flush()
+	stage_stats['load']['seconds'] += time.monotonic() - start
 
-	#Execute query: 1) insert table name, column headers string, and %s placeholder string (for prepared statement format)
-	#Update id = id "resets" the id to itself if a key constraint is triggered, id is not changed, row is not altered, insert continues.
-	query = "INSERT INTO `{}` {} VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(tablename, head, placeholder,
-				', '.join(f"`{col}` = VALUES(`{col}`)" for col in df.columns[1:])) 
+	total_aqi_inserts += bulk_loader.rows_written['aqi']
+	locations_success.update(bulk_loader.locations)
+	for tablename, count in bulk_loader.exceptions.items():
+		table_exceptions[tablename] += count
+	logger.info(bulk_loader.summary())
+	if bulk_loader.cnx is not cnx:	#infile mode's own connection, not the pooled one
+		bulk_loader.cnx.close()
 
-	# Change df into list of tuples, to plug into 'insert many' method. List of tuples is argument for insert_many. 
-	# Each pollutant in list is a separate set of values to be inserted. 
-	if tablename == 'sensors':	#sensors_df all integers. if not explicitly converted to ints, they will be retrieved as numpy.ints from df.values, which is not compatible w mysql insert
-		values = [tuple(int(x) for x in row) for row in df.values]
+#summary of per-stage throughput and queue depth, one line per stage
+def stage_summary():
+	elapsed = stage_stats.get('elapsed') or 1e-9
+	extract, load, q = stage_stats['extract'], stage_stats['load'], stage_stats['queue']
+	return [
+		f"Extract: {extract['items']} locations in {elapsed:.1f}s ({extract['items']/elapsed:.2f}/s), "
+			f"{extract['seconds']:.1f}s fetching, {extract['blocked']:.1f}s blocked on a full queue.",
+		f"Load: {load['items']} locations ({load['items']/elapsed:.2f}/s), "
+			f"{load['seconds']:.1f}s inserting, {load['idle']:.1f}s waiting for data.",
+		f"Queue: max depth {q['max_depth']}, mean depth {q['depth_sum']/max(q['samples'], 1):.1f}.",
+	]
+
+#structured summary of the run: totals, stage counters and every metric recorded by the extract and load code
+def run_summary():
+	metrics.gauge('run_seconds', stage_stats.get('elapsed', 0.0))
+	metrics.gauge('last_run_timestamp', time.time())
+	metrics.gauge('locations_loaded', len(locations_success))
+	metrics.gauge('rate_limit_sleep_seconds', budget.sleep_time)
+	return {
+		'finished_at': datetime.datetime.now().isoformat(timespec='seconds'),
+		'date_to': date_to,
+		'locations': len(location_ids),
+		'locations_loaded': len(locations_success),
+		'aqi_rows': total_aqi_inserts,
+		'table_exceptions': table_exceptions,
+		'failed_loads': len(failed_loads),
+		'api_requests': budget.requests,
+		'rate_limit_sleep_seconds': round(budget.sleep_time, 3),
+		'stages': stage_stats,
+		'metrics': metrics.summary(),
+	}
+
+#write the run summary as JSON, and as a Prometheus textfile when prom_file is set. A failed write never fails the run
+def write_metrics(json_file=METRICS_JSON, prom_file=PROM_FILE):
+	summary = run_summary()
+	try:
+		if json_file:
+			write_json(json_file, summary)
+		if prom_file:
+			write_prometheus(prom_file)
+	except OSError as e:
+		logger.warning('Metrics export failed: %s', e)
+	return summary
+
+#run main under cProfile: full stats are dumped to profile_file (open with pstats or snakeviz) and the top functions logged.
+#The work runs in the fetch workers, extract_data's sensor pool and the loader thread, so every thread started during
+#the run gets a profiler of its own, and their stats are merged with the main thread's
+def profile_main(profile_file, **kwargs):
+	profiler = cProfile.Profile()
+	thread_profilers = []
+	lock = threading.Lock()
+	def profile_thread(frame, event, arg):	#first profile event of a new thread: hand the thread to its own profiler
+		thread_profiler = cProfile.Profile()
+		with lock:
+			thread_profilers.append(thread_profiler)
+		thread_profiler.enable()
+
+	threading.setprofile(profile_thread)
+	try:
+		profiler.runcall(main, **kwargs)
+	finally:
+		threading.setprofile(None)
+		top = io.StringIO()
+		stats = pstats.Stats(profiler, stream=top)
+		with lock:
+			for thread_profiler in thread_profilers:
+				stats.add(thread_profiler)
+		stats.dump_stats(profile_file)
+		stats.sort_stats('cumulative').print_stats(25)
+		logger.info(f'Profile of {len(thread_profilers) + 1} threads written to {profile_file}. '
+			f'Top functions by cumulative time:\n{top.getvalue()}')
+
+#extract stage for one location: location metadata and aqi data for each of its sensors from their watermarks, plus
+#the location's failed sensor windows. from_watermarks False fetches only those windows. Runs in a worker thread.
+def fetch_location(loc_id, from_watermarks=True):
+	# send location endpoint request and return json object of response
+	loc_response = get_location_response(loc_id, to_print=False)
 	
+	if loc_response is None: # or loc_response.results[0]:
+		#the location is dead-lettered on its own, which would only refetch it from the watermarks. Its windows are kept
+		for sensor_id, window_from, window_to in sensor_windows.get(loc_id, []):
+			dead_letters.add('sensor', RuntimeError(f'location {loc_id} fetch failed'), location_id=loc_id,
+				sensor_id=sensor_id, date_from=window_from, date_to=window_to)
+		return None
+
+	with metrics.timer('transform_seconds', step='location'):
+		sensor_ids, dfs = location_res_to_dfs(loc_response)
+
+	#start date of each sensor: its (location, pollutant) watermark, or the global date_from if it has no data yet
+	sensors_df = dfs[2]
+	sensor_from = {}
+	for sensor_id, pollutant_id in zip(sensors_df['id'].tolist(), sensors_df['pollutant_id'].tolist()):
+		newest = watermarks.get((int(loc_id), pollutant_id))
+		sensor_from[sensor_id] = newest.isoformat() if newest else date_from
+
+	#get column buffers of all sensor aqi data at location at loc_id, then of each failed window exactly as recorded
+	if from_watermarks:
+		columns = multi_aqi_request_to_columns(sensor_ids, loc_id, sensor_from, date_to)
 	else:
-		# list of rows from df, each as a tuple. If any NaNs, converted to None for compat. with SQL
-		values = [tuple(None if pd.isna(x) else x for x in row)\
-			 for row in df.values] 
+		columns = {col: [] for col in AQI_COLS}
+	for sensor_id, window_from, window_to in sensor_windows.get(loc_id, []):
+		window = normalize_timestamps(sensor_columns(sensor_id, loc_id, window_from, window_to))
+		for col in AQI_COLS:
+			columns[col].extend(window[col])
+	with metrics.timer('transform_seconds', step='aqi_frame'):
+		aqi_df = DataFrame(columns, columns=AQI_COLS)
+
+	if aqi_df.empty:	
+		return None
+
+	return dfs, aqi_df
+
+#load stage for one location: insert dimension and aqi dataframes, then commit
+def load_location(loc_id, dfs, aqi_df):
+	#unpack dataframes from dfs
+	locations_df, countries_df, sensors_df, pollutants_df = dfs
+
+	#Prepare tables, column headers and data frames for inserting into sql
+	tables = ['countries', 'pollutants', 'locations', 'sensors', 'aqi']	#table names in SQL 
+	dataframes = [countries_df, pollutants_df, locations_df, sensors_df, aqi_df]	#dataframes in the same order
+
+	# dimension rows already in the db unchanged are redundant. only new or changed rows are kept, so in steady state aqi is the only write
+	dataframes = [df if tablename == 'aqi' else dimension_cache.new_rows(tablename, df) for tablename, df in zip(tables, dataframes)]
+
+	touched_dates.update(aqi_df['datetime'].dt.date.unique())
+
+	#bulk mode: queue rows for the next batched flush instead of writing and committing this location on its own
+	if bulk_loader is not None:
+		for tablename, df in zip(tables, dataframes):
+			bulk_loader.add(tablename, df)
+		return
+
+	lines_commited = 0
+	written = []	#dimension tables and rows whose insert went through, known to the cache once committed
+	for tablename, df in zip(tables, dataframes):	#zip so each table and source dataframe can be associated with eachother. 
+		if df.empty:
+			continue
+		#insert to all 5 tables in db
+		if insert_df_to_db(curs, tablename, df):
+			lines_commited += df.shape[0]
+			written.append((tablename, df))
+		elif tablename != 'aqi':	#not in the db, so the next location with these rows writes them again
+			dimension_cache.discard(tablename)
+
+	#commit changes to sql. (like save)
+	with metrics.timer('commit_seconds', mode='location'):
+		cnx.commit()
+	for tablename, df in written:
+		if tablename != 'aqi':
+			dimension_cache.mark_written(tablename, df)
+	logger.info(f'{lines_commited} lines commited for location {loc_id}')
+
+#helper function for inserting a df to associated table in aqi database. Returns whether the insert went through
+def insert_df_to_db(curs, tablename, df):
+	global total_aqi_inserts  # Add this line to modify the global variable
+
+	#upsert query for this table, and rows as tuples with NaNs converted to None for compat. with SQL
+	query = upsert_query(tablename, df.columns.to_list())
+	values = df_to_rows(df)
 
 	try:	#Try inserting into each table, print error on fail and keep looping
-		curs.executemany(query, values)
+		with metrics.timer('insert_seconds', table=tablename, mode='location'):
+			curs.executemany(query, values)
+		metrics.inc('rows_written_total', len(values), table=tablename)
 		if tablename == 'aqi':	# only count actual measurement values that got inserted
 			locations_success.add(df.loc[0]['location_id'])	# add location id from the first row to set of locations that went through
 			total_aqi_inserts += len(values)
+		return True
 
 	except KeyboardInterrupt:
 		raise()
 
 	except Exception as e:
 		table_exceptions[tablename] += 1	#count exception for tracking
+		metrics.inc('insert_errors_total', table=tablename)
 		logger.warning(f'Table {tablename} insert unsuccessfull: %s', e)
 		logger.warning(df.head())
-		return
+		return False
 
-def sensor_in_db(curs, sensor_id):	# func for checking if sensor already in db table sensors - used for preventing redundant inserts
-	query = 'SELECT id FROM sensors WHERE id = %s'
-	sensor_id = [int(sensor_id)]
-	curs.execute(query, sensor_id)
-	rows = curs.fetchall()
-	# if rows:
-	# 	tqdm.write(f'{sensor_id} found in DB already.')
-	return rows is True		# returns True only if not empty set
+def log_summary():
+	print('='*50, '\n', 'IMPORT COMPLETE\n', f'{total_aqi_inserts} aqi measurements added.',
+	f'{len(locations_success)}/ {len(location_ids)} locations returned data.', '\n')
 
+	logger.info('='*50)
+	logger.info(f'\nETL Summary:')
+	logger.info(f'Date range: sensor watermarks (new sensors from {date_from}) to {date_to}.')
+	logger.info(f'{total_aqi_inserts} aqi measurements added.')
+	logger.info(f'{len(locations_success)}/ {len(location_ids)} locations returned data.')
+	logger.info(f'Table insert exceptions: \n{table_exceptions}')
+	if failed_loads:
+		logger.info(f'{len(failed_loads)} locations failed to load: {sorted(failed_loads)}')
+	logger.info(f'{budget.requests} API requests, {budget.sleep_time:.1f}s spent waiting on the API rate limit.')
+	logger.info(dimension_cache.summary())
+	logger.info(response_cache.summary())
+	logger.info(f'{executor.retries} API retries, {dead_letters.count} requests dead-lettered to {dead_letters.filepath}, '
+		f'{dead_letters.rejected} rejected to {dead_letters.rejected_filepath}.')
+	for line in stage_summary():
+		logger.info(line)
+		print(line)
 
-if __name__ == '__main__':
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description='Load daily aqi data from OpenAQ into the aqi database.')
+	parser.add_argument('-w', '--workers', type=int, default=WORKERS, help='number of locations fetched concurrently')
+	parser.add_argument('-m', '--load-mode', choices=['location', 'bulk', 'infile'], default=LOAD_MODE, help='per-location commits or batched bulk loads')
+	parser.add_argument('--flush-rows', type=int, default=FLUSH_ROWS, help='rows per bulk flush')
+	parser.add_argument('--flush-mb', type=float, default=FLUSH_MB, help='megabytes per bulk flush')
+	parser.add_argument('-q', '--queue-size', type=int, default=QUEUE_SIZE, help='max fetched locations waiting to be loaded')
+	parser.add_argument('--no-snapshot', action='store_true', help='skip the parquet snapshot export at the end of the run')
+	parser.add_argument('--metrics-json', default=METRICS_JSON, help='file for the JSON run summary')
+	parser.add_argument('--prometheus', default=PROM_FILE, help='also write metrics as a Prometheus textfile (node_exporter textfile collector)')
+	parser.add_argument('--cache-mode', choices=['use', 'refresh', 'replay', 'off'], default=response_cache.mode,
+		help='OpenAQ response cache: replay rebuilds from cached responses only, without calling the API')
+	parser.add_argument('--cache-file', default=str(response_cache.filepath), help='OpenAQ response cache file')
+	parser.add_argument('--retry-dead-letters', action='store_true',
+		help='only fetch the locations and sensor windows in the dead-letter file of earlier runs, then drop them from it')
+	parser.add_argument('--profile', nargs='?', const=str(path/'etl.prof'), help='run under cProfile and dump stats to this file (default etl.prof)')
+	return parser.parse_args(argv)
+
+#command line entry point: python ETL.py [options]
+def cli(argv=None):
+	args = parse_args(argv)
+	setup_logging()
+	response_cache.configure(args.cache_file, args.cache_mode)
+
+	run_args = dict(workers=args.workers, queue_size=args.queue_size, load_mode=args.load_mode,
+		flush_rows=args.flush_rows, flush_mb=args.flush_mb, snapshot=not args.no_snapshot)
+	retried = []	#dead-letter entries this run retries
+	if args.retry_dead_letters:
+		retried = dead_letters.read()
+		run_args['locations'] = dead_letters.location_ids(retried)
+		run_args['windows'] = dead_letters.sensor_windows(retried)
+		logger.info(f"Retrying {len(run_args['locations'])} dead-lettered locations and "
+			f"{sum(map(len, run_args['windows'].values()))} sensor windows.")
+
+	from wakepy import keep
 	# prevent screen from sleeping during execution
 	with keep.running():
-		main()
-		print('='*50, '\n', 'IMPORT COMPLETE\n', f'{total_aqi_inserts} aqi measurements added.',
-		f'{len(locations_success)}/ {len(location_ids)} locations returned data.', '\n')
+		if args.profile:
+			profile_main(args.profile, **run_args)
+		else:
+			main(**run_args)
+		log_summary()
+
+		#the retried entries leave the file only once the run went through and loaded without errors. Whatever failed
+		#again was appended after them and stays
+		if retried and not any(table_exceptions.values()) and not failed_loads:
+			dead_letters.drop(len(retried))
+		elif retried:
+			logger.warning(f'Load errors in the retry run, {len(retried)} dead-letter entries kept in {dead_letters.filepath}.')
 
-		logger.info('='*50)
-		logger.info(f'\nETL Summary:')
-		logger.info(f'Date range: {date_from} to {date_to}.')
-		logger.info(f'{total_aqi_inserts} aqi measurements added.')
-		logger.info(f'{len(locations_success)}/ {len(location_ids)} locations returned data.')
-		logger.info(f'Table insert exceptions: \n{table_exceptions}')
+		write_metrics(args.metrics_json, args.prometheus)
+		logger.info(f'Run metrics written to {args.metrics_json}' + (f' and {args.prometheus}' if args.prometheus else ''))
 
+if __name__ == '__main__':
+	cli()
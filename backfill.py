@@ -0,0 +1,186 @@
+"""
+Historical backfill of daily aqi data for any date range.
+The range is split into windows for each sensor, and each (sensor, window) request follows pagination until
+meta.found is exhausted, so multi-year history is not capped at one page. Windows are fetched in parallel by a worker
+pool sharing the rate limit budget in extract_data, and loaded with the bulk loader.
+Every (sensor, window) pair is checkpointed to a state file once its rows are committed, so an interrupted backfill
+rerun with the same arguments resumes where it stopped.
+
+Usage:
+	python backfill.py 2022-01-01 2024-12-31 --window-days 90 --workers 4
+"""
+from connectdb import connect_db
+from extract_data import *
+from loader import BulkLoader
+from dimension_cache import DimensionCache
+from rollup import refresh_daily_rollup, refresh_latest_readings, record_load
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from tqdm import tqdm
+import argparse
+import csv
+import datetime
+import logging
+import os
+
+#establish path to current directory
+path = Path(__file__).parent
+
+logger = logging.getLogger(__name__)
+
+#default list of location ids, same file the daily ETL reads
+LOCATIONS_FILE = path/'static'/'locations list.csv'
+
+#completed (sensor, window) pairs, one per line
+STATE_FILE = path/'backfill_state.txt'
+
+#results per page when following pagination. 1000 is the api maximum
+PAGE_LIMIT = 1000
+
+def read_location_ids(filepath):
+	with open(filepath, mode='r') as f:
+		reader = csv.reader(f)
+		return [loc_id for loc_id in list(reader)[0] if loc_id]
+
+#split [date_from, date_to) into consecutive windows of window_days, as iso date strings
+def date_windows(date_from, date_to, window_days):
+	start = datetime.date.fromisoformat(date_from)
+	end = datetime.date.fromisoformat(date_to)
+	windows = []
+	while start < end:
+		stop = min(start + datetime.timedelta(days=window_days), end)
+		windows.append((start.isoformat(), stop.isoformat()))
+		start = stop
+	return windows
+
+class Checkpoint:
+	"""Append-only record of completed (sensor, window) pairs, loaded on start to skip work already done."""
+	def __init__(self, filepath):
+		self.filepath = Path(filepath)
+		self.completed = set()
+		if self.filepath.exists():
+			self.completed = set(self.filepath.read_text().split('\n')) - {''}
+
+	@staticmethod
+	def key(sensor_id, window):
+		return f'{sensor_id} {window[0]} {window[1]}'
+
+	def done(self, sensor_id, window):
+		return self.key(sensor_id, window) in self.completed
+
+	def mark(self, keys):
+		if not keys:
+			return
+		with self.filepath.open('a') as f:
+			f.writelines(key + '\n' for key in keys)
+			f.flush()
+			os.fsync(f.fileno())
+		self.completed.update(keys)
+
+#fetch every page for one sensor and window, as aqi column buffers. Runs in a worker thread
+def fetch_window(location_id, sensor_id, window):
+	columns = {col: [] for col in AQI_COLS}
+	for res in get_sensor_aqi_pages(sensor_id, window[0], window[1], limit=PAGE_LIMIT):
+		sensor_res_to_columns(res, location_id, columns)
+	return normalize_timestamps(columns)
+
+#fetch every window of every location's sensors and load them through one bulk loader on cnx
+def run(cnx, curs, location_ids, windows, checkpoint, workers):
+	dimension_cache = DimensionCache()
+	dimension_cache.load(curs)
+	loader = BulkLoader(cnx, dimensions=dimension_cache)
+
+	touched_dates = set()	#days with backfilled rows, refreshed in the aqi_daily rollup at the end
+	loaded_locations = set()	#locations with backfilled rows, whose countries' latest readings are refreshed at the end
+
+	#windows whose rows are in the loader but not committed yet. they are checkpointed once a flush commits them
+	uncommitted = []
+	def commit_checkpoints(aqi_errors):
+		#a failed aqi flush leaves its windows unmarked, so a rerun fetches them again
+		if loader.exceptions['aqi'] == aqi_errors:
+			checkpoint.mark(uncommitted)
+		uncommitted.clear()
+
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		#discover sensors of each location, and queue any new dimension rows so aqi rows have their parents
+		work = []
+		responses = pool.map(lambda loc_id: get_location_response(loc_id, to_print=False), location_ids)
+		for loc_id, loc_response in zip(location_ids, responses):
+			if loc_response is None or not loc_response.results:
+				continue
+			sensor_ids, dfs = location_res_to_dfs(loc_response)
+			for tablename, df in zip(['locations', 'countries', 'sensors', 'pollutants'], dfs):
+				loader.add(tablename, dimension_cache.new_rows(tablename, df))
+			work += [(loc_id, sensor_id, window) for sensor_id in sensor_ids for window in windows
+						if not checkpoint.done(sensor_id, window)]
+
+		skipped = len(checkpoint.completed)
+		logger.info(f'{len(work)} (sensor, window) pairs to fetch, {skipped} already completed.')
+
+		futures = {pool.submit(fetch_window, *item): item for item in work}
+		with tqdm(total=len(futures), desc='Backfilling', ncols=100) as pbar:
+			for future in as_completed(futures):
+				loc_id, sensor_id, window = futures[future]
+				pbar.update(1)
+				try:
+					columns = future.result()
+				except Exception as e:	#not checkpointed, so a rerun with the same arguments fetches the window again
+					logger.warning(f'Backfill failed for sensor {sensor_id} {window}: %s', e)
+					dead_letters.add('sensor', e, location_id=loc_id, sensor_id=sensor_id, date_from=window[0], date_to=window[1])
+					continue
+
+				commits, aqi_errors = loader.commits, loader.exceptions['aqi']
+				uncommitted.append(Checkpoint.key(sensor_id, window))
+				touched_dates.update(dt.date() for dt in columns['datetime'])
+				loaded_locations.add(loc_id)
+				loader.add_columns('aqi', AQI_COLS, [columns[col] for col in AQI_COLS])
+				if loader.commits != commits:	#add flushed a full batch, including this window
+					commit_checkpoints(aqi_errors)
+
+	aqi_errors = loader.exceptions['aqi']
+	loader.flush()
+	commit_checkpoints(aqi_errors)
+	refresh_daily_rollup(cnx, touched_dates)
+	refresh_latest_readings(cnx, loaded_locations)
+	record_load(cnx, 'backfill', loader.rows_written['aqi'])
+
+	logger.info(loader.summary())
+	logger.info(dimension_cache.summary())
+	logger.info(f'{budget.sleep_time:.1f}s spent waiting on the API rate limit.')
+	logger.info(response_cache.summary())
+	logger.info(f'{executor.retries} API retries, {dead_letters.count} requests dead-lettered to {dead_letters.filepath}, '
+		f'{dead_letters.rejected} rejected to {dead_letters.rejected_filepath}.')
+	print(loader.summary())
+
+def main(date_from, date_to, window_days=90, workers=4, location_ids=None, state_file=STATE_FILE):
+	location_ids = location_ids or read_location_ids(LOCATIONS_FILE)
+	windows = date_windows(date_from, date_to, window_days)
+	checkpoint = Checkpoint(state_file)
+	logger.info(f'Backfill {date_from} to {date_to}: {len(location_ids)} locations, {len(windows)} windows of {window_days} days.')
+
+	#one pooled connection for the whole backfill, handed back when it ends or fails
+	with connect_db() as (cnx, curs):
+		run(cnx, curs, location_ids, windows, checkpoint, workers)
+
+if __name__ == '__main__':
+	logging.basicConfig(
+				filename=path/'backfill.log',
+				level=logging.INFO,
+				format='%(asctime)s || %(levelname)s: %(message)s',
+				)
+
+	parser = argparse.ArgumentParser(description='Backfill historical daily aqi data for a date range.')
+	parser.add_argument('date_from', help='first day to backfill, YYYY-MM-DD')
+	parser.add_argument('date_to', help='day after the last day to backfill, YYYY-MM-DD')
+	parser.add_argument('--window-days', type=int, default=90, help='days per (sensor, window) request')
+	parser.add_argument('-w', '--workers', type=int, default=4, help='windows fetched concurrently')
+	parser.add_argument('--locations', nargs='+', help='location ids to backfill, defaults to the locations list csv')
+	parser.add_argument('--state', default=STATE_FILE, help='checkpoint file of completed (sensor, window) pairs')
+	parser.add_argument('--cache-mode', choices=['use', 'refresh', 'replay', 'off'], default=response_cache.mode,
+		help='OpenAQ response cache: replay rebuilds from cached responses only, without calling the API')
+	parser.add_argument('--cache-file', default=str(response_cache.filepath), help='OpenAQ response cache file')
+	args = parser.parse_args()
+
+	response_cache.configure(args.cache_file, args.cache_mode)
+
+	main(args.date_from, args.date_to, args.window_days, args.workers, args.locations, args.state)
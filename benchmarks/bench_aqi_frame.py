@@ -0,0 +1,71 @@
+"""
+Benchmark for assembling a location's aqi frame from its sensor responses.
+Compares the old loop, which grew the frame with pd.concat once per sensor, against multi_aqi_request_to_df,
+which appends every sensor to shared column buffers and builds the frame once. The API is replaced by canned
+responses from fake_openaq, so only parsing and assembly are timed.
+
+Usage:
+	python benchmarks/bench_aqi_frame.py --sensors 1 10 50 --days 365
+"""
+import argparse
+import datetime
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from openaq.shared.responses import Headers, MeasurementsResponse
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+import extract_data
+import fake_openaq
+
+#one canned daily measurements response per sensor
+def make_responses(n_sensors, days, location_id=1):
+	first = datetime.date(2024, 1, 1)
+	responses = {}
+	for sensor_id in fake_openaq.sensor_ids_for(location_id, n_sensors):
+		results = [fake_openaq.daily_json(sensor_id, first + datetime.timedelta(days=d)) for d in range(days)]
+		meta = {'name': 'openaq-api', 'website': '/', 'page': 1, 'limit': days, 'found': days}
+		responses[sensor_id] = MeasurementsResponse(Headers(), meta, results)
+	return responses
+
+#assembly as multi_aqi_request_to_df did it before: concat per sensor, full NaN check each iteration
+def concat_loop(sensor_ids, location_id, date_from, date_to):
+	aqi_df = pd.DataFrame(columns=extract_data.AQI_COLS)
+	for sensor_id in sensor_ids:
+		res = extract_data.get_sensor_aqi_resp(sensor_id, date_from, date_to, to_print=False)
+		if res == None or not res.meta.found:
+			continue
+		aqi_df_temp = extract_data.sensor_res_to_df(res, location_id)
+		if aqi_df.empty or aqi_df.isna().all().all():
+			aqi_df = aqi_df_temp
+		else:
+			aqi_df = pd.concat([aqi_df, aqi_df_temp], ignore_index=True)
+	return aqi_df
+
+def best_of(fn, args, repeat):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = fn(*args)
+		times.append(time.perf_counter() - start)
+	return min(times), result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--sensors', type=int, nargs='+', default=[1, 10, 50])
+	parser.add_argument('--days', type=int, default=365)
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	print(f"{'sensors':>8} {'rows':>8} {'concat loop':>12} {'buffers':>10} {'speedup':>8}")
+	for n in args.sensors:
+		responses = make_responses(n, args.days)
+		extract_data.get_sensor_aqi_resp = lambda sensor_id, *a, **k: responses[sensor_id]
+		call = (list(responses), 1, '2024-01-01', '2025-01-01')
+		t_old, old = best_of(concat_loop, call, args.repeat)
+		t_new, new = best_of(extract_data.multi_aqi_request_to_df, call, args.repeat)
+		pd.testing.assert_frame_equal(old.reset_index(drop=True), new, check_dtype=False)
+		print(f'{n:>8} {len(new):>8} {t_old:>11.3f}s {t_new:>9.3f}s {t_old/t_new:>7.1f}x')
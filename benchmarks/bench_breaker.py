@@ -0,0 +1,103 @@
+"""
+Check of the circuit breaker around OpenAQ calls (retry.RequestExecutor). Opens an endpoint's circuit with server
+errors, waits out the cooldown, and ends the trial call with each outcome. The next call after a cooldown must be let
+through again whatever the trial ended in:
+	429            rate limit, not the endpoint: the circuit stays open and the next call is a new trial
+	404, 400, 401  the endpoint answered: the circuit closes
+	500            the endpoint is still down: the circuit opens for another cooldown
+Before the fix a 429 or client error on the trial left the circuit open for the rest of the process.
+No network or database is used. Exits 1 on any failed check, so it can run as a check before merging.
+
+Usage:
+	python benchmarks/bench_breaker.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from openaq import BadRequestError, NotAuthorized, NotFoundError, RateLimit, ServerError
+from retry import CircuitOpenError, RequestExecutor
+
+COOLDOWN = 0.05
+
+class NoBudget:
+	"""Rate budget that never waits."""
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+	def backoff(self, seconds):
+		pass
+
+	def reset_in(self):
+		return 0
+
+def fail(error):
+	def call():
+		raise error
+	return call
+
+def ok():
+	return 'ok'
+
+#executor with one attempt per call and the 'locations' circuit opened by server errors
+def open_circuit():
+	executor = RequestExecutor(NoBudget(), max_attempts=1)
+	breaker = executor.breaker('locations')
+	breaker.threshold, breaker.cooldown = 2, COOLDOWN
+	for _ in range(2):
+		try:
+			executor.call('locations', fail(ServerError('down')))
+		except ServerError:
+			pass
+	return executor, breaker
+
+def outcome(executor, fn):
+	try:
+		executor.call('locations', fn)
+		return 'ok'
+	except Exception as e:
+		return type(e).__name__
+
+#list of failed checks for a trial call ending in error, empty when the breaker behaves. after is what the circuit
+#must do next: 'closed', 'trial' (the next call is let through) or 'open' (calls fail until another cooldown)
+def check_trial(name, error, after):
+	failures = []
+	executor, breaker = open_circuit()
+	if outcome(executor, ok) != 'CircuitOpenError':
+		failures.append(f'{name}: circuit not open after server errors')
+	time.sleep(COOLDOWN * 1.5)
+	outcome(executor, fail(error))	#the trial call
+	if breaker.trial:
+		failures.append(f'{name}: trial still in flight after the call returned')
+	if after == 'closed' and breaker.opened_at is not None:
+		failures.append(f'{name}: circuit not closed by an answer from the endpoint')
+	elif after == 'trial' and breaker.opened_at is None:
+		failures.append(f'{name}: circuit closed without an answer from the endpoint')
+	if after != 'open':
+		if outcome(executor, ok) != 'ok':
+			failures.append(f'{name}: next call not let through')
+	else:
+		if outcome(executor, ok) != 'CircuitOpenError':
+			failures.append(f'{name}: circuit closed before another cooldown')
+		time.sleep(COOLDOWN * 1.5)
+		if outcome(executor, ok) != 'ok':
+			failures.append(f'{name}: no trial call let through after the next cooldown')
+	print(f"{name:<14} {'ok' if not failures else 'FAIL'}")
+	return failures
+
+if __name__ == '__main__':
+	failures = []
+	failures += check_trial('429', RateLimit('rate limited'), after='trial')
+	failures += check_trial('500', ServerError('down'), after='open')
+	failures += check_trial('404', NotFoundError('not found'), after='closed')
+	failures += check_trial('400', BadRequestError('bad request'), after='closed')
+	failures += check_trial('401', NotAuthorized('unauthorized'), after='closed')
+	for failure in failures:
+		print(f'FAIL {failure}')
+	if failures:
+		sys.exit(1)
+	print('Every trial outcome resolves the circuit.')
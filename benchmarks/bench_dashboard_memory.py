@@ -0,0 +1,71 @@
+"""
+Benchmark of dashboard memory per session.
+The old dashboard gave every session its own copy of the full daily frame from st.cache_data, a second copy
+(aqi_df2), the groupby mean and the pivot, all with object country/pollutant strings and float64 values.
+When the ETL has written a Parquet snapshot, the data layer now keeps one compact frame of the rollup (categorical
+codes, float32, sorted DatetimeIndex) shared read-only by every session, and a session only adds its explorer
+selection. Without a snapshot it keeps no frame at all, only query results, so the old numbers are the upper bound
+of the saving. Sizes are from memory_usage(deep=True).
+
+Usage:
+	python benchmarks/bench_dashboard_memory.py --countries 100 --pollutants 8 --days 730 --sessions 1 10
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from dashboard_data import compact, frame_bytes
+
+#rollup frame as the snapshot holds it: one row per day, country and pollutant, with its count of readings
+def make_frame(n_countries, n_pollutants, days):
+	dates = pd.date_range('2024-01-01', periods=days, freq='D')
+	countries = [f'Country {i}' for i in range(n_countries)]
+	pollutants = ['pm25', 'pm10', 'o3', 'co', 'no2', 'so2', 'pm1', 'bc'][:n_pollutants]
+	index = pd.MultiIndex.from_product([dates, countries, pollutants], names=['datetime', 'country', 'pollutant'])
+	df = index.to_frame(index=False)
+	df['country'] = df['country'].astype(object)
+	df['pollutant'] = df['pollutant'].astype(object)
+	df['avg_value'] = np.random.default_rng(0).uniform(0, 100, len(df)).round(2)
+	df['n'] = np.random.default_rng(1).integers(1, 48, len(df))
+	return df
+
+#what one session of the old dashboard held: its cache_data copy, aqi_df2, the groupby mean and the pivot
+def old_session(df):
+	aqi_df = df.drop(columns='n')
+	aqi_df2 = aqi_df.copy()
+	aqi_df2.sort_values(by=['country', 'datetime'], inplace=True)
+	grouped = aqi_df2.groupby(['datetime', 'country', 'pollutant']).mean().reset_index()
+	pivot = grouped.pivot(index=['datetime', 'country'], columns='pollutant', values='avg_value').reset_index()
+	return [aqi_df, aqi_df2, grouped, pivot]
+
+#what one session holds now: its explorer selection, 3 countries and one pollutant over the whole range
+def new_session(shared, countries):
+	return [shared[shared['country'].isin(countries) & (shared['pollutant'] == 'pm25')]]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--countries', type=int, default=100)
+	parser.add_argument('--pollutants', type=int, default=8)
+	parser.add_argument('--days', type=int, default=730)
+	parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10])
+	args = parser.parse_args()
+
+	df = make_frame(args.countries, args.pollutants, args.days)
+	shared = compact(df)
+	selection = ['Country 0', 'Country 1', 'Country 2']
+	old_bytes = frame_bytes(old_session(df))
+	new_bytes = frame_bytes(new_session(shared, selection))
+	shared_bytes = frame_bytes([shared])
+
+	mb = 1024**2
+	print(f'{len(df)} rows. Raw frame {frame_bytes([df])/mb:.1f} MB, compact shared frame {shared_bytes/mb:.1f} MB')
+	print(f'Per session: old {old_bytes/mb:.1f} MB, new {new_bytes/mb:.3f} MB')
+	print(f"{'sessions':>8} {'old':>10} {'new':>10} {'ratio':>8}")
+	for n in args.sessions:
+		old_total = old_bytes * n
+		new_total = shared_bytes + new_bytes * n
+		print(f'{n:>8} {old_total/mb:>8.1f}MB {new_total/mb:>8.1f}MB {old_total/new_total:>7.1f}x')
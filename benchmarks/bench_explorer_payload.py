@@ -0,0 +1,75 @@
+"""
+Benchmark of the AQI Explorer chart payload.
+The old chart sent every daily point of every selected country to px.line as SVG traces, plus six filled
+go.Scatter traces for the PM2.5 bands on every rerun. The chart now gets each country downsampled with LTTB
+(dashboard_data.explorer_series) to about its pixel width, drawn with WebGL traces, and the bands as layout shapes.
+Payload is the figure JSON streamlit sends to the browser. Time is building the figure and serializing it on the
+server; browser paint time is not measured here, it follows the points and the SVG vs WebGL traces shown.
+
+Usage:
+	python benchmarks/bench_explorer_payload.py --countries 5 20 --days 365 3650
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from dashboard_data import EXPLORER_POINTS, compact, downsample
+
+#explorer frame as the data layer caches it: one pm25 value per day per country
+def make_frame(n_countries, days, seed=0):
+	rng = np.random.default_rng(seed)
+	dates = pd.date_range('2015-01-01', periods=days, freq='D')
+	df = pd.DataFrame({
+		'datetime': np.tile(dates, n_countries),
+		'country': np.repeat([f'Country {i}' for i in range(n_countries)], days),
+		'value': rng.gamma(2, 12, n_countries * days).round(2),
+	})
+	return compact(df)
+
+#the chart as plot_aqi_explorer used to build it
+def old_figure(df):
+	mindate, maxdate = df.index.min(), df.index.max()
+	fig = px.line(df, x=df.index, y='value', color='country', range_y=(0, df['value'].max()*1.15))
+	bands = [(0, 12), (12, 35.5), (35.5, 55.5), (55.5, 150.5), (150.5, 250.5), (250.5, 500)]
+	for lower, upper in bands:
+		fig.add_trace(go.Scatter(x=[mindate, maxdate, maxdate, mindate], y=[lower, lower, upper, upper], fill='toself',
+								mode='none', fillcolor='rgba(160, 204, 93, .3)', showlegend=False, hoverinfo='skip'))
+	return fig
+
+def new_figure(df, points):
+	import stream	#imported here, streamlit is only needed for this scenario
+	series = downsample(df, points)
+	fig = px.line(series, x=series.index, y='value', color='country', range_y=(0, df['value'].max()*1.15),
+				render_mode='webgl')
+	fig.update_layout(shapes=stream.PM25_BAND_SHAPES)
+	return fig
+
+def measure(build, df):
+	start = time.perf_counter()
+	payload = build(df).to_json()
+	seconds = time.perf_counter() - start
+	return len(payload), seconds
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--countries', type=int, nargs='+', default=[5, 20])
+	parser.add_argument('--days', type=int, nargs='+', default=[365, 3650])
+	parser.add_argument('--points', type=int, default=EXPLORER_POINTS, help='points per country after downsampling')
+	args = parser.parse_args()
+
+	print(f"{'countries':>9} {'days':>6} {'old points':>11} {'old MB':>8} {'old s':>7} {'new points':>11} {'new MB':>8} {'new s':>7}")
+	for n_countries in args.countries:
+		for days in args.days:
+			df = make_frame(n_countries, days)
+			old_bytes, old_seconds = measure(old_figure, df)
+			new_bytes, new_seconds = measure(lambda df: new_figure(df, args.points), df)
+			new_points = n_countries * min(days, args.points)
+			print(f'{n_countries:>9} {days:>6} {len(df):>11} {old_bytes/1024**2:>8.2f} {old_seconds:>7.3f} '
+				f'{new_points:>11} {new_bytes/1024**2:>8.2f} {new_seconds:>7.3f}')
@@ -0,0 +1,89 @@
+"""
+Import-time budget for the pipeline modules. Each module is imported in a fresh interpreter under
+`python -X importtime`, its cumulative import time is checked against a budget in ms, and the modules it loaded
+against the ones it must not load (the database driver, AWS, streamlit or plotting just to import the ETL).
+Exits 1 on any regression, so it can run as a check before merging.
+Budgets leave about 2x headroom over a laptop run: pandas alone is ~400ms and is imported eagerly by the
+modules that build frames, the light modules stay well under 100ms.
+
+Usage:
+	python benchmarks/bench_import_time.py
+	python benchmarks/bench_import_time.py --modules ETL connectdb --repeat 5
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+#module: budget in ms of its cumulative import time
+BUDGETS = {
+	'metrics': 50,
+	'loader': 50,
+	'rollup': 50,
+	'connectdb': 100,
+	'retry': 100,
+	'response_cache': 100,
+	'dimension_cache': 200,
+	'extract_data': 1000,
+	'ETL': 1000,
+	'backfill': 1200,
+	'snapshot': 1000,
+	'dashboard_data': 1200,
+}
+
+#module: top-level packages it must not load on import, only once a connection or a plot is actually needed
+#pyarrow is only listed for modules without pandas: pandas 2.2 loads it on its own import
+HEAVY = ['mysql', 'boto3', 'botocore', 'streamlit', 'matplotlib', 'plotly', 'wakepy', 'psutil']
+FORBIDDEN = {
+	'metrics': HEAVY + ['pandas', 'pyarrow'],
+	'loader': HEAVY + ['pandas', 'pyarrow'],
+	'connectdb': HEAVY + ['pandas', 'pyarrow'],
+	'retry': HEAVY + ['pandas', 'pyarrow', 'openaq', 'httpx', 'tenacity'],
+	'response_cache': HEAVY + ['pandas', 'pyarrow', 'openaq'],
+	'extract_data': HEAVY + ['openaq'],
+	'ETL': HEAVY + ['openaq'],
+	'backfill': HEAVY + ['openaq'],
+	'snapshot': HEAVY,
+	'dashboard_data': ['boto3', 'botocore', 'matplotlib'],
+}
+
+LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+#{module: cumulative us} of one fresh interpreter importing module
+def import_times(module):
+	env = {**os.environ, 'OPENAQ_API_KEY': os.environ.get('OPENAQ_API_KEY', 'x')}	#extract_data reads it on import
+	proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+						text=True, cwd=ROOT, env=env)
+	if proc.returncode:
+		raise RuntimeError(f'import {module} failed:\n{proc.stderr[-2000:]}')
+	times = {}
+	for line in proc.stderr.split('\n'):
+		match = LINE.match(line)
+		if match:
+			times[match.group(4)] = int(match.group(2))
+	return times
+
+def check(module, budget, repeat):
+	runs = [import_times(module) for _ in range(repeat)]
+	ms = min(run[module] for run in runs) / 1000	#best of repeat, like the other benchmarks
+	loaded = {name.split('.')[0] for name in runs[0]}
+	forbidden = sorted(loaded & set(FORBIDDEN.get(module, [])))
+	ok = ms <= budget and not forbidden
+	print(f"{module:<18} {ms:>8.1f}ms / {budget:>5}ms  {'ok' if ok else 'FAIL'}" + (f"  loads {', '.join(forbidden)}" if forbidden else ''))
+	return ok
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--modules', nargs='+', default=list(BUDGETS), help='modules to check')
+	parser.add_argument('--repeat', type=int, default=3, help='fresh imports per module, the best one is checked')
+	parser.add_argument('--scale', type=float, default=1.0, help='multiply every budget, for slower machines')
+	args = parser.parse_args()
+
+	failed = [m for m in args.modules if not check(m, BUDGETS.get(m, 1000) * args.scale, args.repeat)]
+	if failed:
+		print(f"Import time regressions: {', '.join(failed)}")
+		sys.exit(1)
@@ -0,0 +1,151 @@
+"""
+Benchmark and check of the bulk loader against a local MySQL server, in both of its modes:
+	insert   multi-row INSERT ... ON DUPLICATE KEY UPDATE for every table
+	infile   dimension tables as in insert mode, aqi rows through LOAD DATA LOCAL INFILE ... REPLACE
+Frames come from the ETL's extract path over the in-process fake client (fake_openaq.FakeClient). Each mode loads
+every location into an empty static/schema.sql database, then loads the first location again with changed values.
+Row counts of every table must match the distinct keys loaded, and the second load must update rows in place:
+same counts, new aqi values and country name. Any mismatch exits 1.
+The benchmark database is dropped and recreated. A throwaway server with local_infile on:
+	docker run --rm -d -p 3306:3306 -e MYSQL_ALLOW_EMPTY_PASSWORD=yes mysql:8.0 --local-infile=1
+
+Usage:
+	python benchmarks/bench_loader.py --locations 50 --sensors 4 --days 365
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+import extract_data
+import fake_openaq
+import seed_mysql
+from loader import BulkLoader, TABLE_ORDER, infile_options
+
+SCHEMA_FILE = Path(__file__).parent.parent/'static'/'schema.sql'
+
+#primary key of each table, for the row count a load must end with
+KEYS = {
+	'countries': ['id'],
+	'pollutants': ['id'],
+	'locations': ['id'],
+	'sensors': ['id'],
+	'aqi': ['location_id', 'pollutant_id', 'datetime'],
+}
+
+#{table: frame} for each location, in TABLE_ORDER, as the ETL hands them to the loader
+def make_frames(locations, sensors, days):
+	extract_data.api = fake_openaq.FakeClient(sensors=sensors, cache=True)
+	extract_data.response_cache.configure(mode='off')
+	date_to = (datetime.date(2024, 1, 1) + datetime.timedelta(days=days)).isoformat()
+	frames = []
+	for loc_id in range(1, locations + 1):
+		sensor_ids, dfs = extract_data.location_res_to_dfs(extract_data.api.locations.get(loc_id))
+		aqi_df = extract_data.multi_aqi_request_to_df(sensor_ids, loc_id, '2024-01-01', date_to)
+		locations_df, countries_df, sensors_df, pollutants_df = dfs
+		frames.append(dict(zip(TABLE_ORDER, [countries_df, pollutants_df, locations_df, sensors_df, aqi_df])))
+	return frames
+
+def expected_counts(frames):
+	import pandas as pd
+	return {table: len(pd.concat([f[table] for f in frames]).drop_duplicates(subset=KEYS[table])) for table in TABLE_ORDER}
+
+def table_counts(cnx):
+	curs = cnx.cursor()
+	counts = {}
+	for table in TABLE_ORDER:
+		curs.execute(f'SELECT COUNT(*) FROM `{table}`')
+		counts[table] = curs.fetchone()[0]
+	curs.close()
+	return counts
+
+def empty_tables(cnx):
+	curs = cnx.cursor()
+	curs.execute('SET FOREIGN_KEY_CHECKS = 0')
+	for table in TABLE_ORDER:
+		curs.execute(f'TRUNCATE TABLE `{table}`')
+	curs.execute('SET FOREIGN_KEY_CHECKS = 1')
+	curs.close()
+
+def load(cnx, mode, frames, staging_dir):
+	loader = BulkLoader(cnx, mode=mode, staging_dir=staging_dir)
+	for frame in frames:
+		for table in TABLE_ORDER:
+			loader.add(table, frame[table])
+	loader.flush()
+	return loader
+
+#the first location again, with every aqi value raised by 1 and its country renamed
+def changed_frame(frame):
+	changed = dict(frame)
+	changed['aqi'] = frame['aqi'].assign(value=frame['aqi']['value'] + 1)
+	changed['countries'] = frame['countries'].assign(country_name='Renamed country')
+	return changed
+
+#list of failed checks of one mode, empty when the load counts and upserts are right
+def check_mode(cnx, mode, frames, expected, staging_dir):
+	failures = []
+	empty_tables(cnx)
+	start = time.perf_counter()
+	loader = load(cnx, mode, frames, staging_dir)
+	seconds = time.perf_counter() - start
+	rows = sum(expected.values())
+	print(f'{mode:<8} {rows:>9} rows {seconds:>8.3f}s {rows/seconds:>10.0f} rows/s, {loader.commits} commits')
+
+	if any(loader.exceptions.values()):
+		failures.append(f'{mode}: loader errors {loader.exceptions}')
+	counts = table_counts(cnx)
+	if counts != expected:
+		failures.append(f'{mode}: row counts {counts}, expected {expected}')
+
+	changed = changed_frame(frames[0])
+	load(cnx, mode, [changed], staging_dir)
+	if table_counts(cnx) != expected:
+		failures.append(f'{mode}: upsert changed row counts to {table_counts(cnx)}')
+	row = changed['aqi'].iloc[0]
+	curs = cnx.cursor()
+	curs.execute('SELECT value FROM aqi WHERE location_id = %s AND pollutant_id = %s AND datetime = %s',
+		[int(row['location_id']), int(row['pollutant_id']), row['datetime']])
+	value = curs.fetchone()[0]
+	if abs(value - row['value']) > 1e-3:
+		failures.append(f'{mode}: aqi value {value} after upsert, expected {row["value"]}')
+	curs.execute('SELECT country_name FROM countries WHERE id = %s', [int(changed['countries']['id'][0])])
+	if curs.fetchone()[0] != 'Renamed country':
+		failures.append(f'{mode}: country name not updated by upsert')
+	curs.close()
+	return failures
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--locations', type=int, default=50)
+	parser.add_argument('--sensors', type=int, default=4, help='sensors per location')
+	parser.add_argument('--days', type=int, default=365)
+	parser.add_argument('--modes', nargs='+', default=['insert', 'infile'], choices=['insert', 'infile'])
+	parser.add_argument('--host', default=os.getenv('BENCH_DB_HOST', '127.0.0.1'))
+	parser.add_argument('--port', type=int, default=int(os.getenv('BENCH_DB_PORT', 3306)))
+	parser.add_argument('--user', default=os.getenv('BENCH_DB_USER', 'root'))
+	parser.add_argument('--password', default=os.getenv('BENCH_DB_PASSWORD', ''))
+	parser.add_argument('--database', default='aqi_bench_loader')
+	args = parser.parse_args()
+
+	frames = make_frames(args.locations, args.sensors, args.days)
+	expected = expected_counts(frames)
+	staging_dir = Path(tempfile.mkdtemp(prefix='aqi_bench_infile_'))
+	#the same connection options the ETL uses for infile mode, local files only from the staging directory
+	cnx = seed_mysql.connect(args.host, args.port, args.user, args.password, **infile_options(staging_dir))
+	seed_mysql.create_database(cnx, args.database, SCHEMA_FILE.read_text())
+
+	failures = []
+	for mode in args.modes:
+		failures += check_mode(cnx, mode, frames, expected, staging_dir)
+	cnx.close()
+	for failure in failures:
+		print(f'FAIL {failure}')
+	if failures:
+		sys.exit(1)
+	print('Row counts and upserts match in every mode.')
@@ -0,0 +1,121 @@
+"""
+Benchmark of the query workload before and after migrate.py.
+Seeds a local MySQL database in the pre-migration layout (seed_mysql.py), times every SELECT in static/queries.sql
+plus the dashboard and rollup queries, applies the migration and times them again on the same data.
+The legacy layout has no aqi_daily, latest_readings or etl_loads: the migration creates and fills them, so queries on
+them have no time before it.
+Needs a MySQL server the user can create databases on. The benchmark database is dropped and recreated.
+
+Usage:
+	python benchmarks/bench_queries.py --countries 20 --locations 5 --days 365 --repeat 5 [--partition]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+import migrate
+import seed_mysql
+from dashboard_data import LATEST_PM25_QUERY, LATEST_PM25_ROLLUP_QUERY, AVG_PM25_GDP_QUERY, COUNTRIES_QUERY, EXPLORER_QUERY, in_clause
+from rollup import ROLLUP_QUERY
+
+QUERIES_FILE = Path(__file__).parent.parent/'static'/'queries.sql'
+
+#SELECT statements of queries.sql, named by the comment above each. Maintenance inserts are left out
+def read_workload(filepath=QUERIES_FILE):
+	workload = []
+	for statement in filepath.read_text().split(';'):
+		lines = [line for line in statement.strip().split('\n') if line.strip()]
+		comments = [line.strip('- \t') for line in lines if line.strip().startswith('--')]
+		sql = '\n'.join(line for line in lines if not line.strip().startswith('--'))
+		if sql.lstrip().upper().startswith('SELECT'):
+			workload.append((comments[-1] if comments else sql[:40], sql, []))
+	return workload
+
+#dashboard and ETL queries on top of queries.sql. The explorer looks at 3 countries over 90 days
+def app_workload(start, days):
+	countries = ['United States', 'Country 2', 'Country 3']
+	last = start + datetime.timedelta(days=days - 1)
+	month = start + datetime.timedelta(days=days // 2)
+	return [
+		('dashboard latest pm25, aqi_daily', LATEST_PM25_ROLLUP_QUERY, []),
+		('dashboard latest pm25, latest_readings', LATEST_PM25_QUERY, []),
+		('dashboard countries', COUNTRIES_QUERY, []),
+		('dashboard avg pm25 vs gdp', AVG_PM25_GDP_QUERY, []),
+		('explorer 3 countries, 90 days', in_clause(EXPLORER_QUERY, countries),
+			['pm25'] + countries + [last - datetime.timedelta(days=90), last]),
+		('rollup refresh, one month', ROLLUP_QUERY, [month, month + datetime.timedelta(days=30)]),
+	]
+
+#best time of repeat runs, or None if the query's tables do not exist yet
+def time_query(cnx, sql, params, repeat):
+	curs = cnx.cursor()
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		try:
+			curs.execute(sql, params)
+		except seed_mysql.mysql.connector.errors.ProgrammingError as e:
+			if e.errno != 1146:	#ER_NO_SUCH_TABLE
+				raise
+			curs.close()
+			return None
+		if curs.with_rows:
+			curs.fetchall()
+		else:
+			cnx.commit()
+		times.append(time.perf_counter() - start)
+	curs.close()
+	return min(times)
+
+def run_workload(cnx, workload, repeat):
+	curs = cnx.cursor()
+	for table in ('aqi', 'aqi_daily', 'locations'):
+		curs.execute(f'ANALYZE TABLE `{table}`')
+		curs.fetchall()
+	curs.close()
+	return [time_query(cnx, sql, params, repeat) for _, sql, params in workload]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--host', default=os.getenv('BENCH_DB_HOST', '127.0.0.1'))
+	parser.add_argument('--port', type=int, default=int(os.getenv('BENCH_DB_PORT', 3306)))
+	parser.add_argument('--user', default=os.getenv('BENCH_DB_USER', 'root'))
+	parser.add_argument('--password', default=os.getenv('BENCH_DB_PASSWORD', ''))
+	parser.add_argument('--database', default='aqi_bench')
+	parser.add_argument('--countries', type=int, default=20)
+	parser.add_argument('--locations', type=int, default=5, help='locations per country')
+	parser.add_argument('--pollutants', type=int, default=6, help='pollutants per location')
+	parser.add_argument('--days', type=int, default=365)
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--partition', action='store_true', help='also partition aqi by month in the migration')
+	args = parser.parse_args()
+
+	cnx = seed_mysql.connect(args.host, args.port, args.user, args.password)
+	seed_mysql.create_database(cnx, args.database)
+	start = datetime.date(2024, 1, 1)
+	rows = seed_mysql.seed(cnx, args.countries, args.locations, args.pollutants, args.days, start.isoformat())
+	print(f'{rows} aqi rows seeded.')
+
+	workload = read_workload() + app_workload(start, args.days)
+	before = run_workload(cnx, workload, args.repeat)
+
+	start_migration = time.perf_counter()
+	migrate.main(cnx, partition=args.partition)
+	print(f'Migration took {time.perf_counter() - start_migration:.1f}s.\n')
+	after = run_workload(cnx, workload, args.repeat)
+
+	print(f"{'query':<60} {'before':>9} {'after':>9} {'speedup':>8}")
+	for (name, _, _), t_old, t_new in zip(workload, before, after):
+		if t_old is None:
+			print(f"{name[:60]:<60} {'-':>9} {t_new*1000:>7.1f}ms {'-':>8}")
+		else:
+			print(f'{name[:60]:<60} {t_old*1000:>7.1f}ms {t_new*1000:>7.1f}ms {t_old/t_new:>7.1f}x')
+	#totals over the queries timed on both layouts
+	pairs = [(t_old, t_new) for t_old, t_new in zip(before, after) if t_old is not None]
+	old_total, new_total = sum(t for t, _ in pairs), sum(t for _, t in pairs)
+	print(f"{'total':<60} {old_total*1000:>7.1f}ms {new_total*1000:>7.1f}ms {old_total/new_total:>7.1f}x")
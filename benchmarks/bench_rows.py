@@ -0,0 +1,65 @@
+"""
+Micro-benchmark for the DataFrame-to-row conversion on the insert path.
+Compares the per-cell comprehension insert_df_to_db used to run against loader.df_to_rows, which converts
+each column at once by dtype, and checks both give the same rows.
+
+Usage:
+	python benchmarks/bench_rows.py --rows 100000 200000 500000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from loader import df_to_rows, df_to_columns
+
+#aqi shaped frame: timestamps, int ids, float measurements with some missing sd values
+def make_aqi_df(n, seed=0):
+	rng = np.random.default_rng(seed)
+	sd = rng.uniform(0, 5, n)
+	sd[rng.random(n) < 0.1] = np.nan
+	return pd.DataFrame({
+		'datetime': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, n), unit='D'),
+		'location_id': rng.integers(1, 3_000_000, n),
+		'pollutant_id': rng.integers(1, 20, n),
+		'value': rng.uniform(0, 200, n),
+		'min_val': rng.uniform(0, 50, n),
+		'max_val': rng.uniform(50, 400, n),
+		'sd': sd,
+	})
+
+#conversion as it was in insert_df_to_db
+def comprehension_rows(df):
+	return [tuple(None if pd.isna(x) else x for x in row) for row in df.values]
+
+def best_of(fn, df, repeat):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn(df)
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 300_000])
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	check = make_aqi_df(1000)
+	old, new = comprehension_rows(check), df_to_rows(check)
+	assert [tuple(None if v is None else (v.to_pydatetime() if isinstance(v, pd.Timestamp) else v) for v in row) for row in old] == new, \
+		'df_to_rows does not match the comprehension'
+	assert all(type(v) in (int, float, type(None)) for v in new[0][1:]), 'numpy scalars leaked into rows'
+
+	print(f"{'rows':>10} {'comprehension':>15} {'df_to_rows':>12} {'df_to_columns':>15} {'speedup':>8}")
+	for n in args.rows:
+		df = make_aqi_df(n)
+		t_old = best_of(comprehension_rows, df, args.repeat)
+		t_rows = best_of(df_to_rows, df, args.repeat)
+		t_cols = best_of(df_to_columns, df, args.repeat)
+		print(f'{n:>10} {t_old:>14.3f}s {t_rows:>11.3f}s {t_cols:>14.3f}s {t_old/t_rows:>7.1f}x')
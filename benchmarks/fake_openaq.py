@@ -0,0 +1,227 @@
+"""
+Local stand-in for the OpenAQ v3 API, used to drive the ETL without hitting the real service.
+Serves the two endpoints the ETL calls, with deterministic data derived from the requested ids:
+	/v3/locations/{id}
+	/v3/sensors/{id}/measurements/daily
+Every response carries x-ratelimit-* headers, and requests over the quota get a 429, the same way the real API does.
+FakeClient serves the same data in process, as the response objects the sdk builds, for timing parsing without http.
+
+Usage:
+	python benchmarks/fake_openaq.py --port 8080 --limit 60 --window 60 --latency 0.2
+	OPENAQ_BASE_URL=http://127.0.0.1:8080/v3 python ETL.py --workers 8 --cache-mode off
+"""
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from openaq.shared.responses import Headers, LocationsResponse, MeasurementsResponse
+
+#pollutants handed out to fake sensors: id, name, units, display name
+PARAMETERS = [
+	(1, 'pm10', 'µg/m³', 'PM10'),
+	(2, 'pm25', 'µg/m³', 'PM2.5'),
+	(3, 'o3', 'µg/m³', 'O₃ mass'),
+	(5, 'no2', 'µg/m³', 'NO₂ mass'),
+	(8, 'co', 'ppm', 'CO'),
+	(9, 'so2', 'ppm', 'SO₂'),
+]
+
+SENSORS_PER_LOCATION = 4
+
+#sensor ids are derived from location ids so a sensor request can be traced back to its location
+def sensor_ids_for(loc_id, n=SENSORS_PER_LOCATION):
+	return [loc_id * 100 + i for i in range(n)]
+
+def parameter_for(sensor_id):
+	p_id, name, units, display = PARAMETERS[sensor_id % 100 % len(PARAMETERS)]
+	return {'id': p_id, 'name': name, 'units': units, 'displayName': display}
+
+def datetime_obj(dt):
+	return {'utc': dt.strftime('%Y-%m-%dT%H:%M:%SZ'), 'local': dt.strftime('%Y-%m-%dT%H:%M:%S+00:00')}
+
+def location_json(loc_id, n_sensors=SENSORS_PER_LOCATION):
+	rng = random.Random(loc_id)
+	country_id = loc_id % 50 + 1
+	first = datetime.datetime(2020, 1, 1)
+	return {
+		'id': loc_id,
+		'name': f'Location {loc_id}',
+		'locality': f'City {country_id}',
+		'timezone': 'UTC',
+		'country': {'id': country_id, 'code': f'C{country_id}', 'name': f'Country {country_id}'},
+		'owner': {'id': 1, 'name': 'Fake owner'},
+		'provider': {'id': 1, 'name': 'Fake provider'},
+		'isMobile': False,
+		'isMonitor': True,
+		'instruments': [{'id': 1, 'name': 'Government Monitor'}],
+		'sensors': [{'id': s, 'name': f'sensor {s}', 'parameter': parameter_for(s)} for s in sensor_ids_for(loc_id, n_sensors)],
+		'coordinates': {'latitude': round(rng.uniform(-60, 60), 4), 'longitude': round(rng.uniform(-180, 180), 4)},
+		'bounds': [0, 0, 0, 0],
+		'distance': None,
+		'datetimeFirst': datetime_obj(first),
+		'datetimeLast': datetime_obj(datetime.datetime.now()),
+	}
+
+def daily_json(sensor_id, day):
+	#value is stable per (sensor, day) so repeated runs return identical data
+	rng = random.Random(sensor_id * 100000 + day.toordinal())
+	value = round(rng.uniform(1, 80), 2)
+	period_from, period_to = day, day + datetime.timedelta(days=1)
+	return {
+		'period': {'label': 'raw', 'interval': '24:00:00',
+			'datetimeFrom': datetime_obj(period_from), 'datetimeTo': datetime_obj(period_to)},
+		'value': value,
+		'parameter': parameter_for(sensor_id),
+		'coordinates': None,
+		'summary': {'min': round(value * 0.5, 2), 'q02': None, 'q25': None, 'median': value,
+			'q75': None, 'q98': None, 'max': round(value * 1.6, 2), 'sd': round(value * 0.2, 2)},
+		'coverage': {'expectedCount': 24, 'expectedInterval': '24:00:00', 'observedCount': 24,
+			'observedInterval': '24:00:00', 'percentComplete': 100, 'percentCoverage': 100,
+			'datetimeFrom': datetime_obj(period_from), 'datetimeTo': datetime_obj(period_to)},
+	}
+
+def parse_day(value, default):
+	if not value:
+		return default
+	return datetime.date.fromisoformat(value[:10])
+
+def location_page(loc_id, n_sensors=SENSORS_PER_LOCATION):
+	meta = {'name': 'openaq-api', 'website': '/', 'page': 1, 'limit': 100, 'found': 1}
+	return meta, [location_json(loc_id, n_sensors)]
+
+#one page of daily measurements for a sensor. params as the api takes them: datetime_from, datetime_to, page, limit
+def measurements_page(sensor_id, params):
+	today = datetime.date.today()
+	day_from = parse_day(params.get('datetime_from'), today - datetime.timedelta(days=30))
+	day_to = parse_day(params.get('datetime_to'), today)
+	days = [day_from + datetime.timedelta(days=i) for i in range((day_to - day_from).days)]
+	page, limit = int(params.get('page', 1)), int(params.get('limit', 100))
+	results = [daily_json(sensor_id, d) for d in days[(page - 1) * limit: page * limit]]
+	meta = {'name': 'openaq-api', 'website': '/', 'page': page, 'limit': limit, 'found': len(days)}
+	return meta, results
+
+class RateLimiter:	#fixed window counter, like the real API
+	def __init__(self, limit, window):
+		self.limit, self.window = limit, window
+		self.lock = threading.Lock()
+		self.start = time.monotonic()
+		self.used = 0
+
+	def take(self):	#returns (allowed, used, remaining, reset seconds)
+		with self.lock:
+			now = time.monotonic()
+			if now - self.start >= self.window:
+				self.start, self.used = now, 0
+			reset = max(int(self.start + self.window - now + 0.999), 1)
+			if self.used >= self.limit:
+				return False, self.used, 0, reset
+			self.used += 1
+			return True, self.used, self.limit - self.used, reset
+
+class Handler(BaseHTTPRequestHandler):
+	limiter = None
+	latency = 0.0
+	sensors_per_location = SENSORS_PER_LOCATION
+	requests_served = 0
+	rejected = 0
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		params = {k: v[0] for k, v in parse_qs(url.query).items()}
+		allowed, used, remaining, reset = self.limiter.take()
+		if not allowed:
+			Handler.rejected += 1
+			return self.reply(429, {'message': 'Too many requests'}, used, remaining, reset)
+
+		if self.latency:
+			time.sleep(self.latency)
+
+		loc = re.fullmatch(r'.*/locations/(\d+)', url.path)
+		meas = re.fullmatch(r'.*/sensors/(\d+)/measurements/daily', url.path)
+		if loc:
+			meta, results = location_page(int(loc.group(1)), self.sensors_per_location)
+		elif meas:
+			meta, results = measurements_page(int(meas.group(1)), params)
+		else:
+			return self.reply(404, {'message': 'Not found'}, used, remaining, reset)
+
+		Handler.requests_served += 1
+		self.reply(200, {'meta': meta, 'results': results}, used, remaining, reset)
+
+	def reply(self, status, body, used, remaining, reset):
+		payload = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(payload)))
+		self.send_header('x-ratelimit-limit', str(self.limiter.limit))
+		self.send_header('x-ratelimit-used', str(used))
+		self.send_header('x-ratelimit-remaining', str(remaining))
+		self.send_header('x-ratelimit-reset', str(reset))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def log_message(self, *args):	#keep stdout quiet, one line per request is too much at benchmark volume
+		pass
+
+#headers of in-process responses: a quota that is never reached, so the rate budget never waits
+def unlimited_headers():
+	return Headers(x_ratelimit_limit=10**6, x_ratelimit_remaining=10**6, x_ratelimit_used=1, x_ratelimit_reset=60)
+
+class FakeLocations:
+	def __init__(self, sensors):
+		self.sensors = sensors
+		self.calls = 0
+
+	def get(self, locations_id):
+		self.calls += 1
+		return LocationsResponse(unlimited_headers(), *location_page(int(locations_id), self.sensors))
+
+class FakeMeasurements:
+	def __init__(self, cache=False):
+		self.calls = 0
+		self.cache = {} if cache else None	#(sensor, params) -> response, so repeated runs time parsing and not building
+
+	def list(self, sensors_id, **params):
+		self.calls += 1
+		if self.cache is None:
+			return MeasurementsResponse(unlimited_headers(), *measurements_page(int(sensors_id), params))
+		key = (sensors_id, tuple(sorted(params.items())))
+		if key not in self.cache:
+			self.cache[key] = MeasurementsResponse(unlimited_headers(), *measurements_page(int(sensors_id), params))
+		return self.cache[key]
+
+class FakeClient:
+	"""Drop-in for extract_data.api: locations.get and measurements.list return sdk response objects built in process."""
+	def __init__(self, sensors=SENSORS_PER_LOCATION, cache=False):
+		self.locations = FakeLocations(sensors)
+		self.measurements = FakeMeasurements(cache)
+
+def serve(port=8080, limit=60, window=60, latency=0.0, sensors=SENSORS_PER_LOCATION):
+	Handler.limiter = RateLimiter(limit, window)
+	Handler.latency = latency
+	Handler.sensors_per_location = sensors
+	server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+	server.daemon_threads = True
+	return server
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Fake OpenAQ API for local ETL runs.')
+	parser.add_argument('--port', type=int, default=8080)
+	parser.add_argument('--limit', type=int, default=60, help='requests allowed per window')
+	parser.add_argument('--window', type=int, default=60, help='rate limit window in seconds')
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+	parser.add_argument('--sensors', type=int, default=SENSORS_PER_LOCATION, help='sensors per location')
+	args = parser.parse_args()
+
+	server = serve(args.port, args.limit, args.window, args.latency, args.sensors)
+	print(f'Fake OpenAQ listening on http://127.0.0.1:{args.port}/v3')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		print(f'\n{Handler.requests_served} requests served, {Handler.rejected} rejected with 429.')
@@ -0,0 +1,230 @@
+"""
+Benchmark suite for the pipeline, without OpenAQ or RDS.
+Times each stage on deterministic synthetic data and writes the results as JSON, so throughput and memory can be
+compared run to run:
+	location_res_to_dfs       N location responses from the in-process fake client (fake_openaq.FakeClient)
+	multi_aqi_request_to_df   N locations x M sensors x D days, through the rate budget, pagination and parsing
+	get_latest_pm25           header metrics frame of the dashboard
+	dashboard compact frame   daily frame of N/M/D rolled up by country, as the dashboard caches it
+	insert_df_to_db           dimension and aqi frames of every location into MySQL, one commit per location  [--db]
+	BulkLoader insert/infile  the same frames batched across locations, aqi by multi-row upsert or LOAD DATA  [--db]
+	dashboard queries         latest pm25, pm25 vs gdp, countries and explorer queries on the seeded rollup   [--db]
+MySQL scenarios need a local server (--db) and drop/recreate the benchmark database; they are skipped otherwise.
+Each scenario is timed best of --repeat, then run once more under tracemalloc for its peak Python memory.
+
+Usage:
+	python benchmarks/run_suite.py --locations 50 --sensors 4 --days 365
+	python benchmarks/run_suite.py --db --compare benchmarks/results/suite-20250101-120000.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+import bench_loader
+import extract_data
+import fake_openaq
+import seed_mysql
+from dashboard_data import (LATEST_PM25_QUERY, AVG_PM25_GDP_QUERY, COUNTRIES_QUERY, EXPLORER_QUERY,
+							compact, frame_bytes, get_latest_pm25, in_clause)
+import ETL
+
+RESULTS_DIR = Path(__file__).parent/'results'
+
+SCHEMA_FILE = Path(__file__).parent.parent/'static'/'schema.sql'
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+							cwd=Path(__file__).parent).stdout.strip()
+	except Exception:
+		return None
+
+#best wall time of repeat runs, then one traced run for peak memory. fn returns the number of items it handled
+def measure(name, unit, fn, repeat):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		items = fn()
+		times.append(time.perf_counter() - start)
+	tracemalloc.start()
+	fn()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	seconds = min(times)
+	result = {'name': name, 'unit': unit, 'items': items, 'seconds': round(seconds, 6),
+			'items_per_second': round(items / seconds, 1) if seconds else None, 'peak_mb': round(peak / 1024**2, 3)}
+	print(f"{name:<28} {items:>9} {unit:<10} {seconds:>9.4f}s {result['items_per_second'] or 0:>12.0f}/s {result['peak_mb']:>9.2f}MB")
+	return result
+
+def skipped(name, reason):
+	print(f'{name:<28} skipped: {reason}')
+	return {'name': name, 'skipped': reason}
+
+#the ETL's extract stage for every location, against the in-process client
+def extract_scenarios(args):
+	client = fake_openaq.FakeClient(sensors=args.sensors, cache=True)
+	extract_data.api = client
+	extract_data.response_cache.configure(mode='off')	#time the pipeline, not reads of responses cached by an earlier run
+	location_ids = list(range(1, args.locations + 1))
+	date_to = datetime.date(2024, 1, 1) + datetime.timedelta(days=args.days)
+	date_from, date_to = '2024-01-01', date_to.isoformat()
+
+	responses = [client.locations.get(loc_id) for loc_id in location_ids]
+	def to_dfs():
+		for res in responses:
+			extract_data.location_res_to_dfs(res)
+		return len(responses)
+
+	located = [(loc_id, *extract_data.location_res_to_dfs(res)) for loc_id, res in zip(location_ids, responses)]
+	frames = {}
+	def to_aqi_df():
+		rows = 0
+		for loc_id, sensor_ids, dfs in located:
+			frames[loc_id] = (dfs, extract_data.multi_aqi_request_to_df(sensor_ids, loc_id, date_from, date_to))
+			rows += len(frames[loc_id][1])
+		return rows
+	to_aqi_df()	#warm the response cache, so the timed runs measure the pipeline and not building fake responses
+
+	return [
+		measure('location_res_to_dfs', 'locations', to_dfs, args.repeat),
+		measure('multi_aqi_request_to_df', 'rows', to_aqi_df, args.repeat),
+	], frames
+
+#daily country/pollutant frame as the rollup gives it, from the extracted aqi frames
+def daily_frame(frames):
+	parts = []
+	for dfs, aqi_df in frames.values():
+		countries_df, pollutants_df = dfs[1], dfs[3]
+		df = aqi_df.merge(pollutants_df[['id', 'name']], left_on='pollutant_id', right_on='id')
+		parts.append(df.assign(country=countries_df['country_name'][0], pollutant=df['name']))
+	df = pd.concat(parts, ignore_index=True)
+	return df.groupby(['datetime', 'country', 'pollutant'], as_index=False)['value'].mean().rename(columns={'value': 'avg_value'})
+
+def dashboard_scenarios(args, frames):
+	daily = daily_frame(frames)
+	pm25 = daily[daily['pollutant'] == 'pm25']
+	latest = pm25[pm25['datetime'] >= pm25['datetime'].max() - pd.Timedelta(days=1)].rename(columns={'avg_value': 'pm25'})
+
+	def latest_metrics():
+		get_latest_pm25(latest)
+		return len(latest)
+
+	def compact_frame():
+		compact(daily)
+		return len(daily)
+
+	results = [
+		measure('get_latest_pm25', 'rows', latest_metrics, args.repeat),
+		measure('dashboard compact frame', 'rows', compact_frame, args.repeat),
+	]
+	results[-1]['bytes_before'] = frame_bytes([daily])
+	results[-1]['bytes_after'] = frame_bytes([compact(daily)])
+	return results
+
+def mysql_scenarios(args, frames):
+	staging_dir = Path(tempfile.mkdtemp(prefix='aqi_bench_infile_'))
+	cnx = seed_mysql.connect(args.host, args.port, args.user, args.password, **bench_loader.infile_options(staging_dir))
+	seed_mysql.create_database(cnx, args.database, SCHEMA_FILE.read_text())
+	curs = cnx.cursor()
+	tables = ['countries', 'pollutants', 'locations', 'sensors', 'aqi']
+
+	#ETL.insert_df_to_db itself, now that importing ETL no longer connects to the database. Commit per location
+	def insert_frames():
+		rows = 0
+		for dfs, aqi_df in frames.values():
+			locations_df, countries_df, sensors_df, pollutants_df = dfs
+			for tablename, df in zip(tables, [countries_df, pollutants_df, locations_df, sensors_df, aqi_df]):
+				ETL.insert_df_to_db(curs, tablename, df)
+				rows += len(df)
+			cnx.commit()
+		return rows
+
+	results = [measure('insert_df_to_db', 'rows', insert_frames, args.repeat)]
+
+	#the bulk path of ETL --load-mode bulk/infile. Rows are upserts of the same keys, so repeats rewrite in place
+	bulk_frames = [dict(zip(bench_loader.TABLE_ORDER, [dfs[1], dfs[3], dfs[0], dfs[2], aqi_df])) for dfs, aqi_df in frames.values()]
+	for mode in ('insert', 'infile'):
+		def bulk_load():
+			loader = bench_loader.load(cnx, mode, bulk_frames, staging_dir)
+			return sum(loader.rows_written.values())
+		results.append(measure(f'BulkLoader {mode}', 'rows', bulk_load, args.repeat))
+
+	days = sorted({d.date() for _, aqi_df in frames.values() for d in aqi_df['datetime']})
+	from rollup import refresh_daily_rollup, refresh_latest_readings
+	refresh_daily_rollup(cnx, days)
+	refresh_latest_readings(cnx)
+
+	curs.execute(COUNTRIES_QUERY)
+	countries = [row[0] for row in curs.fetchall()][:3]
+	last = datetime.datetime.combine(days[-1], datetime.time())
+	queries = [
+		('latest pm25 query', LATEST_PM25_QUERY, None),
+		('pm25 vs gdp query', AVG_PM25_GDP_QUERY, None),
+		('countries query', COUNTRIES_QUERY, None),
+		('explorer query', in_clause(EXPLORER_QUERY, countries), ['pm25'] + countries + [(last - datetime.timedelta(days=90)).date(), last.date()]),
+	]
+	for name, query, params in queries:
+		results.append(measure(name, 'rows', lambda: len(pd.read_sql_query(query, cnx, params=params)), args.repeat))
+	curs.close()
+	cnx.close()
+	return results
+
+#ratio of each scenario's time to the same scenario in an earlier result file
+def compare(results, previous_file):
+	previous = {r['name']: r for r in json.loads(Path(previous_file).read_text())['scenarios'] if 'seconds' in r}
+	print(f"\n{'scenario':<28} {'previous':>10} {'now':>10} {'ratio':>7}")
+	for r in results:
+		old = previous.get(r['name'])
+		if old and 'seconds' in r:
+			print(f"{r['name']:<28} {old['seconds']:>9.4f}s {r['seconds']:>9.4f}s {r['seconds']/old['seconds']:>6.2f}x")
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--locations', type=int, default=50, help='N locations')
+	parser.add_argument('--sensors', type=int, default=4, help='M sensors per location')
+	parser.add_argument('--days', type=int, default=365, help='D days of daily measurements')
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--output', help='result file, defaults to benchmarks/results/suite-<time>.json')
+	parser.add_argument('--compare', help='earlier result file to compare against')
+	parser.add_argument('--db', action='store_true', help='also run the MySQL scenarios against a local server')
+	parser.add_argument('--host', default=os.getenv('BENCH_DB_HOST', '127.0.0.1'))
+	parser.add_argument('--port', type=int, default=int(os.getenv('BENCH_DB_PORT', 3306)))
+	parser.add_argument('--user', default=os.getenv('BENCH_DB_USER', 'root'))
+	parser.add_argument('--password', default=os.getenv('BENCH_DB_PASSWORD', ''))
+	parser.add_argument('--database', default='aqi_bench')
+	args = parser.parse_args()
+
+	started = datetime.datetime.now()
+	results, frames = extract_scenarios(args)
+	results += dashboard_scenarios(args, frames)
+	if args.db:
+		results += mysql_scenarios(args, frames)
+	else:
+		results += [skipped(name, 'no --db') for name in ('insert_df_to_db', 'BulkLoader insert/infile', 'dashboard queries')]
+
+	report = {
+		'started_at': started.isoformat(timespec='seconds'),
+		'git_commit': git_commit(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'params': {k: v for k, v in vars(args).items() if k not in ('password', 'output', 'compare')},
+		'scenarios': results,
+	}
+	output = Path(args.output) if args.output else RESULTS_DIR/f'suite-{started:%Y%m%d-%H%M%S}.json'
+	output.parent.mkdir(parents=True, exist_ok=True)
+	output.write_text(json.dumps(report, indent=1))
+	print(f'\nResults written to {output}')
+	if args.compare:
+		compare(results, args.compare)
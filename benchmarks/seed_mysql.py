@@ -0,0 +1,177 @@
+"""
+Seeder for a local MySQL benchmark database: creates the aqi tables and fills them with synthetic daily data for
+N countries x M locations per country x D days, every location with the same set of pollutants.
+Country 1 is 'United States' and pollutant 2 is pm25, the ids static/queries.sql filters on.
+aqi rows are inserted day by day, in the order the daily ETL writes them.
+
+Usage:
+	python benchmarks/seed_mysql.py --database aqi_bench --countries 20 --locations 5 --days 365
+"""
+import argparse
+import datetime
+import os
+import re
+import sys
+from pathlib import Path
+
+import mysql.connector
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from rollup import refresh_daily_rollup, refresh_latest_readings
+
+#layout before migrate.py: surrogate aqi id, UNIQUE key leading with datetime, varchar coordinates, and none of the
+#tables added since (aqi_daily, latest_readings, etl_loads), which the migration creates and fills
+LEGACY_SCHEMA = """
+CREATE TABLE `countries` (
+  `id` smallint unsigned NOT NULL AUTO_INCREMENT,
+  `country_name` varchar(50) DEFAULT NULL,
+  `gdp_per_capita` float DEFAULT NULL,
+  `region` varchar(30) DEFAULT NULL,
+  PRIMARY KEY (`id`)
+)
+
+CREATE TABLE `pollutants` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `name` varchar(30) DEFAULT NULL,
+  `units` varchar(10) DEFAULT NULL,
+  `display_name` varchar(20) DEFAULT NULL,
+  PRIMARY KEY (`id`)
+)
+
+CREATE TABLE `locations` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `latitude` varchar(20) NOT NULL,
+  `longitude` varchar(20) NOT NULL,
+  `country_id` smallint unsigned NOT NULL,
+  `locality` varchar(50) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `country_id` (`country_id`),
+  CONSTRAINT `locations_ibfk_1` FOREIGN KEY (`country_id`) REFERENCES `countries` (`id`)
+)
+
+CREATE TABLE `sensors` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `pollutant_id` int unsigned NOT NULL,
+  `location_id` int unsigned NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `location_id` (`location_id`),
+  KEY `pollutant_id` (`pollutant_id`),
+  CONSTRAINT `sensors_ibfk_2` FOREIGN KEY (`location_id`) REFERENCES `locations` (`id`),
+  CONSTRAINT `sensors_ibfk_3` FOREIGN KEY (`pollutant_id`) REFERENCES `pollutants` (`id`)
+)
+
+CREATE TABLE `aqi` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `datetime` datetime NOT NULL,
+  `location_id` int unsigned NOT NULL,
+  `pollutant_id` int unsigned NOT NULL,
+  `value` float NOT NULL,
+  `min_val` float NOT NULL,
+  `max_val` float NOT NULL,
+  `sd` float DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `datetime` (`datetime`,`location_id`,`pollutant_id`),
+  KEY `aqi_location_index` (`location_id`),
+  KEY `aqi_pollutant_index` (`pollutant_id`),
+  CONSTRAINT `aqi_ibfk_1` FOREIGN KEY (`location_id`) REFERENCES `locations` (`id`),
+  CONSTRAINT `aqi_ibfk_2` FOREIGN KEY (`pollutant_id`) REFERENCES `pollutants` (`id`)
+)
+"""
+
+#(id, name, units, display_name). id 2 is pm25, as in static/queries.sql
+POLLUTANTS = [(1, 'pm10', 'µg/m³', 'PM10'), (2, 'pm25', 'µg/m³', 'PM2.5'), (3, 'o3', 'µg/m³', 'O₃'),
+			(4, 'co', 'µg/m³', 'CO'), (5, 'no2', 'µg/m³', 'NO₂'), (6, 'so2', 'µg/m³', 'SO₂'),
+			(19, 'pm1', 'µg/m³', 'PM1'), (98, 'relativehumidity', '%', 'RH')]
+
+REGIONS = ['Europe', 'Asia', 'Africa', 'Americas', 'Oceania']
+
+#rows per executemany when inserting aqi
+INSERT_ROWS = 5000
+
+#options are passed on to the connector, e.g. loader.infile_options() for the bulk loader's infile mode
+def connect(host, port, user, password, database=None, **options):
+	return mysql.connector.connect(host=host, port=port, user=user, password=password, database=database, **options)
+
+#CREATE TABLE statements of a schema file. The files have no semicolons, statements are split on CREATE TABLE
+def schema_statements(ddl):
+	ddl = '\n'.join(line for line in ddl.split('\n') if not line.strip().startswith('--'))
+	return [s.strip() for s in re.split(r'(?=CREATE TABLE)', ddl) if s.strip()]
+
+#drop and recreate the database with the given layout
+def create_database(cnx, database, ddl=LEGACY_SCHEMA):
+	curs = cnx.cursor()
+	curs.execute(f'DROP DATABASE IF EXISTS `{database}`')
+	curs.execute(f'CREATE DATABASE `{database}`')
+	curs.execute(f'USE `{database}`')
+	curs.execute('SET FOREIGN_KEY_CHECKS = 0')	#schema.sql lists aqi before its parents
+	for statement in schema_statements(ddl):
+		curs.execute(statement)
+	curs.execute('SET FOREIGN_KEY_CHECKS = 1')
+	curs.close()
+
+def seed(cnx, countries=20, locations=5, pollutants=6, days=365, start='2024-01-01', random_seed=0):
+	rng = np.random.default_rng(random_seed)
+	curs = cnx.cursor()
+	country_rows = [(i, 'United States' if i == 1 else f'Country {i}', float(rng.uniform(1000, 80000)), REGIONS[i % len(REGIONS)])
+					for i in range(1, countries + 1)]
+	curs.executemany('INSERT INTO countries (id, country_name, gdp_per_capita, region) VALUES (%s, %s, %s, %s)', country_rows)
+	pollutant_rows = POLLUTANTS[:pollutants]
+	curs.executemany('INSERT INTO pollutants (id, name, units, display_name) VALUES (%s, %s, %s, %s)', pollutant_rows)
+
+	location_rows = []
+	for country_id in range(1, countries + 1):
+		for j in range(locations):
+			location_id = country_id * 1000 + j
+			location_rows.append((location_id, f'{rng.uniform(-90, 90):.6f}', f'{rng.uniform(-180, 180):.6f}', country_id, f'City {location_id}'))
+	curs.executemany('INSERT INTO locations (id, latitude, longitude, country_id, locality) VALUES (%s, %s, %s, %s, %s)', location_rows)
+	sensor_rows = [(location[0] * 100 + p[0], p[0], location[0]) for location in location_rows for p in pollutant_rows]
+	curs.executemany('INSERT INTO sensors (id, pollutant_id, location_id) VALUES (%s, %s, %s)', sensor_rows)
+	cnx.commit()
+
+	first = datetime.date.fromisoformat(start)
+	dates = [first + datetime.timedelta(days=d) for d in range(days)]
+	pairs = [(s[2], s[1]) for s in sensor_rows]
+	query = 'INSERT INTO aqi (datetime, location_id, pollutant_id, value, min_val, max_val, sd) VALUES (%s, %s, %s, %s, %s, %s, %s)'
+	batch = []
+	for day in dates:
+		values = rng.gamma(2.0, 12.0, len(pairs))
+		timestamp = datetime.datetime.combine(day, datetime.time())
+		batch += [(timestamp, loc, pol, float(v), float(v) * 0.5, float(v) * 1.8, float(v) * 0.2) for (loc, pol), v in zip(pairs, values)]
+		if len(batch) >= INSERT_ROWS:
+			curs.executemany(query, batch)
+			cnx.commit()
+			batch = []
+	if batch:
+		curs.executemany(query, batch)
+		cnx.commit()
+	curs.close()
+
+	#the legacy layout has no rollup yet, migrate.py fills it
+	curs = cnx.cursor()
+	curs.execute("SHOW TABLES LIKE 'aqi_daily'")
+	has_rollup = bool(curs.fetchall())
+	curs.close()
+	if has_rollup:
+		refresh_daily_rollup(cnx, dates)
+		refresh_latest_readings(cnx)
+	return len(pairs) * days
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--host', default=os.getenv('BENCH_DB_HOST', '127.0.0.1'))
+	parser.add_argument('--port', type=int, default=int(os.getenv('BENCH_DB_PORT', 3306)))
+	parser.add_argument('--user', default=os.getenv('BENCH_DB_USER', 'root'))
+	parser.add_argument('--password', default=os.getenv('BENCH_DB_PASSWORD', ''))
+	parser.add_argument('--database', default='aqi_bench')
+	parser.add_argument('--schema', help='schema file to create instead of the pre-migration layout, e.g. static/schema.sql')
+	parser.add_argument('--countries', type=int, default=20)
+	parser.add_argument('--locations', type=int, default=5, help='locations per country')
+	parser.add_argument('--pollutants', type=int, default=6, help='pollutants per location')
+	parser.add_argument('--days', type=int, default=365)
+	args = parser.parse_args()
+
+	cnx = connect(args.host, args.port, args.user, args.password)
+	create_database(cnx, args.database, Path(args.schema).read_text() if args.schema else LEGACY_SCHEMA)
+	rows = seed(cnx, args.countries, args.locations, args.pollutants, args.days)
+	print(f'{rows} aqi rows seeded into {args.database}.')
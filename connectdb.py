@@ -1,69 +1,202 @@
-import boto3
-import mysql.connector as sqlconnector
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
-import streamlit as st
 
 #Extract api keys and connection info
 load_dotenv()
 
-if os.getenv("USER") == 'michaelkagan': 	#If run locally
-	DB_HOSTNAME = os.getenv('DB_HOSTNAME')
-	DB_PORT = os.getenv('DB_PORT')
-	DB_REGION = os.getenv('DB_REGION')
-	DB_IAMUSER = os.getenv('DB_IAMUSER')
-	aws_access_key_id = os.getenv('aws_access_key_id')
-	aws_secret_access_key = os.getenv('aws_secret_access_key')
-
-else:
-	DB_HOSTNAME = st.secrets['DB_HOSTNAME']
-	DB_PORT = st.secrets['DB_PORT']
-	DB_REGION = st.secrets['DB_REGION']
-	DB_IAMUSER = st.secrets['DB_IAMUSER']
-	aws_access_key_id = st.secrets['aws_access_key_id']
-	aws_secret_access_key = st.secrets['aws_secret_access_key']
-
-
-def get_token():	#obtain token
-	client = boto3.client(
-		'rds', 
-		aws_access_key_id = aws_access_key_id,
-		aws_secret_access_key = aws_secret_access_key,
-		region_name = DB_REGION
-	)
-
-	TOKEN = client.generate_db_auth_token(DB_HOSTNAME, DB_PORT, DB_IAMUSER, DB_REGION)
-	if not TOKEN:
-		raise Exception('Token request failed!')
-	print(f'Token obtained {str(datetime.now())}... \n')
-	return TOKEN
+#boto3, mysql.connector and streamlit are imported by the functions that use them, so importing this module (e.g. for
+#the ETL, which never needs streamlit) stays cheap and reads no secrets
+CREDENTIALS = ['DB_HOSTNAME', 'DB_PORT', 'DB_REGION', 'DB_IAMUSER', 'aws_access_key_id', 'aws_secret_access_key']
 
-def connect_db():	#establish connection
-	TOKEN = get_token()
-	config = {
-		'host': DB_HOSTNAME,
-		'port': DB_PORT,
-		'user': DB_IAMUSER,
-		'password': TOKEN,
-		'auth_plugin': 'mysql_clear_password'
-		}
-	cnx = sqlconnector.connect(**config)
+_settings = None
 
-		#set cursor to execute commands + queries in mysql server
-	curs = cnx.cursor()
+def settings():	#credentials, read once on first use
+	global _settings
+	if _settings is None:
+		if os.getenv("USER") == 'michaelkagan': 	#If run locally
+			_settings = {key: os.getenv(key) for key in CREDENTIALS}
+			_settings['DB_PASSWORD'] = os.getenv('DB_PASSWORD')
+		else:
+			import streamlit as st
+			_settings = {key: st.secrets[key] for key in CREDENTIALS}
+			_settings['DB_PASSWORD'] = st.secrets.get('DB_PASSWORD')
+	return _settings
 
-	#connect to aqi database
-	curs.execute('USE aqi')
+#database selected on every connection
+DB_NAME = os.getenv('DB_NAME', 'aqi')
 
-        #clear cursor result for future queries
-	curs.fetchall()
+#IAM auth tokens are valid for 15 minutes. refresh a little early so a token is never handed out about to expire
+TOKEN_LIFETIME = 15*60
+TOKEN_REFRESH = TOKEN_LIFETIME - 3*60
 
-	#verify connection
-	if cnx.is_connected():
-		print('DB connection established...')
+#pool size: connections kept open and shared by ETL workers or dashboard sessions
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
+
+#idle connections older than this are pinged before being handed out
+HEALTH_CHECK_AFTER = 60
+
+
+_rds_client = None
+_token = None
+_token_time = 0
+_token_lock = threading.Lock()
+
+def get_token():	#obtain token, cached until shortly before it expires
+	global _rds_client, _token, _token_time
+	with _token_lock:
+		if _token and time.monotonic() - _token_time < TOKEN_REFRESH:
+			return _token
+
+		config = settings()
+		if _rds_client is None:
+			import boto3
+			_rds_client = boto3.client(
+				'rds', 
+				aws_access_key_id = config['aws_access_key_id'],
+				aws_secret_access_key = config['aws_secret_access_key'],
+				region_name = config['DB_REGION']
+			)
+
+		TOKEN = _rds_client.generate_db_auth_token(config['DB_HOSTNAME'], config['DB_PORT'], config['DB_IAMUSER'], config['DB_REGION'])
+		if not TOKEN:
+			raise Exception('Token request failed!')
+		print(f'Token obtained {str(datetime.now())}... \n')
+		_token, _token_time = TOKEN, time.monotonic()
+		return TOKEN
+
+#connection settings. DB_PASSWORD (e.g. a local MySQL stand-in) skips IAM auth. options are added to the settings,
+#e.g. loader.infile_options() for the bulk loader's own connection. Local infile stays off everywhere else
+def db_config(**options):
+	credentials = settings()
+	config = {
+		'host': credentials['DB_HOSTNAME'],
+		'port': credentials['DB_PORT'],
+		'user': credentials['DB_IAMUSER'],
+		'database': DB_NAME,	#connect straight into the aqi db, no USE round trip
+		**options
+		}
+	if credentials['DB_PASSWORD']:
+		config['password'] = credentials['DB_PASSWORD']
 	else:
+		config['password'] = get_token()
+		config['auth_plugin'] = 'mysql_clear_password'
+	return config
+
+def new_connection(**options):
+	import mysql.connector as sqlconnector
+	cnx = sqlconnector.connect(**db_config(**options))
+	#verify connection
+	if not cnx.is_connected():
 		raise Exception('DB connection failed')
+	return cnx
+
+class ConnectionPool:
+	"""
+	Bounded pool of open connections with the aqi database selected. Connections are checked out with
+	`with pool.connection() as cnx:` and handed back afterwards. Idle connections are pinged before reuse, and a
+	dead one is replaced by a fresh connection with a current token, so callers never see a stale connection.
+	"""
+	def __init__(self, size=POOL_SIZE, prewarm=1):
+		self.size = size
+		self.idle = queue.LifoQueue()	#(connection, time returned). LIFO keeps the warmest connections in use
+		self.lock = threading.Lock()
+		self.opened = 0
+		for _ in range(min(prewarm, size)):
+			self._reserve()
+			self.idle.put((self._open(), time.monotonic()))
+
+	def _reserve(self):	#claim a slot for a new connection. False when the pool is full
+		with self.lock:
+			if self.opened >= self.size:
+				return False
+			self.opened += 1
+			return True
+
+	def _open(self):	#open a connection in a slot claimed by _reserve. the slot is given back if the connect fails
+		try:
+			return new_connection()
+		except Exception:
+			with self.lock:
+				self.opened -= 1
+			raise
+
+	def _discard(self, cnx):
+		with self.lock:
+			self.opened -= 1
+		try:
+			cnx.close()
+		except Exception:
+			pass
+
+	def _healthy(self, cnx, idle_since):
+		if time.monotonic() - idle_since < HEALTH_CHECK_AFTER:
+			return True
+		try:
+			cnx.ping(reconnect=False)
+			return True
+		except Exception:
+			return False
+
+	def acquire(self, timeout=None):	#take a connection. blocks when all connections are in use
+		while True:
+			try:
+				cnx, idle_since = self.idle.get_nowait()
+			except queue.Empty:
+				if self._reserve():
+					return self._open()
+				cnx, idle_since = self.idle.get(timeout=timeout)
+
+			if self._healthy(cnx, idle_since):
+				return cnx
+			self._discard(cnx)	#stale connection (e.g. server timeout), replace with a fresh one
 
+	def release(self, cnx):	#give a connection back. any open transaction is rolled back first
+		try:
+			if cnx.in_transaction:
+				cnx.rollback()
+			self.idle.put((cnx, time.monotonic()))
+		except Exception:
+			self._discard(cnx)
 
-	return cnx, curs	#returns cnx and curs, with cursor already "in" aqi db
\ No newline at end of file
+	@contextmanager
+	def connection(self):
+		from mysql.connector.errors import OperationalError
+		cnx = self.acquire()
+		try:
+			yield cnx
+		except OperationalError:	#connection lost mid use, don't hand it out again
+			self._discard(cnx)
+			cnx = None
+			raise
+		finally:
+			if cnx is not None:
+				self.release(cnx)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():	#process wide pool, created on first use and shared by ETL workers and dashboard reruns
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = ConnectionPool()
+		return _pool
+
+@contextmanager
+def connect_db():	#establish connection
+	#check out a pooled connection for a with block: `with connect_db() as (cnx, curs):`. It goes back to the pool
+	#when the block ends, also when it raises
+	with get_pool().connection() as cnx:
+		#set cursor to execute commands + queries in mysql server
+		curs = cnx.cursor()
+
+		print('DB connection established...')
+		try:
+			yield cnx, curs	#cnx and curs, with cursor already "in" aqi db
+		finally:
+			curs.close()
\ No newline at end of file
@@ -0,0 +1,499 @@
+"""
+Data layer of the dashboard, shared by every session. Results are cached until the ETL records a new load: it adds a
+row to etl_loads after each one (rollup.record_load), so a rerun costs one MAX(id) query at most every VERSION_TTL
+seconds.
+If the ETL has written a local Parquet snapshot (snapshot.py), the dashboard starts from it without touching MySQL:
+the header metrics come from its latest_readings, the country list, GDP chart and AQI Explorer are computed from the
+aggregated rollup frame, memory-mapped from the snapshot, and labelled from its countries and pollutants tables.
+Once the version moves, the header is the latest_readings query again, as without a snapshot. The first version
+check comes VERSION_TTL seconds later, and when the load version moved only the aqi_daily rows updated since the
+frame's watermark are fetched and merged in. If the database cannot be reached the frame is served as it is.
+Without a snapshot, by default, no frame is held: every result is a query on aqi_daily, run on a pooled connection
+only when it is needed, so the first paint only queries latest_readings and the GDP chart. The limitation is that a
+load version bump re-runs the aggregate queries (GDP chart, country list) and drops cached explorer selections,
+instead of fetching only the new rows. DASHBOARD_FRAME=1 builds the frame from aqi_daily on the first version check
+instead, and then keeps it current with delta queries as with a snapshot, at the cost of reading the whole rollup
+on the first paint and holding it in memory.
+Without a frame, the AQI Explorer pushes its country, pollutant and date predicates down to parameterized queries,
+run only once a selection exists. With one it filters the frame. Results are kept in an LRU cache keyed on the
+selection. The chart gets each
+country's series downsampled with LTTB to about the chart's pixel width, so a narrower slider range is a new query
+that plots at full resolution once it fits.
+Reference tables are read once per load version and indexed for lookups, so labels of a rerun need no query of their own.
+"""
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from snapshot import (SNAPSHOT_DIR, REFERENCE_QUERIES, read_latest_snapshot, read_manifest, read_reference_snapshot,
+    read_rollup_snapshot)
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks of the etl_loads version. Override with DASHBOARD_VERSION_TTL env variable
+VERSION_TTL = int(os.getenv('DASHBOARD_VERSION_TTL', 60))
+
+# build the frame from aqi_daily when there is no snapshot (see the module docstring). Override with DASHBOARD_FRAME=1
+BUILD_FRAME = os.getenv('DASHBOARD_FRAME', '0') == '1'
+
+# rows of a (datetime, country, pollutant) are replaced when the rollup rewrites that day
+AQI_KEY = ['datetime', 'country', 'pollutant']
+
+# daily country averages and their reading counts from the aqi_daily rollup, updated_at >= watermark. updated_at is
+# kept for the next watermark
+DELTA_QUERY = """
+    SELECT CAST(aqi_daily.date AS DATETIME) AS datetime, countries.country_name AS country, pollutants.name AS pollutant,
+        ROUND(avg_value, 2) AS avg_value, n, aqi_daily.updated_at
+    FROM aqi_daily
+    JOIN countries ON countries.id = aqi_daily.country_id
+    JOIN pollutants on aqi_daily.pollutant_id = pollutants.id
+    WHERE aqi_daily.updated_at >= %s
+        """
+
+VERSION_QUERY = 'SELECT MAX(id) FROM etl_loads'
+
+# explorer results kept per (countries, pollutant, range). Override with DASHBOARD_EXPLORER_CACHE env variable
+EXPLORER_CACHE_SIZE = int(os.getenv('DASHBOARD_EXPLORER_CACHE', 64))
+
+# points per country sent to the explorer chart, about its width in pixels. Override with DASHBOARD_EXPLORER_POINTS env variable
+EXPLORER_POINTS = int(os.getenv('DASHBOARD_EXPLORER_POINTS', 1000))
+
+# pm25 of every country whose newest pm25 day is one of the latest two, from latest_readings (one row per country
+# and pollutant, kept by the ETL). All the first paint needs for the header metrics, whatever the history size
+LATEST_PM25_QUERY = """
+    SELECT CAST(latest_readings.date AS DATETIME) AS datetime, countries.country_name AS country, ROUND(value, 2) AS pm25
+    FROM latest_readings
+    JOIN countries ON countries.id = latest_readings.country_id
+    JOIN pollutants on latest_readings.pollutant_id = pollutants.id
+    WHERE pollutants.name = 'pm25'
+    AND latest_readings.date >= (
+        SELECT MAX(latest_readings.date) - INTERVAL 1 DAY
+        FROM latest_readings
+        JOIN pollutants on latest_readings.pollutant_id = pollutants.id
+        WHERE pollutants.name = 'pm25')
+        """
+
+# the same from aqi_daily, for databases where latest_readings is missing or not filled yet (python migrate.py)
+LATEST_PM25_ROLLUP_QUERY = """
+    SELECT CAST(aqi_daily.date AS DATETIME) AS datetime, countries.country_name AS country, ROUND(avg_value, 2) AS pm25
+    FROM aqi_daily
+    JOIN countries ON countries.id = aqi_daily.country_id
+    JOIN pollutants on aqi_daily.pollutant_id = pollutants.id
+    WHERE pollutants.name = 'pm25'
+    AND avg_value >= 0
+    AND aqi_daily.date >= (
+        SELECT MAX(aqi_daily.date) - INTERVAL 1 DAY
+        FROM aqi_daily
+        JOIN pollutants on aqi_daily.pollutant_id = pollutants.id
+        WHERE pollutants.name = 'pm25')
+        """
+
+# average of daily country averages, weighted by readings per day. Days averaging 300 or more are left out as outliers
+AVG_PM25_GDP_QUERY = """
+    SELECT countries.country_name AS country, pollutants.name AS pollutant, ROUND(SUM(avg_value * n) / SUM(n),2) AS 'avg_pm25', gdp_per_capita, region
+    FROM aqi_daily
+    JOIN countries ON countries.id = aqi_daily.country_id
+    JOIN pollutants on aqi_daily.pollutant_id = pollutants.id
+    WHERE pollutants.name = 'pm25'
+    AND avg_value < 300
+    GROUP BY country
+    HAVING avg_pm25 >0
+    ORDER BY country;
+        """
+
+COUNTRIES_QUERY = """
+    SELECT DISTINCT countries.country_name AS country
+    FROM aqi_daily
+    JOIN countries ON countries.id = aqi_daily.country_id
+    ORDER BY country
+        """
+
+# explorer queries. {countries} is replaced by one placeholder per selected country
+POLLUTANTS_QUERY = """
+    SELECT DISTINCT pollutants.name AS pollutant
+    FROM aqi_daily
+    JOIN countries ON countries.id = aqi_daily.country_id
+    JOIN pollutants on aqi_daily.pollutant_id = pollutants.id
+    WHERE countries.country_name IN ({countries})
+    ORDER BY pollutant
+        """
+
+DATE_BOUNDS_QUERY = """
+    SELECT CAST(MIN(aqi_daily.date) AS DATETIME) AS mindate, CAST(MAX(aqi_daily.date) AS DATETIME) AS maxdate
+    FROM aqi_daily
+    JOIN countries ON countries.id = aqi_daily.country_id
+    JOIN pollutants on aqi_daily.pollutant_id = pollutants.id
+    WHERE pollutants.name = %s
+    AND countries.country_name IN ({countries})
+        """
+
+EXPLORER_QUERY = """
+    SELECT CAST(aqi_daily.date AS DATETIME) AS datetime, countries.country_name AS country, ROUND(avg_value, 2) AS value
+    FROM aqi_daily
+    JOIN countries ON countries.id = aqi_daily.country_id
+    JOIN pollutants on aqi_daily.pollutant_id = pollutants.id
+    WHERE pollutants.name = %s
+    AND countries.country_name IN ({countries})
+    AND aqi_daily.date BETWEEN %s AND %s
+    AND avg_value >= 0
+    ORDER BY country, datetime
+        """
+
+# reference tables (snapshot.REFERENCE_QUERIES), small and only written by the ETL, and the column each is indexed on
+# for lookups. Names are not unique in pollutants (OpenAQ has no2, co, o3 and so2 in both ppm and µg/m³), the lowest
+# id is kept per name
+REFERENCE_INDEX = {'pollutants': 'name', 'countries': 'country'}
+
+# rollup columns the frame is loaded with from the snapshot
+SNAPSHOT_COLUMNS = ['datetime', 'country', 'pollutant', 'avg_value', 'n', 'updated_at']
+
+# categorical country/pollutant codes, float32 values and a sorted DatetimeIndex. Cached frames are built once and
+# shared by every session, so they are read-only: callers select or assign into new frames, never modify in place
+def compact(df):
+    df = df.astype({col: 'category' for col in ('country', 'pollutant') if col in df.columns})
+    df = df.astype({col: 'float32' for col in df.columns if df[col].dtype == 'float64'})
+    return df.set_index('datetime').sort_index(kind='stable')
+
+# bytes held by frames, counting the strings behind object columns
+def frame_bytes(frames):
+    return sum(int(df.memory_usage(deep=True).sum()) for df in frames if df is not None)
+
+# latest pm25 row for each country, sorted low to high. If fewer than 6 countries reported on the latest day, the day before is included
+def get_latest_pm25(latest_df):
+    maxdate = latest_df.datetime.max()
+    aqi_df_latest_pm25 = latest_df[latest_df.datetime == maxdate]
+
+    if len(aqi_df_latest_pm25) < 6:
+        aqi_df_latest_pm25 = latest_df
+    
+    return maxdate, aqi_df_latest_pm25[['country', 'pm25']].sort_values(by='pm25')
+
+# positions of the points Largest-Triangle-Three-Buckets keeps to draw y over x with threshold points: the first and
+# last, and from each bucket between them the point making the largest triangle with the previous kept point and the
+# next bucket's average. Peaks and dips survive, unlike with every n-th point or bucket means
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)    # threshold - 2 buckets between first and last point
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        following = slice(end, edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        avg_x, avg_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+# explorer frame with every country's series cut to at most points rows by lttb. Countries shorter than that are kept whole
+def downsample(df, points):
+    parts = []
+    for _, group in df.groupby('country', observed=True, sort=False):
+        x = group.index.asi8.astype('float64')
+        parts.append(group.iloc[lttb(x, group['value'].to_numpy('float64'), points)])
+    return pd.concat(parts) if parts else df
+
+def in_clause(query, countries):
+    return query.format(countries=', '.join(['%s'] * len(countries)))
+
+# pooled connection as a context manager. connectdb and the mysql driver are only imported once a query is needed,
+# a cold start served from the snapshot never loads them
+def pooled_connection():
+    from connectdb import get_pool
+    return get_pool().connection()
+
+# reference table indexed on its REFERENCE_INDEX column, keeping the first row of each value
+def index_reference(table, df):
+    index = REFERENCE_INDEX[table]
+    duplicated = df[index].duplicated()
+    if duplicated.any():
+        logger.info(f'{table} rows sharing a {index}, the first one is used: {sorted(set(df.loc[duplicated, index]))}')
+    return df[~duplicated].set_index(index)
+
+# the results below are computed from the rollup frame (datetime index, country, pollutant, avg_value, n) with the
+# same columns as their queries return
+
+# LATEST_PM25_QUERY, from the latest readings of the snapshot (datetime, country, pollutant, value)
+def snapshot_latest_pm25(latest):
+    pm25 = latest[latest['pollutant'] == 'pm25']
+    if not pm25.empty:
+        pm25 = pm25[pm25['datetime'] >= pm25['datetime'].max() - pd.Timedelta(days=1)]
+    return pd.DataFrame({'datetime': pm25['datetime'].to_numpy(), 'country': pm25['country'].to_numpy(),
+                        'pm25': pm25['value'].astype('float64').to_numpy()})
+
+# AVG_PM25_GDP_QUERY, with gdp_per_capita and region from the countries reference
+def frame_pm25_gdp(frame, countries):
+    pm25 = frame[(frame['pollutant'] == 'pm25') & (frame['avg_value'] < 300)]
+    sums = pd.DataFrame({'country': pm25['country'].astype(str).to_numpy(),
+                        'weighted': pm25['avg_value'].astype('float64').to_numpy() * pm25['n'].to_numpy(),
+                        'n': pm25['n'].to_numpy()}).groupby('country').sum()
+    avg_pm25 = (sums['weighted'] / sums['n']).round(2).rename('avg_pm25')
+    df = avg_pm25[avg_pm25 > 0].to_frame().join(countries[['gdp_per_capita', 'region']], how='inner')
+    return df.rename_axis('country').reset_index().assign(pollutant='pm25')[
+        ['country', 'pollutant', 'avg_pm25', 'gdp_per_capita', 'region']]
+
+# COUNTRIES_QUERY
+def frame_countries(frame):
+    return pd.DataFrame({'country': sorted(frame['country'].unique().tolist())})
+
+# POLLUTANTS_QUERY
+def frame_pollutants(frame, countries):
+    return pd.DataFrame({'pollutant': sorted(frame.loc[frame['country'].isin(countries), 'pollutant'].unique().tolist())})
+
+# DATE_BOUNDS_QUERY
+def frame_date_bounds(frame, countries, pollutant):
+    dates = frame.index[(frame['pollutant'] == pollutant) & frame['country'].isin(countries)]
+    return pd.DataFrame({'mindate': [dates.min()], 'maxdate': [dates.max()]})
+
+# EXPLORER_QUERY, compacted. The frame's index is sorted, so the date range is a slice
+def frame_explorer(frame, countries, pollutant, date_from, date_to):
+    rows = frame.loc[pd.Timestamp(date_from):pd.Timestamp(date_to)]
+    rows = rows[(rows['pollutant'] == pollutant) & rows['country'].isin(countries) & (rows['avg_value'] >= 0)]
+    df = pd.DataFrame({'datetime': rows.index, 'country': rows['country'].astype(str).to_numpy(),
+                        'value': rows['avg_value'].to_numpy()})
+    return compact(df.sort_values(['country', 'datetime'], kind='stable'))
+
+class DashboardData:
+    """
+    Shared by every session of the dashboard (held with st.cache_resource). Opens its own pooled connections, through
+    connect, only when a query is needed. Starts from the snapshot frame when there is one, or with build_frame builds it
+    from aqi_daily (see the module docstring), then serves results from the frame, kept current with delta queries, or
+    else from queries on aqi_daily. Results are
+    cached until the next load version. Explorer results (pollutants, date_bounds, explorer, explorer_series) go through
+    an LRU cache of explorer_size selections, emptied with the other results when the version moves.
+    """
+    def __init__(self, ttl=VERSION_TTL, snapshot_dir=SNAPSHOT_DIR, connect=pooled_connection, build_frame=BUILD_FRAME):
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir
+        self.connect = connect      # () -> context manager of a database connection
+        self.build_frame = build_frame
+        self.lock = threading.Lock()
+        self.frame = None           # rollup: datetime, country, pollutant, avg_value, n. one row per key
+        self.watermark = None       # newest updated_at seen in aqi_daily
+        self.version = None         # MAX(id) of etl_loads at the last refresh
+        self.checked_at = None      # monotonic time of the last version check
+        self.snapshot_read = False  # the snapshot is only looked for once
+        self.results = {}           # query -> frame, valid for the current version
+        self.delta_rows = 0         # rows fetched by delta queries, for logging
+        self.explorer_cache = OrderedDict()     # selection key -> result, least recently used first
+        self.explorer_size = EXPLORER_CACHE_SIZE
+        self.explorer_hits = 0
+        self.explorer_misses = 0
+
+    # query result on a connection of its own. Caller holds the lock
+    def _read(self, query, params=None):
+        with self.connect() as cnx:
+            return pd.read_sql_query(query, cnx, params=params)
+
+    # current load version, or None if etl_loads is missing. The ttl then decides alone when to look for new rows
+    def _load_version(self, cnx):
+        try:
+            curs = cnx.cursor()
+            curs.execute(VERSION_QUERY)
+            version = curs.fetchone()[0]
+            curs.close()
+            return version
+        except Exception as e:
+            logger.warning('Could not read load version: %s', e)
+            return None
+
+    # read the version once per ttl. When it moved, cached results are dropped and the frame, if there is one,
+    # fetches its new rows. With build_frame and no snapshot, the first check loads the whole frame. Other calls serve the cache as it is. The first call looks for the snapshot, which
+    # counts as the first check: its manifest carries the version it was exported at
+    def _update(self):
+        if not self.snapshot_read:
+            self.snapshot_read = True
+            self._load_snapshot()
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.ttl:
+            return
+        first_check = self.checked_at is None
+        self.checked_at = now
+        try:
+            with self.connect() as cnx:
+                version = self._load_version(cnx)
+                if not first_check and version is not None and version == self.version:
+                    return
+                if self.version is not None or version is not None:
+                    logger.info(f'Dashboard load version {self.version} -> {version}.')
+                if self.frame is not None or self.build_frame:
+                    self._fetch_delta(cnx)
+        except Exception as e:
+            if self.frame is None:
+                raise
+            # the version stays where it was, so the next check fetches the delta again
+            logger.warning('Could not refresh the dashboard frame, serving it as it is: %s', e)
+            return
+
+        # results derived from the old data are stale once the version moves
+        self.results = {}
+        self.explorer_cache.clear()
+        self.version = version
+
+    # start the frame, watermark, version and reference tables from the local snapshot, if there is one
+    def _load_snapshot(self):
+        try:
+            manifest = read_manifest(self.snapshot_dir)
+            if manifest is None:
+                return
+            df = read_rollup_snapshot(self.snapshot_dir, columns=SNAPSHOT_COLUMNS)
+            references = {table: read_reference_snapshot(self.snapshot_dir, table) for table in REFERENCE_INDEX}
+            latest = read_latest_snapshot(self.snapshot_dir)
+        except Exception as e:    #a broken snapshot only costs the queries it was meant to save
+            logger.warning('Could not read dashboard snapshot: %s', e)
+            return
+        if df is None or df.empty:
+            return
+        self.watermark = df.pop('updated_at').max()
+        self.frame = compact(df)
+        self.version = manifest.get('version')
+        self.checked_at = time.monotonic()
+        for table, reference in references.items():
+            if reference is not None:
+                self.results[('reference', table)] = index_reference(table, reference)
+        if latest is not None and not latest.empty:    #the header until the version moves, then latest_readings is queried
+            self.results['latest_pm25'] = snapshot_latest_pm25(latest)
+        logger.info(f'Dashboard frame loaded from snapshot: {len(df)} rows up to {self.watermark}, load version {self.version}.')
+
+    # merge aqi_daily rows updated since the watermark into the frame. Without a frame yet, the whole rollup is read
+    def _fetch_delta(self, cnx):
+        watermark = self.watermark if self.watermark is not None else pd.Timestamp(0)
+        # >= so rows written in the same second as the watermark are not missed. they are deduplicated on merge
+        delta = pd.read_sql_query(DELTA_QUERY, cnx, params=[watermark.to_pydatetime()])
+        if delta.empty:
+            if self.frame is None:
+                self.frame = compact(delta.drop(columns='updated_at'))
+            return
+        self.watermark = delta.pop('updated_at').max()
+        self.delta_rows += len(delta)
+        if self.frame is not None and not self.frame.empty:
+            #categories of the two frames differ, so merge on plain columns and compact the result once
+            delta = pd.concat([self.frame.reset_index(), delta], ignore_index=True)\
+                .drop_duplicates(subset=AQI_KEY, keep='last', ignore_index=True)
+        self.frame = compact(delta)
+        logger.info(f'Dashboard frame refreshed: {self.delta_rows} rows fetched, {len(self.frame)} total, '
+                    f'{self.memory_usage()/1024**2:.1f} MB cached.')
+
+    # bytes of every cached frame. They are shared, so this is the whole dashboard, not a per session cost
+    def memory_usage(self):
+        return frame_bytes([self.frame, *self.results.values(), *self.explorer_cache.values()])
+
+    # cached result of key, or build() stored until the next load version. Caller holds the lock
+    def _result(self, key, build):
+        if key not in self.results:
+            self.results[key] = build()
+        return self.results[key]
+
+    # result of any other dashboard query, cached until the next load version
+    def query(self, query):
+        with self.lock:
+            self._update()
+            return self._result(query, lambda: self._read(query))
+
+    # one reference table indexed for lookups, one row per index value, read once per load version. Caller holds the lock
+    def _reference(self, table):
+        return self._result(('reference', table), lambda: index_reference(table, self._read(REFERENCE_QUERIES[table])))
+
+    # one reference table indexed for lookups, shared and read-only
+    def reference(self, table):
+        with self.lock:
+            self._update()
+            return self._reference(table)
+
+    # axis label of a pollutant, its display name and units
+    def pollutant_label(self, pollutant):
+        display_name, units = self.reference('pollutants').loc[pollutant, ['display_name', 'units']]
+        return f'{display_name} ({units})'
+
+    # latest pm25 per country, for the header metrics. From the snapshot's latest readings until the version moves
+    def latest_pm25(self):
+        with self.lock:
+            self._update()
+            if 'latest_pm25' in self.results:
+                return self.results['latest_pm25']
+        try:
+            latest = self.query(LATEST_PM25_QUERY)
+            if not latest.empty:
+                return latest
+        except Exception as e:
+            logger.warning('Could not read latest_readings, falling back to aqi_daily: %s', e)
+        return self.query(LATEST_PM25_ROLLUP_QUERY)
+
+    # average pm25 per country with its gdp per capita and region, for the GDP chart
+    def pm25_gdp(self):
+        with self.lock:
+            self._update()
+            if self.frame is not None:
+                return self._result('pm25_gdp', lambda: frame_pm25_gdp(self.frame, self._reference('countries')))
+            return self._result(AVG_PM25_GDP_QUERY, lambda: self._read(AVG_PM25_GDP_QUERY))
+
+    # countries with any data, for the explorer selection
+    def countries(self):
+        with self.lock:
+            self._update()
+            if self.frame is not None:
+                result = self._result('countries', lambda: frame_countries(self.frame))
+            else:
+                result = self._result(COUNTRIES_QUERY, lambda: self._read(COUNTRIES_QUERY))
+            return result['country'].tolist()
+
+    # cached result of key, or build() stored as the most recently used one. Caller holds the lock
+    def _lru(self, key, build):
+        if key in self.explorer_cache:
+            self.explorer_hits += 1
+            self.explorer_cache.move_to_end(key)
+            return self.explorer_cache[key]
+        self.explorer_misses += 1
+        result = build()
+        self.explorer_cache[key] = result
+        while len(self.explorer_cache) > self.explorer_size:
+            self.explorer_cache.popitem(last=False)
+        return result
+
+    # run a query with params through the LRU cache, or from_frame(frame) when the frame is loaded. key identifies
+    # the selection, independent of its order. transform, if given, is applied once to a query result before it is cached
+    def _explorer_query(self, key, query, params, from_frame, transform=None):
+        def build():
+            if self.frame is not None:
+                return from_frame(self.frame)
+            result = self._read(query, params)
+            return transform(result) if transform is not None else result
+        with self.lock:
+            self._update()
+            return self._lru(key, build)
+
+    # pollutants measured in any of the selected countries
+    def pollutants(self, countries):
+        countries = sorted(countries)
+        result = self._explorer_query(('pollutants', tuple(countries)), in_clause(POLLUTANTS_QUERY, countries), countries,
+                                        lambda frame: frame_pollutants(frame, countries))
+        return result['pollutant'].tolist()
+
+    # first and last day with data for the selection, as python datetimes
+    def date_bounds(self, countries, pollutant):
+        countries = sorted(countries)
+        result = self._explorer_query(('bounds', tuple(countries), pollutant), in_clause(DATE_BOUNDS_QUERY, countries),
+                                        [pollutant] + countries, lambda frame: frame_date_bounds(frame, countries, pollutant))
+        return result['mindate'][0].to_pydatetime(), result['maxdate'][0].to_pydatetime()
+
+    # daily values of one pollutant for the selected countries between two dates (inclusive). Compact and read-only
+    def explorer(self, countries, pollutant, date_from, date_to):
+        countries = sorted(countries)
+        date_from, date_to = date_from.date(), date_to.date()
+        return self._explorer_query(('explorer', tuple(countries), pollutant, date_from, date_to),
+                                        in_clause(EXPLORER_QUERY, countries), [pollutant] + countries + [date_from, date_to],
+                                        lambda frame: frame_explorer(frame, countries, pollutant, date_from, date_to),
+                                        transform=compact)
+
+    # explorer() downsampled for the chart, points per country. Cached next to the full result, which the raw data table shows
+    def explorer_series(self, countries, pollutant, date_from, date_to, points=EXPLORER_POINTS):
+        df = self.explorer(countries, pollutant, date_from, date_to)
+        key = ('series', tuple(sorted(countries)), pollutant, date_from.date(), date_to.date(), points)
+        with self.lock:
+            return self._lru(key, lambda: downsample(df, points))
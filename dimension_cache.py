@@ -0,0 +1,96 @@
+"""
+In-memory cache of the dimension tables (countries, pollutants, locations, sensors).
+Loaded once at ETL start, so dimension rows are only upserted when they are new or changed, and the aqi fact rows
+are the only per-location write in steady state. Rows handed out for writing are pending until the loader reports
+their transaction committed (mark_written), and only then known: later locations that share a country or pollutant
+skip them while they are pending or written, and write them again if the insert failed (discard).
+"""
+from decimal import Decimal
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#columns the ETL writes for each dimension table, in the same order as the dataframes from location_res_to_dfs
+DIMENSION_COLUMNS = {
+	'countries': ['id', 'country_name'],
+	'pollutants': ['id', 'name', 'units', 'display_name'],
+	'locations': ['id', 'latitude', 'longitude', 'country_id', 'locality'],
+	'sensors': ['id', 'pollutant_id', 'location_id'],
+}
+
+#compare values as strings: ids come back as python ints from the db but numpy ints from the dataframes.
+#latitude/longitude come back as DECIMAL(9,6) (varchar before migrate.py) but from the api as floats, so fractional
+#numbers are compared at the 6 decimal places the db keeps
+def normalize(row):
+	return tuple(None if v is None or v != v else format_value(v) for v in row)
+
+def format_value(v):
+	if isinstance(v, (float, Decimal, np.floating)):
+		return f'{float(v):.6f}'
+	if isinstance(v, str) and '.' in v:	#coordinates still stored as varchar
+		try:
+			return f'{float(v):.6f}'
+		except ValueError:
+			pass
+	return str(v)
+
+class DimensionCache:
+	def __init__(self):
+		self.rows = {table: {} for table in DIMENSION_COLUMNS}	#table -> {id: normalized row}, committed in the db
+		self.pending = {table: {} for table in DIMENSION_COLUMNS}	#table -> {id: normalized row}, queued but not committed
+		self.hits = {table: 0 for table in DIMENSION_COLUMNS}	#rows skipped, already in db unchanged
+		self.misses = {table: 0 for table in DIMENSION_COLUMNS}	#rows new to the db
+		self.changed = {table: 0 for table in DIMENSION_COLUMNS}	#rows in db with different values
+
+	#read every existing dimension row in one query per table
+	def load(self, curs):
+		for table, columns in DIMENSION_COLUMNS.items():
+			head = ', '.join(f'`{col}`' for col in columns)
+			try:
+				curs.execute(f'SELECT {head} FROM `{table}`')
+				self.rows[table] = {row[0]: row for row in map(normalize, curs.fetchall())}
+			except Exception as e:	#without the cache every row is treated as new, which is the old behaviour
+				logger.warning(f'Could not load {table} into dimension cache: %s', e)
+		logger.info('Dimension cache loaded: ' + ', '.join(f'{len(rows)} {table}' for table, rows in self.rows.items()))
+
+	#return only the rows of df that are new or changed, and hold them as pending until their write committed
+	def new_rows(self, table, df):
+		cached_rows, pending = self.rows[table], self.pending[table]
+		keep = []
+		for i, row in enumerate(df[DIMENSION_COLUMNS[table]].itertuples(index=False, name=None)):
+			row = normalize(row)
+			cached = cached_rows.get(row[0])
+			if cached == row or pending.get(row[0]) == row:
+				self.hits[table] += 1
+				continue
+			if cached is None:
+				self.misses[table] += 1
+			else:
+				self.changed[table] += 1
+			pending[row[0]] = row
+			keep.append(i)
+		return df.iloc[keep]
+
+	#record rows as in the db, once the transaction that wrote them committed. names and columns are column buffers
+	#(one list of values per column) as the bulk loader holds them
+	def mark_columns(self, table, names, columns):
+		if table not in self.rows or not columns:
+			return
+		index = [names.index(col) for col in DIMENSION_COLUMNS[table]]
+		for row in zip(*(columns[i] for i in index)):
+			row = normalize(row)
+			self.rows[table][row[0]] = row
+			self.pending[table].pop(row[0], None)
+
+	def mark_written(self, table, df):
+		self.mark_columns(table, df.columns.to_list(), [df[col].tolist() for col in df.columns])
+
+	#forget the pending rows of a table whose write failed, so the next location that has them writes them again
+	def discard(self, table):
+		if table in self.pending:
+			self.pending[table] = {}
+
+	def summary(self):
+		return 'Dimension cache: ' + ', '.join(
+			f'{table} {self.hits[table]} hits/{self.misses[table]} new/{self.changed[table]} changed' for table in DIMENSION_COLUMNS)
@@ -7,15 +7,21 @@ Send a request, save the data as a pandas df, then insert it into database.
 #TODO: consider openaq-quality-checks library for quality control of data
 
 #Import dependencies
-import os, sys, requests, json, csv, requests
+import os
 import time
 import datetime
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openaq import OpenAQ, RateLimit as RateLimitError
 from pandas import DataFrame
 import pandas as pd
-fromiso = datetime.datetime.fromisoformat
 from tqdm import tqdm
+from metrics import metrics
+from response_cache import ResponseCache, cache_key, measurement_ttl, LOCATION_TTL
+from retry import RequestExecutor, DeadLetters
+
+logger = logging.getLogger(__name__)
 
 #Extract api keys and connection info
 load_dotenv()
@@ -27,34 +33,153 @@ DB_PORT = os.getenv('DB_PORT')
 DB_REGION = os.getenv('DB_REGION')
 DB_IAMUSER = os.getenv('DB_IAMUSER')
 
-# init client (automatically pulls KEY from env)
-api = OpenAQ()
-
-# check rate limit and sleep if required
+#optional base url, used to point the client at a local fake server (benchmarks/fake_openaq.py)
+OPENAQ_BASE_URL = os.getenv('OPENAQ_BASE_URL')
+
+# OpenAQ client, built by get_api() on the first request so importing this module sends nothing and skips the sdk
+# import. Benchmarks and tests assign a fake here
+api = None
+
+def get_api():
+	global api
+	if api is None:
+		from openaq import OpenAQ
+		# init client (automatically pulls KEY from env)
+		api = OpenAQ(base_url=OPENAQ_BASE_URL) if OPENAQ_BASE_URL else OpenAQ()
+	return api
+
+#sdk response object from a cached body. Cached responses carry no rate limit headers
+def cached_response(endpoint, body):
+	from openaq.shared.responses import Headers, LocationsResponse, MeasurementsResponse
+	response_class = LocationsResponse if endpoint == 'locations' else MeasurementsResponse
+	return response_class(Headers(), body['meta'], body['results'])
+
+class RateBudget:
+	"""
+	Token bucket shared by every thread that calls the API. Each request takes a token before it is sent,
+	and the x_ratelimit_remaining/x_ratelimit_reset headers of each response refill the bucket, so any number
+	of workers together stay inside the quota instead of each one finding the limit with a 429.
+	"""
+	def __init__(self, tokens=1, reset=1):	#starts with one probe request, the first response tells us the real quota
+		self.cond = threading.Condition()
+		self.tokens = tokens	#requests we may still send in this window
+		self.limit = tokens		#size of the window, updated from x_ratelimit_limit
+		self.reset_at = time.monotonic() + reset
+		self.in_flight = 0		#requests sent but not yet answered
+		self.used = 0			#x_ratelimit_used of the newest response seen
+		self.sleep_time = 0.0	#total seconds callers spent waiting on the budget
+		self.requests = 0		#total requests sent
+
+	def acquire(self):
+		with self.cond:
+			waited = 0.0
+			while self.tokens <= 0:
+				wait = self.reset_at - time.monotonic()
+				if wait <= 0:	#window rolled over, refill to the last known limit
+					self.tokens = self.limit
+					break
+				start = time.monotonic()
+				self.cond.wait(wait)
+				waited += time.monotonic() - start
+			self.sleep_time += waited
+			self.tokens -= 1
+			self.in_flight += 1
+			self.requests += 1
+		if waited:
+			metrics.observe('rate_limit_wait_seconds', waited)
+
+	def release(self):
+		with self.cond:
+			self.in_flight -= 1
+			self.cond.notify_all()
+
+	def update(self, headers):	#refill from response headers. headers default to 0 if the server did not send them
+		if not headers.x_ratelimit_limit:
+			return
+		with self.cond:
+			# responses can arrive out of order. only trust headers at least as new as the last ones seen,
+			# a lower used count means the server started a new window
+			if headers.x_ratelimit_used < self.used and self.used - headers.x_ratelimit_used < self.limit // 2:
+				return
+			self.used = headers.x_ratelimit_used
+			self.limit = headers.x_ratelimit_limit
+			# requests still in flight were sent against the same quota but are not counted by the server yet
+			self.tokens = max(headers.x_ratelimit_remaining - self.in_flight, 0)
+			self.reset_at = time.monotonic() + headers.x_ratelimit_reset
+			self.cond.notify_all()
+
+	def backoff(self, seconds):	#empty the bucket so every worker waits, used after a 429
+		with self.cond:
+			self.tokens = 0
+			self.reset_at = max(self.reset_at, time.monotonic() + seconds)
+
+	def reset_in(self):	#seconds until the current quota window resets, from the newest headers seen
+		with self.cond:
+			return max(self.reset_at - time.monotonic(), 0)
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *exc):
+		self.release()
+
+#one budget per process, shared by all fetch workers
+budget = RateBudget()
+
+#every API call goes through one executor: retries with backoff on the shared budget, and a circuit breaker per endpoint.
+#requests that fail after every retry are written to the dead-letter file, see ETL.py --retry-dead-letters
+executor = RequestExecutor(budget)
+dead_letters = DeadLetters()
+
+#on-disk response cache shared by all fetch workers. Set up by the --cache flags of ETL.py and backfill.py,
+#or the OPENAQ_CACHE_* env variables
+response_cache = ResponseCache()
+
+#sensor requests of a location run on their own pool, not the ETL's location workers, so a location waiting on its
+#sensors never waits for a slot it holds itself. The rate budget bounds requests in flight across both
+SENSOR_WORKERS = int(os.getenv('OPENAQ_SENSOR_WORKERS', 4))
+sensor_pool = None
+sensor_pool_lock = threading.Lock()
+
+def get_sensor_pool():
+	global sensor_pool
+	with sensor_pool_lock:
+		if sensor_pool is None:
+			sensor_pool = ThreadPoolExecutor(max_workers=SENSOR_WORKERS, thread_name_prefix='sensor')
+	return sensor_pool
+
+# check rate limit. Waiting is left to the shared budget
 def check_rate_limit(response, to_print=True):
 		if to_print:
 			print(f'{response.headers.x_ratelimit_used} call(s) placed') 
-			#catch/limit rate limiting
+		#refill shared budget from headers. the next acquire() waits until reset if the quota is used up
+		budget.update(response.headers)
 		if response.headers.x_ratelimit_remaining == 0: 
-			tqdm.write(f'\nRate limit reached. Sleeping {response.headers.x_ratelimit_reset} seconds...') 
-			rest = response.headers.x_ratelimit_reset 
-			time.sleep(rest)
+			tqdm.write(f'\nRate limit reached. Requests wait {response.headers.x_ratelimit_reset} seconds for the quota to reset...') 
 
 #Get location info from location endpoint - taking location id as argument
 def get_location_response(loc_id, to_print=True):
+	#a cached response has no rate limit headers, and takes no token from the budget
+	key = cache_key('locations', loc_id)
+	cached = response_cache.get('locations', key)
+	if cached is not None:
+		return cached_response('locations', cached)
+	if response_cache.mode == 'replay':	#cache only, nothing is fetched
+		return None
+
 	try:
-		loc_response = api.locations.get(loc_id)
+		loc_response = executor.call('locations', get_api().locations.get, loc_id)
+	except Exception as e:	#failed after every retry, or the endpoint's circuit is open
+		logger.warning(f'Location {loc_id} request failed: {type(e).__name__} {e}')
+		dead_letters.add('location', e, location_id=loc_id)
+		return None
 
-		#pass loc response to check rate limit + sleep if nec.
-		check_rate_limit(loc_response, to_print)
-		return loc_response
-	except RateLimitError:	#exception object from OpenAQ sdk
-		time.sleep(30)
+	#pass loc response to check rate limit + sleep if nec.
+	check_rate_limit(loc_response, to_print)
+	response_cache.put('locations', key, loc_response, ttl=LOCATION_TTL)
+	return loc_response
 
-		#Call get_loc recursively with the same loc_id. This is only safe if the exception is rate limit, so it won't be inf. loop.
-		return get_location_response(loc_id, to_print)
-	except:
-		return None
 def location_res_to_dfs(loc_response):
 	res = loc_response.results[0]
 
@@ -110,92 +235,150 @@ def get_sensor_aqi_resp(sensor_id, date_from, date_to, to_print=True, limit=365,
 		'datetime_from': date_from,
 		'datetime_to': date_to,
 		'limit': limit,
+		'page': page,
 		'rollup': 'daily'	# aggregates measurements as daily avgs
 	}
 
-	# Define response as None before attempting to make a request
-	response = None
-	try:
-		# send get request
-		response = api.measurements.list(sensor_id, **params)
-		
-		# check rate limit + sleep if nec.
-		check_rate_limit(response, to_print)
-
-	# catch exception only if rate limit. otherwise, will raise
-	except RateLimitError:
-		# sleep 30s to back off the request rate limit
-		time.sleep(30)
-
-		# recurs. call func again with same request. Only works if issue is rate limit.
-		return get_sensor_aqi_resp(sensor_id, date_from, date_to, limit=limit, page=page)
-	
-	except TypeError as e:
-		raise Exception(e)
-	
-	# returns None if request failed, handled downstream
-	return response	
-
-
-def sensor_res_to_df(response, location_id):	#select desired data to retain from entire json object. json object may contain mulitple days of sensor data for each sensor
-	results = response.results
-	found = len(response.results)
-
-	#define datetime format string for aqi table
-	fmt_str = '%Y-%m-%d %T'
-
-	# extract timestamps, with exception hanlding
-	try: 	# check result timestamp format for iso compatibility
-		timestamps = [fromiso(result.period.datetime_to.local).strftime(fmt_str)\
-		for result in results]
-	except ValueError:	#only take first 10 chars (date - no time)
-		timestamps = [fromiso(result.period.datetime_to.local[:10]).strftime(fmt_str)\
-		for result in results]
-		
-	#extract all dates from each result entry in results json object
-	data = {
-		'datetime': timestamps,
-		'location_id': [location_id] * len(results),
-		'pollutant_id': [result.parameter.id for result in results],
-		'value': [result.value for result in results],
-		'min_val': [result.summary.min for result in results],
-		'max_val': [result.summary.max for result in results],
-		'sd': [result.summary.sd for result in results]
-	}
-
-	df = DataFrame(data, index=range(found))
-	df = df[df['value']>=0]
+	key = cache_key('measurements', sensor_id, params)
+	cached = response_cache.get('measurements', key)
+	if cached is not None:
+		return cached_response('measurements', cached)
+	if response_cache.mode == 'replay':
+		return None
 
-	return df
+	#raises once every retry failed, the caller decides whether the sensor or the whole location is lost
+	response = executor.call('measurements', get_api().measurements.list, sensor_id, **params)
+
+	# check rate limit + sleep if nec.
+	check_rate_limit(response, to_print)
+	#windows that ended before today are final and kept for good, open ones expire
+	response_cache.put('measurements', key, response, ttl=measurement_ttl(params))
+	return response
+
+#meta.found is an int, or a string like '>1000' when the api did not count every match. None if unknown
+def found_count(found):
+	if isinstance(found, str):
+		return int(found) if found.isdigit() else None
+	return found
+
+#cached responses of every window of a sensor that overlaps [date_from, date_to], oldest first. Replay takes the
+#windows earlier runs fetched, which rarely match this run's watermark and date exactly. Rows outside the range
+#are upserts of rows already loaded
+def replay_sensor_pages(sensor_id, date_from, date_to):
+	date_from, date_to = str(date_from)[:10], str(date_to)[:10]
+	windows = response_cache.responses('measurements', sensor_id)
+	windows.sort(key=lambda window: (window[0].get('datetime_from', ''), int(window[0].get('page', 1))))
+	for params, body in windows:
+		if params.get('datetime_to', '9999')[:10] >= date_from and params.get('datetime_from', '')[:10] <= date_to:
+			yield cached_response('measurements', body)
+
+#follow pagination for one sensor and date range until meta.found is exhausted. yields one response per page
+def get_sensor_aqi_pages(sensor_id, date_from, date_to, to_print=False, limit=1000):
+	if response_cache.mode == 'replay':
+		yield from replay_sensor_pages(sensor_id, date_from, date_to)
+		return
+	page = 1
+	while True:
+		res = get_sensor_aqi_resp(sensor_id, date_from, date_to, to_print=to_print, limit=limit, page=page)
+		if res is None or not res.results:
+			return
+		yield res
+
+		found = found_count(res.meta.found)
+		#a short page is the last one, whether or not the api reported a total
+		if len(res.results) < limit or (found is not None and page * limit >= found):
+			return
+		page += 1
+
+
+#columns of the aqi table, in insert order
+AQI_COLS = ['datetime', 'location_id', 'pollutant_id', 'value', 'min_val', 'max_val', 'sd']
+
+#select desired data to retain from entire json object. json object may contain mulitple days of sensor data for each sensor.
+#results are appended to columns, a dict of lists (one per aqi column), so many sensors can share one set of buffers
+def sensor_res_to_columns(response, location_id, columns=None):
+	if columns is None:
+		columns = {col: [] for col in AQI_COLS}
+	#negative values are sensor errors, drop them
+	results = [result for result in response.results if result.value is not None and result.value >= 0]
+
+	#extract all dates from each result entry in results json object. timestamps stay raw iso strings here and are
+	#parsed for all sensors at once by parse_timestamps
+	columns['datetime'].extend(result.period.datetime_to.local for result in results)
+	columns['location_id'].extend([location_id] * len(results))
+	columns['pollutant_id'].extend(result.parameter.id for result in results)
+	columns['value'].extend(result.value for result in results)
+	columns['min_val'].extend(result.summary.min for result in results)
+	columns['max_val'].extend(result.summary.max for result in results)
+	columns['sd'].extend(result.summary.sd for result in results)
+
+	return columns
+
+#parse a column of iso timestamps at once. The local wall time (first 19 chars) is kept and the utc offset dropped,
+#as fromisoformat(...).strftime() did. Elements that fail fall back to their date part on their own, instead of
+#the whole batch being reparsed. Returns a datetime64 Series, NaT where neither form parses
+def parse_timestamps(local):
+	local = pd.Series(local, dtype=object)
+	parsed = pd.to_datetime(local.str.slice(0, 19), format='ISO8601', errors='coerce')
+	failed = parsed.isna()
+	if failed.any():	#only take first 10 chars (date - no time)
+		parsed[failed] = pd.to_datetime(local[failed].str.slice(0, 10), format='ISO8601', errors='coerce')
+	return parsed
+
+#replace raw timestamps in column buffers with python datetimes, which the connector binds without string formatting.
+#rows whose timestamp cannot be parsed are dropped, datetime is NOT NULL in aqi
+def normalize_timestamps(columns):
+	parsed = parse_timestamps(columns['datetime'])
+	valid = parsed.notna().to_numpy()
+	if not valid.all():
+		columns = {col: [v for v, ok in zip(values, valid) if ok] for col, values in columns.items()}
+		parsed = parsed[valid]
+	columns['datetime'] = parsed.to_numpy(dtype='datetime64[us]').astype(object).tolist()
+	return columns
+
+def sensor_res_to_df(response, location_id):
+	return DataFrame(normalize_timestamps(sensor_res_to_columns(response, location_id)), columns=AQI_COLS)
+
+#every page of one sensor as column buffers. A failed sensor is logged and dead-lettered, the pages it did get are kept
+def sensor_columns(sensor_id, location_id, date_from, date_to):
+	columns = {col: [] for col in AQI_COLS}
+	try:
+		for res in get_sensor_aqi_pages(sensor_id, date_from, date_to):
+			#extract desired data from json object
+			with metrics.timer('transform_seconds', step='aqi_columns'):
+				sensor_res_to_columns(res, location_id, columns)
+	except Exception as e:	#one failed sensor does not cost the rest of the location
+		logger.warning(f'Sensor {sensor_id} at location {location_id} failed: {type(e).__name__} {e}')
+		dead_letters.add('sensor', e, location_id=location_id, sensor_id=sensor_id, date_from=date_from, date_to=date_to)
+	return columns
+
+#get aqi data of every sensor at a location as column buffers (dict of lists). Sensors are fetched in parallel on
+#the sensor pool and their buffers appended in sensor order, so assembly stays linear in the number of results.
+#Rows can be streamed from here without a DataFrame.
+#date_from is one date for every sensor, or a dict of {sensor_id: date} when each sensor has its own watermark.
+#pages are followed, so a sensor far behind gets its whole gap and not just the first page
+def multi_aqi_request_to_columns(sensor_ids, location_id, date_from, date_to):
+	columns = {col: [] for col in AQI_COLS}
+
+	def fetch(sensor_id):
+		sensor_from = date_from[sensor_id] if isinstance(date_from, dict) else date_from
+		return sensor_columns(sensor_id, location_id, sensor_from, date_to)
+
+	if len(sensor_ids) > 1 and SENSOR_WORKERS > 1:
+		results = get_sensor_pool().map(fetch, sensor_ids)
+	else:
+		results = map(fetch, sensor_ids)
+	for result in results:
+		for col in AQI_COLS:
+			columns[col].extend(result[col])
+
+	with metrics.timer('transform_seconds', step='timestamps'):
+		return normalize_timestamps(columns)
 
 # Establish client connection with OpenAQ - air quality API
 # def multi_aqi_request_to_df(sensor_ids: list[str], location_id: str, date_from, date_to: datetime) -> pd.DataFrame | None:
 def multi_aqi_request_to_df(sensor_ids, location_id, date_from, date_to):
-	
-	#initiate dataframe to None
-	aqi_cols = ['datetime', 'location_id', 'pollutant_id', 'value', 'min_val', 'max_val', 'sd']
-	aqi_df = DataFrame(columns = aqi_cols)
-
-	#loop over sensor ids, get sensor json response, then format it to extract needed parameters
-	for sensor_id in sensor_ids:		
-		#call get_info func
-		res = get_sensor_aqi_resp(sensor_id, date_from, date_to, to_print=False)
-		#catch None response, !200 status_code
-		if res == None or not res.meta.found:
-			#break out of current iteration of loop (current sensor_id)
-			continue
-
-		#extract desired data from json object
-		aqi_df_temp = sensor_res_to_df(res, location_id)	
-		
-		#if aqi_df dataframe for responses not appended yet, set it to the dataframe with the dict data
-		if aqi_df.empty or aqi_df.isna().all().all():
-			aqi_df = aqi_df_temp
-
-		#if it already exists, make a temp dataframe with current dict data, and concatenate the two. 
-		else:
-			aqi_df = pd.concat([aqi_df, aqi_df_temp], ignore_index=True)
-	
-	return aqi_df
-
-
+	#frame is built once from the buffers of all sensors
+	columns = multi_aqi_request_to_columns(sensor_ids, location_id, date_from, date_to)
+	with metrics.timer('transform_seconds', step='aqi_frame'):
+		return DataFrame(columns, columns=AQI_COLS)
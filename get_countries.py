@@ -3,99 +3,202 @@ The purpose of this script is to create a list of location ids to be used for da
 This is done by:
         1. obtaining all countries that are served by the OpenAQ API with the countries endpoint
         2. parsing response to a dataframe with country name, id, and code
-        3. Getting the capital name and coordinates for each country in the list (because I want to collect aqi data from every country's capital
-        4. Sending a get request to the coordinates of the capitals to see which of those cities have aqi systems. Available locations are narrowed down in a list called available_countries, with their location_ids representing the associated ids. 
+        3. Getting the capital name and coordinates for each country in the list (because I want to collect aqi data from every country's capital.
+           These are cached in static/capitals.csv, so countryinfo is only asked once per country
+        4. Finding the locations near each capital. The default bulk mode downloads every OpenAQ location page by page, builds a grid
+           index over their coordinates, and matches every capital against it by radius. The bbox mode sends one request per capital
+           with a fixed box around it, as before.
         5. Finally, a list of location ids is saved in a csv file as one row of data.
         6. This will be used by the ETL script as a template for which location ids to query. 
+
+Usage:
+        python get_countries.py --radius-km 25 --per-capital 10 --output "static/locations list.csv"
 """
 from extract_data import *
+from openaq import RateLimit as RateLimitError, ServerError
 from countryinfo import CountryInfo
-import csv, time, os
-from dotenv import load_dotenv
+from pathlib import Path
+import argparse
+import csv, json, time, os
+import numpy as np
 
-# init client
-api = OpenAQ()
-        
-def main():
+#capital name and coordinates per country, built from countryinfo on the first run
+CAPITALS_FILE = Path(__file__).parent/'static'/'capitals.csv'
+
+#locations per page of the bulk download. 1000 is the api maximum
+PAGE_LIMIT = 1000
+
+EARTH_RADIUS_KM = 6371.0
+
+def main(mode='bulk', radius_km=25, per_capital=10, output='locations list1.csv', refresh_capitals=False):
         #send request to API for countries info, process json data, then convert to dataframe (request func auto rate-limits)
-        #countries_json = send_get_request(limit=300, endpoint='countries')
-        countries_resp = api.countries.list(limit=200)
-        # countries_df = format_countries_json(countries_json)
+        countries_resp = executor.call('countries', get_api().countries.list, limit=200)
         countries_df = format_countries_resp(countries_resp)
-        
-        #make copy for modifying rows
-        cdc = countries_df.copy()
 
-        #initiate lists for tracking capitals, their coordinates, and skipped countries
-        capitals = []
-        coordinates = []
-        skipped = []
+        #capital and its coordinates for every country countryinfo knows, from the cached table
+        cdc = get_capitals(countries_df, CAPITALS_FILE, refresh=refresh_capitals)
 
-        #loop over countries in the name column of cdc and add all countries to either skipped or capitals/coordinates lists
-        for country in cdc['name']:
-                try:
-                        #use helper fn to extract capital name and its coords for each country.
-                        coords, capital = get_capital_coord(country)
+        #from countries dataframe, get list of available countries (whose capital cities have a location in OpenAQ API) and location ids.
+        if mode == 'bulk':
+                location_ids = match_capitals(cdc, fetch_all_locations(), radius_km, per_capital)
+        else:
+                cdc['coordinates'] = list(zip(cdc['latitude'], cdc['longitude']))
+                location_ids = get_available_locations(cdc)
 
-                        #Append each to list
-                        capitals.append(capital)
-                        coordinates.append(coords)
+        #save location ids as csv file in one row. 
+        save_list(location_ids, output)
+        return cdc
 
-                #If countryinfo library doesn't have info for a country or any other exception, remove it from dataframe
-                except Exception:       
-                        #if response does not contain 2 items, drop given country from dataframe
-                        cdc.drop(index = cdc[cdc['name'] == country].index, inplace=True)
+#capitals table: id, name, code, capital, latitude, longitude. Countries missing from the cache are looked up with countryinfo once
+#and added to it. Countries countryinfo does not know are left out and reported
+def get_capitals(countries_df, filepath=CAPITALS_FILE, refresh=False):
+        cached = pd.read_csv(filepath) if filepath.exists() and not refresh else pd.DataFrame(columns=['name', 'capital', 'latitude', 'longitude'])
+        missing = countries_df.loc[~countries_df['name'].isin(cached['name']), 'name']
 
-                        #add country to skipped list for tracking
+        rows, skipped = [], []
+        for country in missing:
+                try:
+                        (lat, lon), capital = get_capital_coord(country)
+                        rows.append({'name': country, 'capital': capital, 'latitude': lat, 'longitude': lon})
+                #If countryinfo library doesn't have info for a country or any other exception, leave it out
+                except Exception:
                         skipped.append(country)
-        
-        #add both lists to new columns in the dataframe
-        cdc['capital'] = capitals
-        cdc['coordinates'] = coordinates
-        
-        #from countries dataframe, get list of available countries (whose capital cities have a location in OpenAQ API) and location ids.
-        location_ids = get_available_locations(cdc)
 
-        #create a boolean mask by mapping a boolean response func on the country name column. If name is in avaiable list, it will be true. 
-        # mask = cdc.name.map(lambda x: x in available_countries)
-        # cdc = cdc.loc[mask] 
+        if rows:
+                cached = pd.concat([cached, pd.DataFrame(rows)], ignore_index=True)
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                cached.to_csv(filepath, index=False)
+        if skipped:
+                print(f'No capital found for {len(skipped)} countries: {skipped}')
 
-        #save location ids as csv file in one row. 
-        filename='locations list1.csv'
-        save_list(location_ids, filename)
+        return countries_df.merge(cached[['name', 'capital', 'latitude', 'longitude']], on='name')
+
+#every OpenAQ location as id, country_id, latitude, longitude. Follows pagination until meta.found is exhausted. Pages go
+#through the response cache, so a second run within the location TTL does not download them again. In replay mode
+#nothing is fetched: paging stops at the first page missing from the cache, and fails if the first one is missing
+def fetch_all_locations(page_limit=PAGE_LIMIT):
+        rows = []
+        page = 1
+        while True:
+                params = {'page': page, 'limit': page_limit, 'mobile': False, 'order_by': 'id', 'sort_order': 'asc'}
+                key = cache_key('locations', 'list', params)
+                cached = response_cache.get('locations', key)
+                if cached is not None:
+                        res = cached_response('locations', cached)
+                elif response_cache.mode == 'replay':
+                        if page == 1:
+                                raise RuntimeError('No cached location pages to replay, run once with the cache in use mode')
+                        print(f'Page {page} not cached, replaying the first {page - 1} pages only')
+                        break
+                else:
+                        res = executor.call('locations', get_api().locations.list, **params)
+                        check_rate_limit(res, to_print=False)
+                        response_cache.put('locations', key, res, ttl=LOCATION_TTL)
+
+                rows += [(loc.id, loc.country.id, loc.coordinates.latitude, loc.coordinates.longitude)
+                                for loc in res.results if loc.coordinates is not None]
+                found = found_count(res.meta.found)
+                print(f'Page {page}: {len(rows)} locations')
+                if len(res.results) < page_limit or (found is not None and page * page_limit >= found):
+                        break
+                page += 1
+
+        return DataFrame(rows, columns=['id', 'country_id', 'latitude', 'longitude']).dropna()
+
+#great circle distance in km from one point to arrays of points
+def haversine_km(lat, lon, lats, lons):
+        lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+        a = np.sin((lats - lat)/2)**2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon)/2)**2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+class GridIndex:
+        """
+        Points bucketed into cells of cell_deg x cell_deg degrees. A radius query only measures the distance to points in the
+        cells the radius can reach, instead of to every point. Longitude cells wrap around the antimeridian.
+        """
+        def __init__(self, ids, lats, lons, cell_deg=0.5):
+                self.ids = np.asarray(ids)
+                self.lats = np.asarray(lats, dtype=float)
+                self.lons = np.asarray(lons, dtype=float)
+                self.cell_deg = cell_deg
+                self.lon_cells = int(np.ceil(360 / cell_deg))
+
+                rows = np.floor((self.lats + 90) / cell_deg).astype(int)
+                cols = np.floor((self.lons + 180) / cell_deg).astype(int) % self.lon_cells
+                order = np.lexsort((cols, rows))
+                keys = np.stack([rows[order], cols[order]], axis=1)
+                #one slice of `order` per occupied cell
+                starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)])
+                ends = np.r_[starts[1:], len(order)]
+                self.cells = {tuple(keys[i]): order[i:j] for i, j in zip(starts, ends)}
+
+        #(id, distance km) of the points within radius_km of lat/lon, nearest first, at most k
+        def query(self, lat, lon, radius_km, k=None):
+                dlat = radius_km / 111.0
+                dlon = radius_km / (111.32 * max(np.cos(np.radians(lat)), 1e-6))
+                row_range = range(int(np.floor((lat - dlat + 90) / self.cell_deg)), int(np.floor((lat + dlat + 90) / self.cell_deg)) + 1)
+                if dlon >= 180:
+                        col_range = range(self.lon_cells)
+                else:
+                        first, last = int(np.floor((lon - dlon + 180) / self.cell_deg)), int(np.floor((lon + dlon + 180) / self.cell_deg))
+                        col_range = {c % self.lon_cells for c in range(first, last + 1)}
+
+                cells = [self.cells[(r, c)] for r in row_range for c in col_range if (r, c) in self.cells]
+                if not cells:
+                        return []
+                candidates = np.concatenate(cells)
+                distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+                within = distances <= radius_km
+                candidates, distances = candidates[within], distances[within]
+                nearest = np.argsort(distances, kind='stable')[:k]
+                return list(zip(self.ids[candidates[nearest]].tolist(), distances[nearest].tolist()))
+
+#location ids near each capital: the nearest per_capital locations of the same country within radius_km
+def match_capitals(cdc, locations_df, radius_km=25, per_capital=10):
+        index = GridIndex(locations_df['id'], locations_df['latitude'], locations_df['longitude'])
+        country_of = dict(zip(locations_df['id'], locations_df['country_id']))
+
+        location_ids, notfound_countries = [], []
+        for country_id, country, lat, lon in zip(cdc['id'], cdc['name'], cdc['latitude'], cdc['longitude']):
+                #a capital near a border can reach stations of the neighbour, those belong to the other country
+                matches = [loc_id for loc_id, _ in index.query(lat, lon, radius_km) if country_of[loc_id] == country_id][:per_capital]
+                if matches:
+                        location_ids += matches
+                else:
+                        notfound_countries.append(country)
+
+        #report how many countries found and not found        
+        print('\nRESULTS\n', '='*50)
+        print(f'{len(cdc) - len(notfound_countries)} countries successful')
+        print(f'{len(location_ids)} locations saved')
+        print(f'{len(notfound_countries)} locations not found')
+        print(f'Failed:\n{notfound_countries}') 
+
+        #a location near two capitals is only listed once
+        return list(dict.fromkeys(location_ids))
 
 """Optional parameters to include can be found at OpenAQ endpoint documentation.
 for locations: coordinates, countries_id...
 """
 def send_get_request(limit, endpoint=None, box=None): #coordinates, country_id - optional argument with 4 decimal precision, WGS 84 format
 
-        #send get request
-        # try to get response = requests.get(URL, headers=headers, params=params)
+        #send get request through the shared executor: rate limits and server errors are retried with backoff,
+        #returns None once every retry failed
         try:
                 if endpoint == 'countries':
-                        response = api.countries.list(limit=limit)
+                        response = executor.call('countries', get_api().countries.list, limit=limit)
                 elif endpoint == 'locations':
                         pollutants=[1,2,3,5]        # make sure searches for presence of key pollutants
-                        response = api.locations.list(limit=limit, bbox=box)    # , parameters_id=pollutants)
-                
-                print(f'{response.headers.x_ratelimit_used} call(s) placed')
-                #catch/limit rate limiting
-                if response.headers.x_ratelimit_remaining == 0:
-                        print(f'\nRate limit reached. Sleeping {response.headers.x_ratelimit_reset} seconds...')
-                        rest = response.headers.x_ratelimit_reset
-                        time.sleep(rest)
-
-                return json.loads(response.json())
-
-        # catch ratelimit errors indefinitely, and recursively call get request after taking a nice nap
-        except RateLimitError:
-                time.sleep(nap=30)
-                send_get_request(limit, endpoint, box)
-
-        #catch error if there is an error that isn't 429, or after 5 retries, still fails, also return None.
-        if response.status_code != 200:
-                print(f'Error: {response.status_code}, {response.text}')
+                        response = executor.call('locations', get_api().locations.list, limit=limit, bbox=box)    # , parameters_id=pollutants)
+                else:
+                        raise ValueError(f'Unknown endpoint: {endpoint}')
+        except (RateLimitError, ServerError) as e:
+                print(f'Error: {type(e).__name__}, {e}')
                 return None
+
+        #refill the shared budget, the next request waits for the reset if the quota is used up
+        check_rate_limit(response, to_print=True)
+        return json.loads(response.json())
         
 #format data into desired dataframe. source data is json object. 
 def format_countries_resp(response):
@@ -137,17 +240,6 @@ def bbox_gen(coord):
         dif = 0.2
         return [round(long-dif,4), round(lat-dif,4), round(long+dif, 4), round(lat+dif, 4)]
 
-# check rate limit and sleep if required
-def check_rate_limit(response, to_print=True):
-        if to_print:
-                print(f'{response.headers.x_ratelimit_used} call(s) placed')
-        #catch/limit rate limiting
-        if response.headers.x_ratelimit_remaining == 0:
-                if to_print:
-                        print(f'\nRate limit reached. Sleeping {response.headers.x_ratelimit_reset} seconds...')
-                rest = response.headers.x_ratelimit_reset
-                time.sleep(rest)
-
 def get_available_locations(dataframe):
         cdc = dataframe.copy()
 
@@ -166,8 +258,8 @@ def get_available_locations(dataframe):
                 #print(f'{box}\t{box_str}')
                 try:
                         #locations_json = send_get_request(limit=3, endpoint='locations', box=box_str)
-                        locations_resp = api.locations.list(limit=10, bbox=box_str)
-                        check_rate_limit(locations_resp, to_print=True)
+                        locations_resp = executor.call('locations', get_api().locations.list, limit=10, bbox=box_str)
+                        check_rate_limit(locations_resp, to_print=True)     #shared budget from extract_data
 
                         if locations_resp.meta.found != 0:
                                 available_countries.append(country)
@@ -197,6 +289,14 @@ def save_list(data_list, filename):
         return
 
 if __name__ == '__main__':
+        parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument('--mode', choices=['bulk', 'bbox'], default='bulk', help='bulk download + local index, or one bbox request per capital')
+        parser.add_argument('--radius-km', type=float, default=25, help='max distance of a location from its capital (bulk mode)')
+        parser.add_argument('--per-capital', type=int, default=10, help='max locations kept per capital, nearest first (bulk mode)')
+        parser.add_argument('--output', default='locations list1.csv', help='location list csv, one row of ids as ETL.py reads it')
+        parser.add_argument('--refresh-capitals', action='store_true', help='rebuild the capitals table from countryinfo')
+        args = parser.parse_args()
+
         #calls main script to output dataframe cdc (countries with ids, capital, and coordinates of capital)
-        cdc = main()
+        cdc = main(args.mode, args.radius_km, args.per_capital, args.output, args.refresh_capitals)
         print(cdc)
\ No newline at end of file
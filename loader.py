@@ -0,0 +1,219 @@
+"""
+Bulk loader for the aqi database. Instead of one executemany + commit per table per location, rows are gathered
+across many locations and flushed per table in large multi-row upserts, or with LOAD DATA LOCAL INFILE from a staged
+file. Each flush is one transaction, so a full run commits a handful of times instead of once per location.
+"""
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+#tables in foreign key order: parents are always written before the rows that reference them
+TABLE_ORDER = ['countries', 'pollutants', 'locations', 'sensors', 'aqi']
+
+#rows per INSERT statement. Keeps each statement well under max_allowed_packet
+STATEMENT_ROWS = 1000
+
+#directory infile mode stages its files in. Override with ETL_STAGING_DIR env variable
+STAGING_DIR = Path(os.getenv('ETL_STAGING_DIR', Path(tempfile.gettempdir())/'aqi_infile'))
+
+#connector options for the connection of an infile mode loader: LOAD DATA LOCAL INFILE may read files from the
+#staging directory and nowhere else. The connector keeps local infile off unless asked, and so do other connections
+def infile_options(staging_dir=STAGING_DIR):
+	return {'allow_local_infile_in_path': str(staging_dir)}
+
+#build upsert query for a table. duplicate keys update every column except the first (id)
+def upsert_query(tablename, columns):
+	head = ', '.join(f'`{col}`' for col in columns)
+	placeholder = ', '.join(['%s']*len(columns))
+	updates = ', '.join(f"`{col}` = VALUES(`{col}`)" for col in columns[1:])
+	return f"INSERT INTO `{tablename}` ({head}) VALUES ({placeholder}) ON DUPLICATE KEY UPDATE {updates}"
+
+#convert one column to a list of python values, using the column dtype to pick the conversion once for the whole
+#column instead of testing each cell. NaN/NaT become None (NULL), numpy scalars become native ints/floats/datetimes
+def column_values(col):
+	kind = col.dtype.kind
+	has_nulls = col.hasnans if kind in 'fcmM' else col.isna().any()
+	if kind == 'M':	#datetime64: numpy casts to python datetimes (NaT to None), which bind directly in the connector
+		values = col.to_numpy(dtype='datetime64[us]').astype(object).tolist()
+	elif not has_nulls and kind in 'iufb':
+		return col.to_numpy().tolist()	#numpy tolist gives native python types
+	else:
+		values = col.astype(object).tolist()
+	if has_nulls:
+		values = [None if null else v for v, null in zip(values, col.isna().to_numpy())]
+	return values
+
+#column buffers for a df: one list of python values per column, in column order
+def df_to_columns(df):
+	return [column_values(df[col]) for col in df.columns]
+
+#convert df to list of tuples for executemany
+def df_to_rows(df):
+	return list(zip(*df_to_columns(df)))
+
+class BulkLoader:
+	"""
+	Collects rows per table across locations and writes them in one transaction when max_rows or max_bytes is reached.
+	mode='insert' sends multi-row INSERT ... ON DUPLICATE KEY UPDATE statements, mode='infile' stages aqi rows to a
+	tab separated file in staging_dir and loads it with LOAD DATA LOCAL INFILE. That needs local_infile enabled on the
+	server, and a connection opened with infile_options(staging_dir).
+	dimensions, a DimensionCache, is told which dimension rows committed and which failed after every flush.
+	"""
+	def __init__(self, cnx, mode='insert', max_rows=50000, max_bytes=16*1024**2, staging_dir=STAGING_DIR, dimensions=None):
+		if mode not in ('insert', 'infile'):
+			raise ValueError(f'Unknown bulk load mode: {mode}')
+		self.cnx = cnx
+		self.staging_dir = Path(staging_dir)
+		self.dimensions = dimensions
+		self.curs = cnx.cursor()
+		self.mode = mode
+		self.max_rows = max_rows
+		self.max_bytes = max_bytes
+
+		#pending column buffers (one list per column) and column names, per table
+		self.pending = {table: [] for table in TABLE_ORDER}
+		self.columns = {}
+		self.pending_rows = 0
+		self.pending_bytes = 0
+		self.pending_locations = set()
+
+		#counters for run summary
+		self.rows_written = {table: 0 for table in TABLE_ORDER}
+		self.exceptions = {table: 0 for table in TABLE_ORDER}
+		self.locations = set()	#locations whose aqi rows were committed
+		self.commits = 0
+		self.flush_seconds = 0.0
+
+	#queue a dataframe for its table. Flushes first if the batch is full
+	def add(self, tablename, df):
+		if df.empty:
+			return
+		self.add_columns(tablename, df.columns.to_list(), df_to_columns(df))
+
+	#queue column buffers (one list of python values per column) directly, without building a DataFrame
+	def add_columns(self, tablename, names, columns):
+		n = len(columns[0]) if columns else 0
+		if not n:
+			return
+		self.columns.setdefault(tablename, names)
+		buffers = self.pending[tablename]
+		if not buffers:
+			self.pending[tablename] = [list(values) for values in columns]
+		else:
+			for buffer, values in zip(buffers, columns):
+				buffer.extend(values)
+		self.pending_rows += n
+		self.pending_bytes += len(str([c[0] for c in columns])) * n	#estimate from first row, exact size is not worth the cost
+		if tablename == 'aqi':
+			self.pending_locations.update(columns[names.index('location_id')])
+
+		if self.pending_rows >= self.max_rows or self.pending_bytes >= self.max_bytes:
+			self.flush()
+
+	#write all pending rows in one transaction
+	def flush(self):
+		if not self.pending_rows:
+			return
+		start = time.monotonic()
+		try:
+			for tablename in TABLE_ORDER:
+				self._write(tablename, self.pending[tablename])
+			with metrics.timer('commit_seconds', mode=self.mode):
+				self.cnx.commit()
+			self.commits += 1
+			for tablename in TABLE_ORDER:
+				rows = self._count(tablename)
+				self.rows_written[tablename] += rows
+				if rows:
+					metrics.inc('rows_written_total', rows, table=tablename)
+					self._committed(tablename)
+			self.locations |= self.pending_locations
+			logger.info(f'Bulk flush: {self.pending_rows} rows committed for {len(self.pending_locations)} locations')
+
+		except KeyboardInterrupt:
+			raise
+
+		except Exception as e:
+			# one bad row should not cost the whole batch. retry table by table so only the failing table is lost
+			self.cnx.rollback()
+			logger.warning('Bulk flush failed, retrying table by table: %s', e)
+			self._flush_per_table()
+
+		finally:
+			self.flush_seconds += time.monotonic() - start
+
+		self.pending = {table: [] for table in TABLE_ORDER}
+		self.pending_rows = 0
+		self.pending_bytes = 0
+		self.pending_locations = set()
+
+	def _flush_per_table(self):
+		for tablename in TABLE_ORDER:
+			rows = self._count(tablename)
+			if not rows:
+				continue
+			try:
+				self._write(tablename, self.pending[tablename])
+				with metrics.timer('commit_seconds', mode=self.mode):
+					self.cnx.commit()
+				self.commits += 1
+				self.rows_written[tablename] += rows
+				metrics.inc('rows_written_total', rows, table=tablename)
+				self._committed(tablename)
+				if tablename == 'aqi':
+					self.locations |= self.pending_locations
+			except Exception as e:
+				self.cnx.rollback()
+				if self.dimensions is not None:	#not in the db, so locations still to come write these rows again
+					self.dimensions.discard(tablename)
+				self.exceptions[tablename] += 1	#count exception for tracking
+				metrics.inc('insert_errors_total', table=tablename)
+				logger.warning(f'Table {tablename} bulk insert unsuccessfull ({rows} rows): %s', e)
+
+	#dimension rows of a table are known to the dimension cache only once their transaction committed
+	def _committed(self, tablename):
+		if self.dimensions is not None and tablename != 'aqi':
+			self.dimensions.mark_columns(tablename, self.columns[tablename], self.pending[tablename])
+
+	def _count(self, tablename):
+		buffers = self.pending[tablename]
+		return len(buffers[0]) if buffers else 0
+
+	def _write(self, tablename, buffers):
+		if not buffers:
+			return
+		with metrics.timer('insert_seconds', table=tablename, mode=self.mode):
+			columns = self.columns[tablename]
+			rows = list(zip(*buffers))
+			if self.mode == 'infile' and tablename == 'aqi':
+				return self._load_infile(tablename, columns, rows)
+
+			#connector rewrites executemany on an INSERT into a single multi-row statement, one per chunk
+			query = upsert_query(tablename, columns)
+			for i in range(0, len(rows), STATEMENT_ROWS):
+				self.curs.executemany(query, rows[i:i+STATEMENT_ROWS])
+
+	#stage rows in a temp file and load it in one statement. REPLACE gives upsert behaviour on the unique key.
+	#Only used for aqi: dimension tables are referenced by foreign keys, so REPLACE (delete + insert) would fail there.
+	def _load_infile(self, tablename, columns, rows):
+		#aqi rows are numbers and timestamps only, so no quoting or escaping is needed. \\N is NULL for LOAD DATA
+		self.staging_dir.mkdir(parents=True, exist_ok=True)
+		with tempfile.NamedTemporaryFile('w', suffix='.tsv', newline='', delete=False, dir=self.staging_dir) as f:
+			f.writelines('\t'.join('\\N' if x is None else str(x) for x in row) + '\n' for row in rows)
+			staged = f.name
+		try:
+			head = ', '.join(f'`{col}`' for col in columns)
+			self.curs.execute(f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE `{tablename}` "
+				f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({head})", [staged])
+		finally:
+			os.remove(staged)
+
+	def summary(self):
+		return (f'Bulk loader ({self.mode}): {sum(self.rows_written.values())} rows in {self.commits} commits, '
+			f'{self.flush_seconds:.1f}s flushing. Rows per table: {self.rows_written}')
@@ -0,0 +1,151 @@
+"""
+Run metrics for the ETL: counters, gauges and latency histograms, shared by every thread of a run.
+API calls, rate limit waits, transforms, inserts and commits record into the process-wide `metrics` registry.
+At the end of a run the registry is written as a JSON summary, and optionally as a Prometheus textfile for the
+node_exporter textfile collector.
+"""
+from contextlib import contextmanager
+import json
+import math
+import os
+import threading
+import time
+
+#latency bucket upper bounds in seconds, from a fast insert to a long rate limit wait
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+class Histogram:
+	def __init__(self, buckets=BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)	#per bucket, not cumulative
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+		self.count += 1
+		self.sum += value
+		self.max = max(self.max, value)
+
+	#upper bound of the bucket holding the q-th observation. Coarse, but enough to tell 50ms from 5s
+	def quantile(self, q):
+		if not self.count:
+			return None
+		rank, seen = q * self.count, 0
+		for bound, n in zip(self.buckets, self.counts):
+			seen += n
+			if seen >= rank:
+				return self.max if bound == math.inf else bound
+		return self.max
+
+	def summary(self):
+		return {'count': self.count, 'sum': round(self.sum, 4), 'mean': round(self.sum / self.count, 4) if self.count else None,
+				'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'max': round(self.max, 4)}
+
+#metric key: name plus sorted labels, so the same labels in any order are one series
+def series(name, labels):
+	return (name, tuple(sorted(labels.items())))
+
+def label_text(labels, extra=()):
+	pairs = list(labels) + list(extra)
+	return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+
+class Metrics:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counters = {}
+		self.gauges = {}
+		self.histograms = {}
+
+	def inc(self, name, value=1, **labels):
+		key = series(name, labels)
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def gauge(self, name, value, **labels):
+		with self.lock:
+			self.gauges[series(name, labels)] = value
+
+	def observe(self, name, seconds, **labels):
+		key = series(name, labels)
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = Histogram()
+			self.histograms[key].observe(seconds)
+
+	#time the with block into histogram name, also when it raises
+	@contextmanager
+	def timer(self, name, **labels):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start, **labels)
+
+	def reset(self):
+		with self.lock:
+			self.counters, self.gauges, self.histograms = {}, {}, {}
+
+	#nested dict for the JSON summary: {name: value} without labels, {name: {"label=value,...": value}} with them
+	def summary(self):
+		def group(items, value):
+			out = {}
+			for (name, labels), metric in items:
+				if labels:
+					out.setdefault(name, {})[','.join(f'{k}={v}' for k, v in labels)] = value(metric)
+				else:
+					out[name] = value(metric)
+			return out
+		with self.lock:
+			return {
+				'counters': group(sorted(self.counters.items()), lambda v: v),
+				'gauges': group(sorted(self.gauges.items()), lambda v: v),
+				'histograms': group(sorted(self.histograms.items()), lambda h: h.summary()),
+			}
+
+	#Prometheus text exposition format, every metric name prefixed
+	def prometheus(self, prefix='aqi_etl'):
+		lines = []
+		with self.lock:
+			for kind, items in (('counter', self.counters), ('gauge', self.gauges)):
+				typed = set()
+				for (name, labels), value in sorted(items.items()):
+					full = f'{prefix}_{name}'
+					if full not in typed:
+						lines.append(f'# TYPE {full} {kind}')
+						typed.add(full)
+					lines.append(f'{full}{label_text(labels)} {value}')
+			typed = set()
+			for (name, labels), h in sorted(self.histograms.items()):
+				full = f'{prefix}_{name}'
+				if full not in typed:
+					lines.append(f'# TYPE {full} histogram')
+					typed.add(full)
+				cumulative = 0
+				for bound, n in zip(h.buckets, h.counts):
+					cumulative += n
+					le = '+Inf' if bound == math.inf else repr(bound)
+					lines.append(f'{full}_bucket{label_text(labels, [("le", le)])} {cumulative}')
+				lines.append(f'{full}_sum{label_text(labels)} {h.sum}')
+				lines.append(f'{full}_count{label_text(labels)} {h.count}')
+		return '\n'.join(lines) + '\n'
+
+#write text to path through a temp file, so a collector never reads a half written file
+def write_atomic(path, text):
+	staged = f'{path}.tmp'
+	with open(staged, 'w') as f:
+		f.write(text)
+	os.replace(staged, path)
+
+def write_json(path, summary):
+	write_atomic(path, json.dumps(summary, indent=1, default=str))
+
+def write_prometheus(path, registry=None, prefix='aqi_etl'):
+	write_atomic(path, (registry or metrics).prometheus(prefix))
+
+#one registry per process, shared by all fetch workers and the loader
+metrics = Metrics()
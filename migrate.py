@@ -0,0 +1,269 @@
+"""
+Migration of the aqi database to the layout in static/schema.sql, for time-range queries by location and pollutant.
+- aqi is clustered on (location_id, pollutant_id, datetime): the surrogate id and the UNIQUE key leading with datetime
+  are dropped, so one series is a contiguous range of the primary key instead of rows spread across the table.
+- covering secondary indexes for the rollup refresh, the pollutant-wide queries in static/queries.sql and the
+  dashboard queries on aqi_daily.
+- locations.latitude/longitude become DECIMAL(9,6) instead of varchar(20), with an index for bounding box lookups.
+- the tables the ETL and dashboard added are created when missing, before the indexes on them: aqi_daily filled with
+  the rollup of every date in aqi, etl_loads with a first load version, and latest_readings, the dashboard header's
+  newest value per country and pollutant, filled from aqi_daily.
+- optionally (--partition) aqi is range partitioned by month on datetime. MySQL does not allow foreign keys on a
+  partitioned table, so aqi's foreign keys are dropped in that case. The ETL writes parent rows first either way.
+Every step checks information_schema first, so the tool can be rerun and only applies what is missing.
+
+Usage:
+	python migrate.py --dry-run
+	python migrate.py --partition --months-ahead 3
+	python migrate.py --extend-partitions         # monthly maintenance: add partitions for the coming months
+"""
+import datetime
+import logging
+
+from rollup import LATEST_QUERY, ROLLUP_QUERY
+
+logger = logging.getLogger(__name__)
+
+#aqi primary key after the migration. InnoDB stores rows in primary key order, so this is the physical order
+AQI_PRIMARY_KEY = ['location_id', 'pollutant_id', 'datetime']
+
+#secondary indexes, table -> {index: columns}. InnoDB appends the primary key columns to every secondary index,
+#so (datetime, value) also carries location_id and pollutant_id and covers the rollup refresh without touching rows
+COVERING_INDEXES = {
+	'aqi': {
+		'aqi_datetime_index': ['datetime', 'value'],					#MAX(datetime), rollup refresh by date range
+		'aqi_pollutant_index': ['pollutant_id', 'datetime', 'value'],	#one pollutant across locations, over time
+	},
+	'aqi_daily': {
+		'aqi_daily_pollutant_index': ['pollutant_id', 'country_id', 'date', 'avg_value', 'n'],	#dashboard and explorer
+		'aqi_daily_country_index': ['country_id'],						#country list of the explorer
+	},
+	'locations': {
+		'locations_coordinates_index': ['latitude', 'longitude'],
+	},
+}
+
+#indexes the new primary key makes redundant
+REDUNDANT_INDEXES = {
+	'aqi': ['datetime', 'aqi_location_index'],
+}
+
+COORDINATE_TYPE = 'decimal(9,6)'
+
+#aqi_daily over every date in aqi: the rollup refresh (rollup.refresh_daily_rollup) of the one range from the oldest
+#day to the newest. Dates are inlined, so the statement prints with --dry-run as it runs
+def rollup_fill(curs):
+	curs.execute('SELECT MIN(datetime), MAX(datetime) FROM aqi')
+	first, last = curs.fetchone()
+	if first is None:
+		return None
+	return ROLLUP_QUERY % (f"'{first.date()}'", f"'{last.date() + datetime.timedelta(days=1)}'")
+
+#tables added after the first layout, in the order they are filled: created with the definition in static/schema.sql,
+#then filled by a statement, or by fill(curs) returning one (None when there is nothing to fill)
+NEW_TABLES = {
+	'aqi_daily': ("""
+		CREATE TABLE `aqi_daily` (
+		  `date` date NOT NULL,
+		  `country_id` smallint unsigned NOT NULL,
+		  `pollutant_id` int unsigned NOT NULL,
+		  `avg_value` float NOT NULL,
+		  `min_value` float NOT NULL,
+		  `max_value` float NOT NULL,
+		  `n` int unsigned NOT NULL,
+		  `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+		  PRIMARY KEY (`date`,`country_id`,`pollutant_id`),
+		  KEY `aqi_daily_pollutant_index` (`pollutant_id`,`country_id`,`date`,`avg_value`,`n`),
+		  KEY `aqi_daily_country_index` (`country_id`),
+		  KEY `aqi_daily_updated_index` (`updated_at`)
+		)""", rollup_fill),
+	'etl_loads': ("""
+		CREATE TABLE `etl_loads` (
+		  `id` int unsigned NOT NULL AUTO_INCREMENT,
+		  `source` varchar(16) NOT NULL,
+		  `aqi_rows` int unsigned NOT NULL DEFAULT 0,
+		  `finished_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+		  PRIMARY KEY (`id`)
+		)""", "INSERT INTO etl_loads (source) VALUES ('migrate')"),
+	'latest_readings': ("""
+		CREATE TABLE `latest_readings` (
+		  `country_id` smallint unsigned NOT NULL,
+		  `pollutant_id` int unsigned NOT NULL,
+		  `date` date NOT NULL,
+		  `value` float NOT NULL,
+		  `n` int unsigned NOT NULL,
+		  `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+		  PRIMARY KEY (`country_id`,`pollutant_id`)
+		)""", LATEST_QUERY.format(countries='')),
+}
+
+def index_columns(curs, table, index):
+	curs.execute("""
+		SELECT COLUMN_NAME FROM information_schema.STATISTICS
+		WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+		ORDER BY SEQ_IN_INDEX""", [table, index])
+	return [row[0] for row in curs.fetchall()]
+
+def table_exists(curs, table):
+	curs.execute("""
+		SELECT COUNT(*) FROM information_schema.TABLES
+		WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s""", [table])
+	return curs.fetchone()[0] > 0
+
+def column_type(curs, table, column):
+	curs.execute("""
+		SELECT COLUMN_TYPE FROM information_schema.COLUMNS
+		WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s""", [table, column])
+	row = curs.fetchone()
+	return row[0].decode() if row and isinstance(row[0], bytes) else (row[0] if row else None)
+
+def foreign_keys(curs, table):
+	curs.execute("""
+		SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS
+		WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_TYPE = 'FOREIGN KEY'""", [table])
+	return [row[0] for row in curs.fetchall()]
+
+def partitions(curs, table):
+	curs.execute("""
+		SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+		WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+		ORDER BY PARTITION_ORDINAL_POSITION""", [table])
+	return [row[0] for row in curs.fetchall()]
+
+def next_month(day):
+	return datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def partition_name(month):
+	return f'p{month:%Y_%m}'
+
+def partition_clause(month):
+	return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{next_month(month).isoformat()}')"
+
+#first day of every month from first up to months_ahead months after today
+def months_between(first, months_ahead):
+	month = datetime.date(first.year, first.month, 1)
+	last = datetime.date.today().replace(day=1)
+	for _ in range(months_ahead):
+		last = next_month(last)
+	months = []
+	while month <= last:
+		months.append(month)
+		month = next_month(month)
+	return months
+
+#statements that bring aqi to the clustered key and drop the indexes it replaces
+def primary_key_steps(curs):
+	if index_columns(curs, 'aqi', 'PRIMARY') == AQI_PRIMARY_KEY:
+		return []
+	changes = []
+	if column_type(curs, 'aqi', 'id') is not None:
+		changes.append('DROP COLUMN `id`')	#drops the old primary key with it
+	else:
+		changes.append('DROP PRIMARY KEY')
+	changes += [f'DROP INDEX `{index}`' for index in REDUNDANT_INDEXES['aqi'] if index_columns(curs, 'aqi', index)]
+	head = ', '.join(f'`{col}`' for col in AQI_PRIMARY_KEY)
+	changes.append(f'ADD PRIMARY KEY ({head})')
+	return [f"ALTER TABLE `aqi` {', '.join(changes)}"]
+
+def index_steps(curs):
+	statements = []
+	for table, indexes in COVERING_INDEXES.items():
+		changes = []
+		for index, columns in indexes.items():
+			existing = index_columns(curs, table, index)
+			if existing == columns:
+				continue
+			if existing:
+				changes.append(f'DROP INDEX `{index}`')
+			changes.append(f"ADD INDEX `{index}` ({', '.join(f'`{col}`' for col in columns)})")
+		if changes:
+			statements.append(f"ALTER TABLE `{table}` {', '.join(changes)}")
+	return statements
+
+def table_steps(curs):
+	statements = []
+	for table, (create, fill) in NEW_TABLES.items():
+		if not table_exists(curs, table):
+			fill = fill(curs) if callable(fill) else fill
+			statements += [create] + ([fill] if fill else [])
+	return statements
+
+def coordinate_steps(curs):
+	changes = [f'MODIFY `{col}` {COORDINATE_TYPE} NOT NULL' for col in ('latitude', 'longitude')
+				if column_type(curs, 'locations', col) != COORDINATE_TYPE]
+	return [f"ALTER TABLE `locations` {', '.join(changes)}"] if changes else []
+
+def partition_steps(curs, months_ahead):
+	if partitions(curs, 'aqi'):
+		return []
+	statements = [f'ALTER TABLE `aqi` DROP FOREIGN KEY `{fk}`' for fk in foreign_keys(curs, 'aqi')]
+	curs.execute('SELECT MIN(datetime) FROM aqi')
+	first = curs.fetchone()[0] or datetime.date.today()
+	clauses = [partition_clause(month) for month in months_between(first, months_ahead)]
+	clauses.append('PARTITION pmax VALUES LESS THAN (MAXVALUE)')
+	statements.append('ALTER TABLE `aqi` PARTITION BY RANGE COLUMNS(`datetime`) (\n\t' + ',\n\t'.join(clauses) + ')')
+	return statements
+
+#split pmax so every month up to months_ahead has its own partition before data arrives for it
+def extend_partition_steps(curs, months_ahead):
+	existing = partitions(curs, 'aqi')
+	if not existing:
+		return []
+	months = [datetime.date(int(name[1:5]), int(name[6:8]), 1) for name in existing if name != 'pmax']
+	new = [month for month in months_between(max(months), months_ahead) if partition_name(month) not in existing]
+	if not new:
+		return []
+	clauses = [partition_clause(month) for month in new] + ['PARTITION pmax VALUES LESS THAN (MAXVALUE)']
+	return ['ALTER TABLE `aqi` REORGANIZE PARTITION pmax INTO (\n\t' + ',\n\t'.join(clauses) + ')']
+
+#list the statements that are still needed, and run them unless dry_run. Returns the statements
+def main(cnx, partition=False, months_ahead=3, extend_only=False, dry_run=False):
+	curs = cnx.cursor()
+	if extend_only:
+		steps = [('partitions', lambda: extend_partition_steps(curs, months_ahead))]
+	else:
+		steps = [
+			('primary key', lambda: primary_key_steps(curs)),
+			('coordinates', lambda: coordinate_steps(curs)),
+			('tables', lambda: table_steps(curs)),	#before the indexes, some of them are on these tables
+			('indexes', lambda: index_steps(curs)),
+		]
+		if partition:
+			steps.append(('partitions', lambda: partition_steps(curs, months_ahead)))
+
+	applied = []
+	#each step is planned after the previous one ran, since it reads the layout the previous step left
+	for name, plan in steps:
+		statements = plan()
+		if not statements:
+			logger.info(f'Migration step {name}: already applied.')
+			continue
+		for statement in statements:
+			logger.info(f'Migration step {name}: {statement}')
+			if dry_run:
+				print(statement + ';\n')
+				continue
+			start = datetime.datetime.now()
+			curs.execute(statement)	#DDL commits implicitly, the fill of a new table does not
+			cnx.commit()
+			logger.info(f'Migration step {name} took {(datetime.datetime.now() - start).total_seconds():.1f}s.')
+		applied += statements
+	curs.close()
+	return applied
+
+if __name__ == '__main__':
+	import argparse
+	from connectdb import connect_db
+
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s || %(levelname)s: %(message)s')
+
+	parser = argparse.ArgumentParser(description='Migrate the aqi database to the clustered, indexed layout.')
+	parser.add_argument('--partition', action='store_true', help='range partition aqi by month (drops its foreign keys)')
+	parser.add_argument('--months-ahead', type=int, default=3, help='empty monthly partitions created ahead of today')
+	parser.add_argument('--extend-partitions', action='store_true', help='only add partitions for the coming months')
+	parser.add_argument('--dry-run', action='store_true', help='print the statements instead of running them')
+	args = parser.parse_args()
+
+	with connect_db() as (cnx, curs):
+		applied = main(cnx, args.partition, args.months_ahead, args.extend_partitions, args.dry_run)
+	print(f'{len(applied)} statements {"planned" if args.dry_run else "applied"}.')
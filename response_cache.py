@@ -0,0 +1,233 @@
+"""
+On-disk cache of OpenAQ responses, in one SQLite file keyed by endpoint and request params.
+Location metadata is kept for a long TTL, as coordinates, country and sensors almost never change. Measurement
+requests whose window ended before today are immutable and never fetched again, windows still open get a short TTL.
+The file is bounded in size: past max_bytes the least recently used responses are evicted.
+
+Modes:
+	use      read from the cache, fetch and store on a miss (default)
+	refresh  always fetch, store the new response
+	replay   cache only, a miss is never fetched. For rebuilding the database offline from earlier runs: measurements
+	         are looked up by sensor, and every cached window overlapping the requested range is replayed, whatever
+	         window the run that cached it asked for
+	off      no cache
+
+Usage:
+	python response_cache.py --stats
+	python response_cache.py --prune
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = os.getenv('OPENAQ_CACHE_FILE', str(Path(__file__).parent/'cache'/'openaq.sqlite'))
+CACHE_MODE = os.getenv('OPENAQ_CACHE_MODE', 'use')
+CACHE_MB = float(os.getenv('OPENAQ_CACHE_MB', 512))
+LOCATION_TTL = int(os.getenv('OPENAQ_LOCATION_TTL', 7*24*3600))	#seconds location metadata is reused
+OPEN_WINDOW_TTL = int(os.getenv('OPENAQ_OPEN_WINDOW_TTL', 3600))	#seconds for measurement windows that reach today
+
+MODES = ('use', 'refresh', 'replay', 'off')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+	key TEXT PRIMARY KEY,
+	endpoint TEXT NOT NULL,
+	body BLOB NOT NULL,
+	size INTEGER NOT NULL,
+	fetched_at REAL NOT NULL,
+	expires_at REAL,
+	accessed_at REAL NOT NULL
+)
+"""
+
+#cache key: endpoint, resource id and params in a fixed order, like the url the sdk requests
+def cache_key(endpoint, resource_id, params=None):
+	return f'{endpoint}/{resource_id}?' + urlencode(sorted((params or {}).items()))
+
+#first and last key of a resource's responses: keys are endpoint/id?params, and '@' sorts right after '?'
+def key_range(endpoint, resource_id):
+	prefix = f'{endpoint}/{resource_id}?'
+	return prefix, prefix[:-1] + '@'
+
+#expiry of a measurement response: None (never) when the window ended before today, else a short TTL
+def measurement_ttl(params, today=None):
+	today = today or datetime.date.today()
+	date_to = params.get('datetime_to')
+	if date_to and datetime.date.fromisoformat(str(date_to)[:10]) < today:
+		return None
+	return OPEN_WINDOW_TTL
+
+class ResponseCache:
+	"""
+	Thread safe: fetch workers share one connection behind a lock. The file is opened on first use, so building the
+	cache costs nothing when mode is off or no request is made.
+	"""
+	def __init__(self, filepath=CACHE_FILE, mode=CACHE_MODE, max_bytes=int(CACHE_MB*1024**2)):
+		if mode not in MODES:
+			raise ValueError(f'Unknown cache mode: {mode}')
+		self.filepath = Path(filepath)
+		self.mode = mode
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		self.db = None
+		self.size = 0	#bytes of stored bodies, kept in memory so puts do not sum the table
+		self.hits = 0
+		self.misses = 0
+		self.stores = 0
+		self.evicted = 0
+
+	def configure(self, filepath=None, mode=None, max_bytes=None):
+		if mode is not None and mode not in MODES:
+			raise ValueError(f'Unknown cache mode: {mode}')
+		with self.lock:
+			if filepath is not None and Path(filepath) != self.filepath:
+				self.close()
+				self.filepath = Path(filepath)
+			self.mode = mode or self.mode
+			self.max_bytes = max_bytes or self.max_bytes
+
+	@property
+	def reads(self):
+		return self.mode in ('use', 'replay')
+
+	@property
+	def writes(self):
+		return self.mode in ('use', 'refresh')
+
+	def _open(self):	#caller holds the lock
+		if self.db is None:
+			self.filepath.parent.mkdir(parents=True, exist_ok=True)
+			self.db = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+			self.db.execute('PRAGMA journal_mode=WAL')
+			self.db.execute(SCHEMA)
+			self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed_index ON responses (accessed_at)')
+			self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+		return self.db
+
+	#stored body as a dict of meta and results, or None on a miss or an expired entry.
+	#A broken cache file is logged and treated as a miss, the cache never fails a fetch
+	def get(self, endpoint, key):
+		if not self.reads:
+			return None
+		now = time.time()
+		with self.lock:
+			try:
+				row = self._open().execute('SELECT body, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+				#replay takes whatever it has, expired or not
+				if row and (row[1] is None or row[1] > now or self.mode == 'replay'):
+					self.db.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+				else:
+					row = None
+			except sqlite3.Error as e:
+				logger.warning('Response cache read failed: %s', e)
+				row = None
+			if row:
+				self.hits += 1
+			else:
+				self.misses += 1
+		metrics.inc('response_cache_total', endpoint=endpoint, result='hit' if row else 'miss')
+		return json.loads(zlib.decompress(row[0])) if row else None
+
+	#[(params, body)] of every stored response of one resource, expired ones included, in key order. For replay,
+	#which has to find responses by resource whatever params they were fetched with
+	def responses(self, endpoint, resource_id):
+		if not self.reads:
+			return []
+		first, last = key_range(endpoint, resource_id)
+		with self.lock:
+			try:
+				rows = self._open().execute('SELECT key, body FROM responses WHERE key >= ? AND key < ?', (first, last)).fetchall()
+			except sqlite3.Error as e:
+				logger.warning('Response cache read failed: %s', e)
+				rows = []
+			if rows:
+				self.hits += len(rows)
+			else:
+				self.misses += 1
+		metrics.inc('response_cache_total', len(rows) or 1, endpoint=endpoint, result='hit' if rows else 'miss')
+		return [(dict(parse_qsl(key[len(first):])), json.loads(zlib.decompress(body))) for key, body in rows]
+
+	#store the meta and results of an sdk response. ttl None keeps it until evicted
+	def put(self, endpoint, key, response, ttl=None):
+		if not self.writes:
+			return
+		body = json.loads(response.json())
+		blob = zlib.compress(json.dumps({'meta': body['meta'], 'results': body['results']}).encode())
+		now = time.time()
+		with self.lock:
+			try:
+				db = self._open()
+				old = db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+				db.execute('REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+					(key, endpoint, blob, len(blob), now, None if ttl is None else now + ttl, now))
+				self.size += len(blob) - (old[0] if old else 0)
+				self.stores += 1
+				if self.size > self.max_bytes:
+					self._evict()
+			except sqlite3.Error as e:
+				logger.warning('Response cache write failed: %s', e)
+				return
+		metrics.inc('response_cache_total', endpoint=endpoint, result='stored')
+
+	#drop expired entries, then least recently used ones until the file is back under 90% of max_bytes
+	def _evict(self):	#caller holds the lock
+		now = time.time()
+		freed = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE expires_at <= ?', (now,)).fetchone()
+		self.db.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+		self.size -= freed[1]
+		self.evicted += freed[0]
+		target = int(self.max_bytes * 0.9)
+		while self.size > target:
+			rows = self.db.execute('SELECT key, size FROM responses ORDER BY accessed_at LIMIT 500').fetchall()
+			if not rows:
+				self.size = 0
+				break
+			self.db.executemany('DELETE FROM responses WHERE key = ?', [(k,) for k, _ in rows])
+			self.size -= sum(size for _, size in rows)
+			self.evicted += len(rows)
+
+	def prune(self):
+		with self.lock:
+			self._open()
+			self._evict()
+			self.db.execute('VACUUM')
+
+	def stats(self):
+		with self.lock:
+			rows = self._open().execute('SELECT endpoint, COUNT(*), SUM(size), SUM(expires_at IS NULL) FROM responses GROUP BY endpoint').fetchall()
+		return {endpoint: {'responses': n, 'bytes': size, 'immutable': immutable} for endpoint, n, size, immutable in rows}
+
+	def summary(self):
+		return (f'Response cache ({self.mode}): {self.hits} hits, {self.misses} misses, {self.stores} stored, '
+			f'{self.evicted} evicted, {self.size/1024**2:.1f}MB on disk.')
+
+	def close(self):	#caller holds the lock or is the only user
+		if self.db is not None:
+			self.db.close()
+			self.db = None
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--file', default=CACHE_FILE, help='cache file')
+	parser.add_argument('--stats', action='store_true', help='responses and bytes per endpoint')
+	parser.add_argument('--prune', action='store_true', help='evict expired and least recently used responses past the size bound, then vacuum')
+	parser.add_argument('--max-mb', type=float, default=CACHE_MB, help='size bound for --prune')
+	args = parser.parse_args()
+
+	cache = ResponseCache(args.file, mode='use', max_bytes=int(args.max_mb*1024**2))
+	if args.prune:
+		cache.prune()
+		print(f'{cache.evicted} responses evicted.')
+	print(json.dumps(cache.stats(), indent=1))
@@ -0,0 +1,228 @@
+"""
+Shared request executor for OpenAQ calls: bounded retries with exponential backoff and jitter, a circuit breaker per
+endpoint, and a dead-letter file of the locations and sensors that still failed.
+A 429 holds every worker through the shared rate budget until the quota window resets (x_ratelimit_reset of the
+last response), or for the backoff when that is longer. Server errors, timeouts and dropped connections are retried.
+Client errors (bad request, not found, auth) are not, retrying cannot fix them. Bad requests and not found are not
+dead-lettered either: they go to a separate rejected file that --retry-dead-letters never reads.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv('OPENAQ_MAX_ATTEMPTS', 6))	#attempts per request, the first one included
+BACKOFF_MAX = float(os.getenv('OPENAQ_BACKOFF_MAX', 120))	#cap in seconds of one backoff
+BREAKER_FAILURES = int(os.getenv('OPENAQ_BREAKER_FAILURES', 10))	#consecutive failures that open an endpoint's circuit
+BREAKER_COOLDOWN = float(os.getenv('OPENAQ_BREAKER_COOLDOWN', 120))	#seconds open before one trial request is let through
+
+DEAD_LETTER_FILE = os.getenv('OPENAQ_DEAD_LETTER_FILE', str(Path(__file__).parent/'dead_letters.jsonl'))
+REJECTED_FILE = os.getenv('OPENAQ_REJECTED_FILE', str(Path(__file__).parent/'rejected.jsonl'))
+
+class CircuitOpenError(Exception):
+	"""Raised instead of sending a request while the endpoint's circuit is open."""
+
+#errors worth another attempt. The sdk raises a bare Exception for statuses it has no class for (502, 503).
+#httpx and openaq are imported here rather than at the top: they are loaded anyway once a request was sent
+def retryable(e):
+	import httpx
+	from openaq import RateLimit, ServerError
+	return isinstance(e, (RateLimit, ServerError, httpx.TransportError)) or type(e) is Exception
+
+#errors no later run can fix: the resource does not exist or the request itself is wrong. Auth errors are not in here,
+#a fixed key makes them go through
+def rejected(e):
+	from openaq import BadRequestError, NotFoundError
+	return isinstance(e, (BadRequestError, NotFoundError))
+
+#an answer from the endpoint about the request itself (404, 400, auth): the endpoint is up
+def client_error(e):
+	from openaq.shared.exceptions import ClientError
+	return isinstance(e, ClientError) and not rate_limited(e)
+
+def rate_limited(e):
+	from openaq import RateLimit
+	return isinstance(e, RateLimit)
+
+class CircuitBreaker:
+	"""
+	Opens after `threshold` consecutive failures of an endpoint, then fails calls fast for `cooldown` seconds instead of
+	spending every worker's retries on it. After the cooldown one trial call goes through: success closes the circuit,
+	failure opens it for another cooldown.
+	"""
+	def __init__(self, endpoint, threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+		self.endpoint = endpoint
+		self.threshold = threshold
+		self.cooldown = cooldown
+		self.lock = threading.Lock()
+		self.failures = 0
+		self.opened_at = None
+		self.trial = False	#a trial call is in flight
+
+	def check(self):
+		with self.lock:
+			if self.opened_at is None:
+				return
+			if self.trial or time.monotonic() - self.opened_at < self.cooldown:
+				raise CircuitOpenError(f'{self.endpoint} circuit open after {self.failures} consecutive failures')
+			self.trial = True
+
+	#end a trial call without a verdict on the endpoint: the circuit stays open since opened_at, and the next call after
+	#the cooldown is let through as a new trial
+	def rearm(self):
+		with self.lock:
+			self.trial = False
+
+	def success(self):
+		with self.lock:
+			if self.opened_at is not None:
+				logger.info(f'{self.endpoint} circuit closed')
+			self.failures, self.opened_at, self.trial = 0, None, False
+
+	def failure(self):
+		with self.lock:
+			self.failures += 1
+			if self.trial or self.failures >= self.threshold:
+				if self.opened_at is None:
+					logger.warning(f'{self.endpoint} circuit opened after {self.failures} consecutive failures')
+					metrics.inc('circuit_opened_total', endpoint=self.endpoint)
+				self.opened_at, self.trial = time.monotonic(), False
+
+class RequestExecutor:
+	"""Runs API calls through the rate budget, retrying with backoff. One executor is shared by every fetch worker."""
+	def __init__(self, budget, max_attempts=MAX_ATTEMPTS, backoff_max=BACKOFF_MAX):
+		self.budget = budget
+		self.max_attempts = max_attempts
+		self.backoff_max = backoff_max
+		self.backoff = None	#tenacity wait strategy, built with the first call. tenacity pulls in tornado, too slow for import time
+		self.breakers = {}
+		self.lock = threading.Lock()
+		self.retries = 0
+
+	def breaker(self, endpoint):
+		with self.lock:
+			if endpoint not in self.breakers:
+				self.breakers[endpoint] = CircuitBreaker(endpoint)
+			return self.breakers[endpoint]
+
+	#seconds before the next attempt. A 429 is waited out in the budget, so every worker holds, not just this one
+	def _wait(self, retry_state):
+		seconds = self.backoff(retry_state)
+		if rate_limited(retry_state.outcome.exception()):
+			self.budget.backoff(max(seconds, self.budget.reset_in()))
+			return 0
+		return seconds
+
+	def _before_sleep(self, retry_state):
+		with self.lock:
+			self.retries += 1
+		e = retry_state.outcome.exception()
+		logger.info(f'Retrying {retry_state.args[0]} after attempt {retry_state.attempt_number}: {type(e).__name__} {e}')
+
+	#fn(*args, **kwargs) as one API request, retried up to max_attempts. Raises the last error when every attempt failed
+	def call(self, endpoint, fn, *args, **kwargs):
+		from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+		if self.backoff is None:
+			self.backoff = wait_random_exponential(multiplier=2, max=self.backoff_max)	#up to 4, 8, 16... seconds
+		retrying = Retrying(stop=stop_after_attempt(self.max_attempts), wait=self._wait, retry=retry_if_exception(retryable),
+			before_sleep=self._before_sleep, reraise=True)
+		return retrying(self._attempt, endpoint, fn, *args, **kwargs)
+
+	def _attempt(self, endpoint, fn, *args, **kwargs):
+		breaker = self.breaker(endpoint)
+		try:
+			breaker.check()
+		except CircuitOpenError:
+			metrics.inc('api_requests_total', endpoint=endpoint, outcome='circuit_open')
+			raise
+		try:
+			with self.budget, metrics.timer('api_request_seconds', endpoint=endpoint):
+				response = fn(*args, **kwargs)
+		except Exception as e:
+			#every outcome resolves a trial call, or the breaker would wait on it forever and fail every later call
+			if rate_limited(e):	#the quota, not the endpoint, so the circuit is left as it was
+				breaker.rearm()
+				metrics.inc('api_requests_total', endpoint=endpoint, outcome='rate_limited')
+				raise
+			if retryable(e):
+				breaker.failure()
+			elif client_error(e):
+				breaker.success()
+			else:
+				breaker.rearm()
+			metrics.inc('api_requests_total', endpoint=endpoint, outcome='error')
+			raise
+		except BaseException:	#interrupted
+			breaker.rearm()
+			raise
+		breaker.success()
+		metrics.inc('api_requests_total', endpoint=endpoint, outcome='ok')
+		return response
+
+class DeadLetters:
+	"""
+	Append-only JSON lines file of locations and sensor windows whose requests failed after every retry.
+	ETL.py --retry-dead-letters fetches just those again, without a full rerun, and drops them from the file once that
+	run went through. Rejected requests (rejected(e)) are written to rejected_filepath instead, for a look by hand.
+	"""
+	def __init__(self, filepath=DEAD_LETTER_FILE, rejected_filepath=REJECTED_FILE):
+		self.filepath = Path(filepath)
+		self.rejected_filepath = Path(rejected_filepath)
+		self.lock = threading.Lock()
+		self.count = 0
+		self.rejected = 0
+
+	def add(self, kind, error, **fields):
+		entry = {'kind': kind, **fields, 'error': f'{type(error).__name__}: {error}'[:500],
+				'failed_at': datetime.datetime.now().isoformat(timespec='seconds')}
+		is_rejected = rejected(error)
+		with self.lock:
+			with (self.rejected_filepath if is_rejected else self.filepath).open('a') as f:
+				f.write(json.dumps(entry, default=str) + '\n')
+			if is_rejected:
+				self.rejected += 1
+			else:
+				self.count += 1
+		metrics.inc('rejected_total' if is_rejected else 'dead_letters_total', kind=kind)
+
+	def read(self):
+		if not self.filepath.exists():
+			return []
+		return [json.loads(line) for line in self.filepath.read_text().split('\n') if line.strip()]
+
+	#ids of every location whose location request failed, in the order they failed
+	@staticmethod
+	def location_ids(entries):
+		return list(dict.fromkeys(str(entry['location_id']) for entry in entries if entry['kind'] == 'location'))
+
+	#{location_id: [(sensor_id, date_from, date_to)]} of every failed sensor window, each window once
+	@staticmethod
+	def sensor_windows(entries):
+		windows = {}
+		for entry in entries:
+			if entry['kind'] == 'sensor':
+				window = (entry['sensor_id'], entry['date_from'], entry['date_to'])
+				location_windows = windows.setdefault(str(entry['location_id']), [])
+				if window not in location_windows:
+					location_windows.append(window)
+		return windows
+
+	#remove the first n entries, the ones a retry run read, keeping whatever failed since and was appended after them
+	def drop(self, n):
+		with self.lock:
+			if not self.filepath.exists():
+				return
+			lines = [line for line in self.filepath.read_text().split('\n') if line.strip()][n:]
+			if not lines:
+				self.filepath.unlink()
+				return
+			tmp = self.filepath.with_suffix('.tmp')
+			tmp.write_text(''.join(line + '\n' for line in lines))
+			tmp.replace(self.filepath)
@@ -0,0 +1,136 @@
+"""
+Daily country/pollutant rollup of the aqi table (aqi_daily), read by the dashboard instead of raw aqi.
+The ETL refreshes only the dates it loaded, so maintenance cost follows the size of a run, not of the history.
+latest_readings keeps the newest daily average of every (country, pollutant), rewritten after each load for the
+countries of the locations it loaded, so the dashboard header reads a table of countries x pollutants rows.
+After each load a row is added to etl_loads, the version the dashboard polls to know new rollup rows exist.
+Run this file directly to rebuild the whole rollup, e.g. after creating the table.
+
+Usage:
+	python rollup.py                 # rebuild every date in aqi
+	python rollup.py 2024-01-01 2024-02-01
+	python rollup.py --latest        # rebuild latest_readings only
+"""
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+#recompute every (date, country, pollutant) row of the given date range [date_from, date_to). REPLACE overwrites
+#the rows a previous refresh wrote for these dates
+ROLLUP_QUERY = """
+	REPLACE INTO aqi_daily (`date`, country_id, pollutant_id, avg_value, min_value, max_value, n)
+	SELECT DATE(aqi.datetime), locations.country_id, aqi.pollutant_id, AVG(value), MIN(value), MAX(value), COUNT(*)
+	FROM aqi
+	JOIN locations ON aqi.location_id = locations.id
+	WHERE aqi.datetime >= %s AND aqi.datetime < %s
+	GROUP BY DATE(aqi.datetime), locations.country_id, aqi.pollutant_id
+	"""
+
+#newest day with a valid average of each (country, pollutant) in aqi_daily. {countries} narrows it to some countries.
+#the aqi_daily_pollutant_index (pollutant_id, country_id, date, ...) serves the MAX per group from the index
+LATEST_QUERY = """
+	REPLACE INTO latest_readings (country_id, pollutant_id, `date`, value, n)
+	SELECT aqi_daily.country_id, aqi_daily.pollutant_id, aqi_daily.date, aqi_daily.avg_value, aqi_daily.n
+	FROM aqi_daily
+	JOIN (
+		SELECT country_id, pollutant_id, MAX(`date`) AS `date`
+		FROM aqi_daily
+		WHERE avg_value >= 0 {countries}
+		GROUP BY country_id, pollutant_id) latest
+	USING (country_id, pollutant_id, `date`)
+	"""
+
+COUNTRIES_FILTER = 'AND country_id IN (SELECT country_id FROM locations WHERE id IN ({locations}))'
+
+#merge dates into contiguous [start, end) ranges, so a long backfill is a few range statements, not one per day
+def date_ranges(dates):
+	ranges = []
+	for day in sorted(set(dates)):
+		if ranges and ranges[-1][1] == day:
+			ranges[-1][1] = day + datetime.timedelta(days=1)
+		else:
+			ranges.append([day, day + datetime.timedelta(days=1)])
+	return [tuple(r) for r in ranges]
+
+#refresh the rollup for the given dates (datetime.date objects) in one transaction
+def refresh_daily_rollup(cnx, dates):
+	ranges = date_ranges(dates)
+	if not ranges:
+		return 0
+	curs = cnx.cursor()
+	rows = 0
+	try:
+		for start, end in ranges:
+			curs.execute(ROLLUP_QUERY, [start, end])
+			rows += curs.rowcount
+		cnx.commit()
+	except Exception as e:
+		cnx.rollback()
+		logger.warning('Daily rollup refresh failed: %s', e)
+		return 0
+	finally:
+		curs.close()
+	logger.info(f'Daily rollup refreshed for {len(set(dates))} dates in {len(ranges)} ranges.')
+	return rows
+
+#rewrite latest_readings for the countries of location_ids, or every country when None. Run after the rollup refresh
+def refresh_latest_readings(cnx, location_ids=None):
+	if location_ids is not None:
+		location_ids = sorted({int(loc_id) for loc_id in location_ids})
+		if not location_ids:
+			return 0
+		query = LATEST_QUERY.format(countries=COUNTRIES_FILTER.format(locations=', '.join(['%s'] * len(location_ids))))
+	else:
+		query = LATEST_QUERY.format(countries='')
+	curs = cnx.cursor()
+	try:
+		curs.execute(query, location_ids or [])
+		rows = curs.rowcount
+		cnx.commit()
+	except Exception as e:	#the dashboard falls back to reading aqi_daily
+		cnx.rollback()
+		logger.warning('Latest readings refresh failed: %s', e)
+		return 0
+	finally:
+		curs.close()
+	logger.info(f"Latest readings refreshed for {'all' if location_ids is None else len(location_ids)} locations.")
+	return rows
+
+#signal a completed load to the dashboard by bumping the etl_loads version
+def record_load(cnx, source, aqi_rows=0):
+	curs = cnx.cursor()
+	try:
+		curs.execute('INSERT INTO etl_loads (source, aqi_rows) VALUES (%s, %s)', [source, aqi_rows])
+		cnx.commit()
+		return curs.lastrowid
+	except Exception as e:	#the dashboard falls back to its ttl, so a missing signal only delays the refresh
+		cnx.rollback()
+		logger.warning('Could not record load version: %s', e)
+		return None
+	finally:
+		curs.close()
+
+if __name__ == '__main__':
+	import argparse
+	from connectdb import connect_db
+
+	parser = argparse.ArgumentParser(description='Rebuild the aqi_daily rollup table.')
+	parser.add_argument('date_from', nargs='?', help='first date to rebuild, defaults to the oldest aqi row')
+	parser.add_argument('date_to', nargs='?', help='day after the last date to rebuild, defaults to tomorrow')
+	parser.add_argument('--latest', action='store_true', help='only rebuild latest_readings from aqi_daily')
+	args = parser.parse_args()
+
+	with connect_db() as (cnx, curs):
+		if not args.latest:
+			if args.date_from:
+				start = datetime.date.fromisoformat(args.date_from)
+			else:
+				curs.execute('SELECT MIN(datetime) FROM aqi')
+				start = curs.fetchone()[0].date()
+			end = datetime.date.fromisoformat(args.date_to) if args.date_to else datetime.date.today() + datetime.timedelta(days=1)
+
+			days = [start + datetime.timedelta(days=i) for i in range((end - start).days)]
+			print(f'{refresh_daily_rollup(cnx, days)} rollup rows written for {start} to {end}.')
+		print(f'{refresh_latest_readings(cnx)} latest readings written.')
+		record_load(cnx, 'rollup')
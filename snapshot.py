@@ -0,0 +1,192 @@
+"""
+Local Parquet snapshot of the aqi database, for dashboard cold starts and offline analysis without RDS.
+aqi joined with its dimensions is written one file per month (snapshot/aqi/month=YYYY-MM/part.parquet), and the
+aqi_daily rollup with country and pollutant names to snapshot/aqi_daily.parquet, next to the countries and pollutants
+tables the dashboard labels it with and the latest_readings its header shows. The ETL calls export_snapshot at the end of each run with the dates it loaded, so
+only those months are rewritten. Files are written to a temp name and renamed, so a reader never sees half a file.
+
+Usage:
+	python snapshot.py                  # export every month in aqi
+	python snapshot.py --months 2024-12 2025-01
+"""
+import datetime
+import json
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+#snapshot location. Override with AQI_SNAPSHOT_DIR env variable
+SNAPSHOT_DIR = Path(os.getenv('AQI_SNAPSHOT_DIR', Path(__file__).parent/'snapshot'))
+
+#aqi rows of one month [start, end) with the names and coordinates of their dimensions
+AQI_QUERY = """
+	SELECT aqi.datetime, aqi.location_id, locations.locality, locations.latitude, locations.longitude,
+		countries.country_name AS country, pollutants.name AS pollutant, pollutants.units,
+		aqi.value, aqi.min_val, aqi.max_val, aqi.sd
+	FROM aqi
+	JOIN locations ON aqi.location_id = locations.id
+	JOIN countries ON locations.country_id = countries.id
+	JOIN pollutants ON aqi.pollutant_id = pollutants.id
+	WHERE aqi.datetime >= %s AND aqi.datetime < %s
+	"""
+
+#whole daily rollup, same columns as the dashboard delta query plus the rest of the rollup
+ROLLUP_QUERY = """
+	SELECT CAST(aqi_daily.date AS DATETIME) AS datetime, countries.country_name AS country, pollutants.name AS pollutant,
+		ROUND(avg_value, 2) AS avg_value, min_value, max_value, n, aqi_daily.updated_at
+	FROM aqi_daily
+	JOIN countries ON countries.id = aqi_daily.country_id
+	JOIN pollutants ON aqi_daily.pollutant_id = pollutants.id
+	"""
+
+#newest day of every country and pollutant, kept by the ETL (rollup.refresh_latest_readings)
+LATEST_QUERY = """
+	SELECT CAST(latest_readings.date AS DATETIME) AS datetime, countries.country_name AS country, pollutants.name AS pollutant,
+		ROUND(value, 2) AS value
+	FROM latest_readings
+	JOIN countries ON countries.id = latest_readings.country_id
+	JOIN pollutants ON latest_readings.pollutant_id = pollutants.id
+	"""
+
+#dimension tables the dashboard labels and joins the rollup with, written whole by every export
+REFERENCE_QUERIES = {
+	'pollutants': 'SELECT id, name, display_name, units FROM pollutants ORDER BY id',
+	'countries': 'SELECT id, country_name AS country, gdp_per_capita, region FROM countries ORDER BY id',
+}
+
+def month_start(day):
+	return datetime.date(day.year, day.month, 1)
+
+def next_month(day):
+	return datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+#pyarrow is imported on first read or write, not with the module: the ETL and dashboard import snapshot on every start
+#but only touch a file at the end of a run or on the first chart
+def parquet():
+	import pyarrow.parquet as pq
+	return pq
+
+#write df to path through a temp file, so readers only ever see a complete file
+def write_parquet(df, path):
+	import pyarrow as pa
+	path.parent.mkdir(parents=True, exist_ok=True)
+	staged = path.with_suffix('.tmp')
+	parquet().write_table(pa.Table.from_pandas(df, preserve_index=False), staged, compression='zstd')
+	os.replace(staged, path)
+
+def month_path(snapshot_dir, month):
+	return Path(snapshot_dir)/'aqi'/f'month={month:%Y-%m}'/'part.parquet'
+
+def rollup_path(snapshot_dir):
+	return Path(snapshot_dir)/'aqi_daily.parquet'
+
+def reference_path(snapshot_dir, table):
+	return Path(snapshot_dir)/f'{table}.parquet'
+
+def latest_path(snapshot_dir):
+	return Path(snapshot_dir)/'latest_readings.parquet'
+
+def manifest_path(snapshot_dir):
+	return Path(snapshot_dir)/'manifest.json'
+
+#export the months of the given dates (every month in aqi if dates is None) and the whole rollup
+def export_snapshot(cnx, dates=None, snapshot_dir=SNAPSHOT_DIR):
+	snapshot_dir = Path(snapshot_dir)
+	curs = cnx.cursor()
+	if not manifest_path(snapshot_dir).exists():	#first export writes every month, not just the ones this run loaded
+		dates = None
+	if dates is None:
+		curs.execute('SELECT MIN(datetime), MAX(datetime) FROM aqi')
+		first, last = curs.fetchone()
+		months = []
+		if first is not None:
+			month = month_start(first)
+			while month <= last.date():
+				months.append(month)
+				month = next_month(month)
+	else:
+		months = sorted({month_start(day) for day in dates})
+
+	rows = 0
+	for month in months:
+		df = pd.read_sql_query(AQI_QUERY, cnx, params=[month, next_month(month)])
+		write_parquet(df, month_path(snapshot_dir, month))
+		rows += len(df)
+
+	rollup = pd.read_sql_query(ROLLUP_QUERY, cnx)
+	write_parquet(rollup, rollup_path(snapshot_dir))
+	for table, query in REFERENCE_QUERIES.items():
+		write_parquet(pd.read_sql_query(query, cnx), reference_path(snapshot_dir, table))
+	try:
+		write_parquet(pd.read_sql_query(LATEST_QUERY, cnx), latest_path(snapshot_dir))
+	except Exception as e:	#latest_readings is missing before python migrate.py. No file, so the dashboard asks the database
+		logger.warning('latest_readings not exported: %s', e)
+		latest_path(snapshot_dir).unlink(missing_ok=True)
+
+	curs.execute('SELECT MAX(id) FROM etl_loads')
+	version = curs.fetchone()[0]
+	curs.close()
+	manifest = {
+		'version': version,
+		'watermark': str(rollup['updated_at'].max()) if not rollup.empty else None,
+		'written_at': datetime.datetime.now().isoformat(timespec='seconds'),
+		'months': sorted(p.parent.name.split('=')[1] for p in (snapshot_dir/'aqi').glob('month=*/part.parquet')),
+	}
+	manifest_path(snapshot_dir).write_text(json.dumps(manifest, indent=1))
+	logger.info(f'Snapshot written to {snapshot_dir}: {rows} aqi rows in {len(months)} months, {len(rollup)} rollup rows.')
+	return rows
+
+#the rollup snapshot, memory-mapped, or None if there is none. columns limits what is read from the file
+def read_rollup_snapshot(snapshot_dir=SNAPSHOT_DIR, columns=None):
+	path = rollup_path(snapshot_dir)
+	if not path.exists():
+		return None
+	return parquet().read_table(path, columns=columns, memory_map=True).to_pandas()
+
+#one reference table of the snapshot, or None if there is none
+def read_reference_snapshot(snapshot_dir, table):
+	path = reference_path(snapshot_dir, table)
+	if not path.exists():
+		return None
+	return parquet().read_table(path).to_pandas()
+
+#latest readings of the snapshot, or None if there are none
+def read_latest_snapshot(snapshot_dir=SNAPSHOT_DIR):
+	path = latest_path(snapshot_dir)
+	if not path.exists():
+		return None
+	return parquet().read_table(path).to_pandas()
+
+#manifest of the last export, or None before the first one
+def read_manifest(snapshot_dir=SNAPSHOT_DIR):
+	path = manifest_path(snapshot_dir)
+	if not path.exists():
+		return None
+	return json.loads(path.read_text())
+
+#aqi snapshot of every month, or of [date_from, date_to) if given, as one frame. Months outside the range are not read
+def read_aqi_snapshot(snapshot_dir=SNAPSHOT_DIR, date_from=None, date_to=None, columns=None):
+	frames = []
+	for path in sorted((Path(snapshot_dir)/'aqi').glob('month=*/part.parquet')):
+		month = datetime.date.fromisoformat(path.parent.name.split('=')[1] + '-01')
+		if (date_from and next_month(month) <= date_from) or (date_to and month >= date_to):
+			continue
+		frames.append(parquet().read_table(path, columns=columns, memory_map=True).to_pandas())
+	return pd.concat(frames, ignore_index=True) if frames else None
+
+if __name__ == '__main__':
+	import argparse
+	from connectdb import connect_db
+
+	parser = argparse.ArgumentParser(description='Export a Parquet snapshot of the aqi database.')
+	parser.add_argument('--months', nargs='+', help='months to export as YYYY-MM, defaults to every month in aqi')
+	parser.add_argument('--dir', default=SNAPSHOT_DIR, help='snapshot directory')
+	args = parser.parse_args()
+
+	dates = [datetime.date.fromisoformat(month + '-01') for month in args.months] if args.months else None
+	with connect_db() as (cnx, curs):
+		print(f'{export_snapshot(cnx, dates, args.dir)} aqi rows exported to {args.dir}.')
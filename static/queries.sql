@@ -1,12 +1,12 @@
---This sql file shows examples of common queries that a user might run on this database to gain insights into the air quality data.
+-- This sql file shows examples of common queries that a user might run on this database to gain insights into the air quality data.
 -- It also has commonly run queries that the admin runs to maintain it. 
 
 
--- select all sensors (elements) that are the location in the US
-SELECT name, displayName, units 
-FROM elements
+-- select all sensors (pollutants) that are the location in the US
+SELECT name, display_name, units 
+FROM pollutants
 WHERE id IN (
-	SELECT element_id 
+	SELECT pollutant_id 
 	FROM sensors
 	WHERE location_id IN (
 		SELECT id 
@@ -14,18 +14,18 @@ WHERE id IN (
 		WHERE country_id = (
 			SELECT id
 			FROM countries
-			WHERE name = 'United States'
+			WHERE country_name = 'United States'
 		)
 	)
 );
 
 
--- select all aqi values from the past day in the United States, including the element name
-SELECT `datetime`, `elements`.`name` AS 'element', `value`
-FROM aqi JOIN elements ON aqi.element_id = elements.id 
+-- select all aqi values from the past day in the United States, including the pollutant name
+SELECT `datetime`, `pollutants`.`name` AS 'pollutant', `value`
+FROM aqi JOIN pollutants ON aqi.pollutant_id = pollutants.id 
 	 JOIN locations ON aqi.location_id = locations.id
 	 JOIN countries ON locations.country_id = countries.id
-WHERE countries.name = 'United States'
+WHERE countries.country_name = 'United States'
 AND `datetime` = (
 	SELECT MAX(datetime)
 	FROM aqi
@@ -33,46 +33,46 @@ AND `datetime` = (
 
 
 -- get average values by locality in the last week, as well as number of data points
-SELECT `datetime`, `locality`, `elements`.`name` AS 'element', ROUND(AVG(`value`), 3) AS 'average_value', COUNT(*) AS 'data_points'
-FROM aqi JOIN elements ON aqi.element_id = elements.id 
+SELECT `locality`, `pollutants`.`name` AS 'pollutant', ROUND(AVG(`value`), 3) AS 'average_value', COUNT(*) AS 'data_points'
+FROM aqi JOIN pollutants ON aqi.pollutant_id = pollutants.id 
 	 JOIN locations ON aqi.location_id = locations.id
 	 JOIN countries ON locations.country_id = countries.id
-WHERE countries.name = 'United States'
+WHERE countries.country_name = 'United States'
 AND `datetime` BETWEEN 
 		(SELECT DATE_SUB(
 			(SELECT MAX(`datetime`) FROM `aqi`), 
 			INTERVAL 1 MONTH))
 	AND 
 		(SELECT MAX(`datetime`) FROM `aqi`)
-GROUP BY locality, element;
+GROUP BY locality, pollutant;
 
 
---Select countries and number of sensors (measurments) in each
-SELECT name, COUNT(value) AS 'number measurements'
+-- Select countries and number of sensors (measurments) in each
+SELECT country_name, COUNT(value) AS 'number measurements'
 FROM countries 
 JOIN locations ON countries.id = locations.country_id
 JOIN aqi ON locations.id = aqi.location_id
 GROUP BY country_id
-ORDER BY name;
+ORDER BY country_name;
 
 
---Select all pm2.5 measurements 
-SELECT name, datetime, value, min_val, max_val, sd
+-- Select all pm2.5 measurements 
+SELECT country_name, datetime, value, min_val, max_val, sd
 FROM countries 
 JOIN locations ON countries.id = locations.country_id
 JOIN aqi ON locations.id = aqi.location_id
-WHERE element_id = 2
+WHERE pollutant_id = 2
 AND value > 0
-ORDER BY name, datetime
+ORDER BY country_name, datetime
 LIMIT 50;
 
 
---Select average pm2.5 measurement in each country
-SELECT name, ROUND(AVG(value),2) AS 'avg_pm2.5', COUNT(value) AS 'number measurements'
+-- Select average pm2.5 measurement in each country
+SELECT country_name, ROUND(AVG(value),2) AS 'avg_pm2.5', COUNT(value) AS 'number measurements'
 FROM countries 
 JOIN locations ON countries.id = locations.country_id
 JOIN aqi ON locations.id = aqi.location_id
-WHERE element_id = 2
+WHERE pollutant_id = 2
 GROUP BY country_id
 HAVING `avg_pm2.5` > 0
 ORDER BY `avg_pm2.5` DESC;
@@ -80,19 +80,19 @@ ORDER BY `avg_pm2.5` DESC;
 
 -- Commonly run queries to maintain/ populate DB
 
---Retreive latest datetime that new data was entered.
+-- Retreive latest datetime that new data was entered.
 SELECT MAX(`datetime`) FROM `aqi`;
 
 
---Multi-row insertion from dataframe, with ignore parameter if unique/ key duplicates are entered.
-INSERT IGNORE INTO `aqi` (`datetime`, `location_id`, `element_id`, `value`, `min_val`, `max_val`, `sd`)
+-- Multi-row insertion from dataframe, with ignore parameter if unique/ key duplicates are entered.
+INSERT IGNORE INTO `aqi` (`datetime`, `location_id`, `pollutant_id`, `value`, `min_val`, `max_val`, `sd`)
 VALUES ('2024-12-01 18:00:00', 2537, 5, 0.234, '0.1', 1.39, 0.211),
 	('2024-12-01 18:00:00', 2537, 5, 0.234, '0.1', 1.39, 0.211),
 	('2024-12-01 18:00:00', 2537, 5, 0.234, '0.1', 1.39, 0.211);
 
 
---Multi-row insert from dataframe with update parameter for updating displayName column in elements table
+-- Multi-row insert from dataframe with update parameter for updating display_name column in pollutants table
 	-- because displayName col added after table existed, so NULL values had to be updated.
 	-- prepared query is formatted in python script
-INSERT INTO `{}` {} VALUES ({}) ON DUPLICATE KEY UPDATE displayName = VALUES(displayName);
+INSERT INTO `{}` {} VALUES ({}) ON DUPLICATE KEY UPDATE display_name = VALUES(display_name);
 
@@ -1,5 +1,10 @@
+-- aqi is clustered on (location_id, pollutant_id, datetime): each sensor series is one contiguous primary key range.
+-- Secondary indexes carry the primary key columns, so (datetime, value) and (pollutant_id, datetime, value) cover the
+-- rollup refresh and the pollutant-wide queries. Existing databases are migrated with: python migrate.py
+-- Optional monthly partitioning (python migrate.py --partition) appends
+--   PARTITION BY RANGE COLUMNS(`datetime`) (PARTITION p2024_01 VALUES LESS THAN ('2024-02-01'), ..., PARTITION pmax VALUES LESS THAN (MAXVALUE))
+-- and drops the two foreign keys, which MySQL does not support on partitioned tables.
 CREATE TABLE `aqi` (
-  `id` int unsigned NOT NULL AUTO_INCREMENT,
   `datetime` datetime NOT NULL,
   `location_id` int unsigned NOT NULL,
   `pollutant_id` int unsigned NOT NULL,
@@ -7,10 +12,9 @@ CREATE TABLE `aqi` (
   `min_val` float NOT NULL,
   `max_val` float NOT NULL,
   `sd` float DEFAULT NULL,
-  PRIMARY KEY (`id`),
-  UNIQUE KEY `datetime` (`datetime`,`location_id`,`pollutant_id`),
-  KEY `aqi_location_index` (`location_id`),
-  KEY `aqi_pollutant_index` (`pollutant_id`),
+  PRIMARY KEY (`location_id`,`pollutant_id`,`datetime`),
+  KEY `aqi_datetime_index` (`datetime`,`value`),
+  KEY `aqi_pollutant_index` (`pollutant_id`,`datetime`,`value`),
   CONSTRAINT `aqi_ibfk_1` FOREIGN KEY (`location_id`) REFERENCES `locations` (`id`),
   CONSTRAINT `aqi_ibfk_2` FOREIGN KEY (`pollutant_id`) REFERENCES `pollutants` (`id`)
 )
@@ -21,19 +25,20 @@ CREATE TABLE `aqi` (
 
 CREATE TABLE `locations` (
   `id` int unsigned NOT NULL AUTO_INCREMENT,
-  `latitude` varchar(20) NOT NULL,
-  `longitude` varchar(20) NOT NULL,
+  `latitude` decimal(9,6) NOT NULL,
+  `longitude` decimal(9,6) NOT NULL,
   `country_id` smallint unsigned NOT NULL,
   `locality` varchar(50) DEFAULT NULL,
   PRIMARY KEY (`id`),
   KEY `country_id` (`country_id`),
+  KEY `locations_coordinates_index` (`latitude`,`longitude`),
   CONSTRAINT `locations_ibfk_1` FOREIGN KEY (`country_id`) REFERENCES `countries` (`id`)
 )
 
 
 CREATE TABLE `countries` (
   `id` smallint unsigned NOT NULL AUTO_INCREMENT,
-  `name` varchar(50) DEFAULT NULL,
+  `country_name` varchar(50) DEFAULT NULL,
   `gdp_per_capita` float DEFAULT NULL,
   `region` varchar(30) DEFAULT NULL,
   PRIMARY KEY (`id`)
@@ -43,7 +48,7 @@ CREATE TABLE `pollutants` (
   `id` int unsigned NOT NULL AUTO_INCREMENT,
   `name` varchar(30) DEFAULT NULL,
   `units` varchar(10) DEFAULT NULL,
-  `displayName` varchar(20) DEFAULT NULL,
+  `display_name` varchar(20) DEFAULT NULL,
   PRIMARY KEY (`id`)
 )
 
@@ -56,4 +61,43 @@ CREATE TABLE `sensors` (
   KEY `pollutant_id` (`pollutant_id`),
   CONSTRAINT `sensors_ibfk_2` FOREIGN KEY (`location_id`) REFERENCES `locations` (`id`),
   CONSTRAINT `sensors_ibfk_3` FOREIGN KEY (`pollutant_id`) REFERENCES `pollutants` (`id`)
-) 
\ No newline at end of file
+) 
+
+-- Daily rollup of aqi per country and pollutant, read by the dashboard instead of raw aqi.
+-- Maintained by the ETL for the dates each run loads (rollup.py), rebuild all with: python rollup.py
+CREATE TABLE `aqi_daily` (
+  `date` date NOT NULL,
+  `country_id` smallint unsigned NOT NULL,
+  `pollutant_id` int unsigned NOT NULL,
+  `avg_value` float NOT NULL,
+  `min_value` float NOT NULL,
+  `max_value` float NOT NULL,
+  `n` int unsigned NOT NULL,
+  `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`date`,`country_id`,`pollutant_id`),
+  KEY `aqi_daily_pollutant_index` (`pollutant_id`,`country_id`,`date`,`avg_value`,`n`),
+  KEY `aqi_daily_country_index` (`country_id`),
+  KEY `aqi_daily_updated_index` (`updated_at`)
+)
+
+-- Newest daily average of each country and pollutant, for the dashboard header. Rewritten from aqi_daily after each
+-- load for the countries it loaded (rollup.refresh_latest_readings), rebuild with: python rollup.py --latest
+CREATE TABLE `latest_readings` (
+  `country_id` smallint unsigned NOT NULL,
+  `pollutant_id` int unsigned NOT NULL,
+  `date` date NOT NULL,
+  `value` float NOT NULL,
+  `n` int unsigned NOT NULL,
+  `updated_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`country_id`,`pollutant_id`)
+)
+
+-- One row per completed ETL/backfill load. The dashboard polls MAX(id) as a version and only fetches
+-- aqi_daily rows updated since its watermark when the version changes (dashboard_data.py)
+CREATE TABLE `etl_loads` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `source` varchar(16) NOT NULL,
+  `aqi_rows` int unsigned NOT NULL DEFAULT 0,
+  `finished_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+)
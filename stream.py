@@ -2,11 +2,8 @@
 #DONE: resolved insert updating bug
 #DONE: moved aqi_df_pm25 to external func
 # from connectdb import *
-from connectdb import connect_db
-from matplotlib import pyplot as plt
+from dashboard_data import DashboardData, get_latest_pm25
 import plotly.express as px
-import plotly.graph_objects as go
-import numpy as np
 import pandas as pd
 import streamlit as st
 import datetime
@@ -28,16 +25,20 @@ def dashboard():
     st.title("Air Quality in Capital Cities Around the World")
     st.markdown('###')
 
-    # Establish connection and cursor with database as IAM user
-    cnx, curs = connect_db()
+    # the data layer checks out pooled connections itself, only for what the snapshot cannot answer. The pool and its
+    # cached IAM token live across reruns, so a rerun that does query pays for neither a token nor a fresh connection
+    render_dashboard()
 
-    @st.cache_data      #prevents streamlit from rerunning following function more than once while data is static
-    def query_to_df(query):
-        return pd.read_sql_query(query, cnx)
-        
-    # query desired data from aqi as a pandas dataframe
-    aqi_df = query_to_df(query_all_aqi())
-    aqi_df2 = aqi_df.copy()
+# one data layer per server process, shared by every session. It only re-queries when the ETL records a new load
+@st.cache_resource
+def get_dashboard_data():
+    return DashboardData()
+
+def render_dashboard():
+    data = get_dashboard_data()
+
+    # first paint only needs the latest pm25 of each country. Explorer data is queried once a selection exists
+    maxdate, latest_pm25 = get_latest_pm25(data.latest_pm25())
 
     # TODO: implement upper value cutoffs for pollutants once unit conversion redundancy is resolved
     upper_cutoffs = {
@@ -49,24 +50,16 @@ def dashboard():
     'so2': 300
     }
 
-    #limit pm25 and other values to be capped off at approp. max as defined in upper_cutoffs
-    # aqi_df2['avg_value'] = aqi_df2.apply(
-    #     lambda x: min(x['avg_value'], upper_cutoffs.get(x['pollutant'], x['avg_value'])), 
-    #     axis=1
-    #     )
-
     # setup session state for expander
     if 'expander_state' not in st.session_state:
         st.session_state.expander_state = True
 
     # with st.expander('PM2.5 Daily and Historical Averages', expanded=st.session_state.expander_state):
-    aqi_df2_latest_pm25, aqi_df_pivot = get_latest_pm25(aqi_df2)
     #apply metrics display at top of page
-    maxdate = aqi_df2.datetime.max()
-    top_3_metrics(maxdate, aqi_df2_latest_pm25)     
+    top_3_metrics(maxdate, latest_pm25)     
     st.markdown('')
     col1, col2 = st.columns(2, border=True)
-    fig = plot_pm25_gdp(cnx)
+    fig = plot_pm25_gdp(data)
     col1.plotly_chart(fig)
     col2.markdown('#')
     # col2.markdown('')
@@ -80,8 +73,8 @@ def dashboard():
 
     st.markdown('---')
 
-    # give option bar for countries, taken from aqi_df, in sidebar
-    countries = aqi_df_pivot['country'].sort_values().unique()
+    # give option bar for countries with data, in sidebar
+    countries = data.countries()
 
     # st.sidebar.markdown('#\n#\n#\n#\n#')    #5 blank spaces
     st.sidebar.title('AQI Explorer')
@@ -98,51 +91,18 @@ def dashboard():
         #collapse pm25 expander so user can see content
         st.session_state.expander_state = False
 
-        # filters out rows which contain the countries in the selected list. Drops any columns that don't have any valid values
-        aqi_df_plot = aqi_df_pivot[aqi_df_pivot.country.isin(selected)].dropna(axis=1, how='all').sort_values(by=['country', 'datetime'])
-
-        # select pollutant to view
-        pollutants = aqi_df_plot.columns[2:]
+        # select pollutant to view, from those measured in the selected countries
+        pollutants = data.pollutants(selected)
         pollutant = st.sidebar.pills('Select a pollutant', options=pollutants, selection_mode='single')
 
         if pollutant:
             st.sidebar.markdown('---')
-            # get measurement units, and display name for modifying xaxis label
-            
-            plot_aqi_explorer(curs, aqi_df_plot, pollutant)
+            aqi_df_plot = plot_aqi_explorer(data, selected, pollutant)
             
-        # show raw data below
-        st.markdown('#####')
-        st.write('##### Raw Data')
-        st.write(aqi_df_plot)
-
-def get_latest_pm25(aqi_df):
-
-    #sort by country and date so lines don't spaghetti
-    aqi_df.sort_values(by=['country', 'datetime'], inplace=True)
-    aqi_df[aqi_df['avg_value'] < 0 ] = np.nan
-
-    # aggregate any possible duplicates (of datetime, country, pollutant combination) and reset
-    aqi_df = aqi_df.groupby(['datetime', 'country', 'pollutant']).mean().reset_index()
-
-    # pivot table for graphing in plotly - each pollutant gets column
-    aqi_df_pivot = aqi_df.pivot(index=['datetime', 'country'], columns='pollutant', values='avg_value').reset_index()
-    aqi_df_pivot.sort_values(['country', 'datetime'], inplace=True)
-
-    #only show latest pm25 row for each country
-    maxdate = aqi_df_pivot.datetime.max()
-    aqi_df_latest_pm25 = aqi_df_pivot[aqi_df_pivot.datetime == maxdate][['country', 'pm25']].dropna().sort_values(by='pm25') 
-
-    if len(aqi_df_latest_pm25) < 6:
-        mindate = maxdate - pd.Timedelta(days=1)
-        aqi_df_latest_pm25 = aqi_df_pivot[(aqi_df_pivot.datetime <= maxdate) & (aqi_df_pivot.datetime >= mindate)]\
-            [['country', 'pm25']].dropna().sort_values(by='pm25') 
-    
-    return aqi_df_latest_pm25, aqi_df_pivot
-    
-
-
-
+            # show raw data below
+            st.markdown('#####')
+            st.write('##### Raw Data')
+            st.write(aqi_df_plot)
 
 def top_3_metrics(date, aqi_df):      #takes dataframe with pm25 column
     #sticks top 3 and bottom 3 rows together
@@ -166,12 +126,10 @@ def top_3_metrics(date, aqi_df):      #takes dataframe with pm25 column
             country = top3['country'].values[i]
             st.metric(label=country, value=pm25) #, border=True)
         
-# gets avg pm2.5 data over time per country, with gdp per cap and region data from db
-def plot_pm25_gdp(cnx):
-    avg_pm25_gdp_df = pd.read_sql_query(query_avg_pm25_gdp(), cnx)
-    avg_pm25_gdp_df['dummy_size'] = 1
-    pm25_row = pd.read_sql_query("SELECT display_name, units FROM pollutants WHERE name = 'pm25' ", cnx)
-    display_name, units = pm25_row.values[0]
+# gets avg pm2.5 data over time per country, with gdp per cap and region data, from the snapshot or the db
+def plot_pm25_gdp(data):
+    # the cached result is shared by every session, so the size column goes on a new frame
+    avg_pm25_gdp_df = data.pm25_gdp().assign(dummy_size=1)
 
     fig = px.scatter(avg_pm25_gdp_df, x='gdp_per_capita', y='avg_pm25', color='region', 
                     hover_name='country',
@@ -180,7 +138,7 @@ def plot_pm25_gdp(cnx):
                     opacity=0.8,
                     title=f'Jan \'24 - Present Average PM 2.5 vs. GDP Per Capita',
                     labels={
-                        'avg_pm25': f'{display_name} ({units})', 
+                        'avg_pm25': data.pollutant_label('pm25'), 
                         'gdp_per_capita': 'GDP Per Capita'
                         },
                     hover_data={'pollutant':False, 'dummy_size':False, 'country':False, },
@@ -188,16 +146,25 @@ def plot_pm25_gdp(cnx):
                   )
     return fig
 
-def plot_aqi_explorer(curs, aqi_df_plot, pollutant):
-    curs.execute('SELECT display_name, units FROM pollutants WHERE name = %s', [pollutant,])
-    display_name, units = curs.fetchall()[0]
-
-    # apply mask to keep only rows w/ countries that have >= 1 measurement of selected pollutant
-    mask = aqi_df_plot.groupby('country')[pollutant].transform(lambda x: not x.isna().all())
-    aqi_df_plot = aqi_df_plot[mask]
-
-    # establish min, max dates for slider defaults for +/- 1 week
-    mindate, maxdate = aqi_df_plot.datetime.min().to_pydatetime(), aqi_df_plot.datetime.max().to_pydatetime()
+# PM2.5 severity bands behind the explorer lines: (lower, upper, fill color, name). Layout shapes spanning the
+# plot width, built once, instead of six filled traces sent with every rerun
+PM25_BANDS = [
+    (0, 12, 'rgba(160, 204, 93, .3)', 'Good'),
+    (12, 35.5, 'rgba(247, 207, 95, .3)', 'Moderate'),
+    (35.5, 55.5, 'rgba(253, 142, 82, .3)', 'Unhealthy for Sensitive Groups'),
+    (55.5, 150.5, 'rgba(241, 96, 96, .3)', 'Unhealthy'),
+    (150.5, 250.5, 'rgba(155, 115, 177, .3)', 'Very Unhealthy'),
+    (250.5, 500, 'rgba(148, 107, 121, .3)', 'Hazardous'),
+]
+PM25_BAND_SHAPES = [dict(type='rect', xref='paper', x0=0, x1=1, yref='y', y0=lower, y1=upper, fillcolor=color,
+                        line_width=0, layer='below', name=name) for lower, upper, color, name in PM25_BANDS]
+
+def plot_aqi_explorer(data, selected, pollutant):
+    # measurement units and display name for the axis label, from the cached reference table
+    label = data.pollutant_label(pollutant)
+
+    # establish min, max dates of the selection for slider defaults for +/- 1 week
+    mindate, maxdate = data.date_bounds(selected, pollutant)
     if mindate == maxdate:
         mindate = mindate - pd.Timedelta(weeks=1)
         maxdate = maxdate + pd.Timedelta(weeks=1)
@@ -207,56 +174,33 @@ def plot_aqi_explorer(curs, aqi_df_plot, pollutant):
                                 mindate, maxdate,     # range to display on the slider
                                 value=[mindate, maxdate])     # default selected range
 
+    # only rows of the selected countries, pollutant and range are fetched. countries without any measurement return no rows.
+    # the frame is shared and indexed by datetime, so it is plotted as is without a renamed copy.
+    # the chart gets each series downsampled to about its pixel width, the raw data table below shows every row
+    aqi_df_plot = data.explorer(selected, pollutant, xrange[0], xrange[1])
+    series_df = data.explorer_series(selected, pollutant, xrange[0], xrange[1])
+
     # find y range with selected range
-    maxy = aqi_df_plot[aqi_df_plot['datetime'].between(xrange[0], xrange[1], inclusive='both')][pollutant].max()
+    maxy = aqi_df_plot['value'].max()
     maxy = maxy*1.15    # add padding to upper range
     
     # add section title
     st.markdown('#####')
     st.write('##### Air Quality Explorer')
-    # plotly instead of pyplot
-    fig = px.line(aqi_df_plot, x='datetime', y=pollutant, color = 'country',
+    # plotly instead of pyplot, drawn with WebGL traces
+    fig = px.line(series_df, x=series_df.index, y='value', color = 'country',
                 range_x=xrange,
                 range_y=(0,maxy),
+                render_mode='webgl',
                 labels={
-                    pollutant: f'{display_name} ({units})'
+                    'value': label
                 })
     # add color bands to show different severity levels for PM2.5
     if pollutant == 'pm25':
-        fig.add_trace(go.Scatter(x=[mindate, maxdate, maxdate, mindate], y=[0,0, 12,12], fill='toself', mode="none", fillcolor="rgba(160, 204, 93, .3)", line=dict(color='rgba(0,0,0,0)'), showlegend=False, name='Good', hoverinfo='skip'))
-        fig.add_trace(go.Scatter(x=[mindate, maxdate, maxdate, mindate], y=[12,12, 35.5,35.5], fill='toself', mode="none", fillcolor="rgba(247, 207, 95, .3)", line=dict(color='rgba(0,0,0,0)'), showlegend=False, name='Moderate', hoverinfo='skip'))
-        fig.add_trace(go.Scatter(x=[mindate, maxdate, maxdate, mindate], y=[35.5,35.5, 55.5,55.5], fill='toself', mode="none", fillcolor="rgba(253, 142, 82, .3)", line=dict(color='rgba(0,0,0,0)'), showlegend=False, name='Unhealthy for Sensitive Groups', hoverinfo='skip'))
-        fig.add_trace(go.Scatter(x=[mindate, maxdate, maxdate, mindate], y=[55.5,55.5, 150.5,150.5], fill='toself', mode="none", fillcolor="rgba(241, 96, 96, .3)", line=dict(color='rgba(0,0,0,0)'), showlegend=False, name='Unhealthy', hoverinfo='skip'))
-        fig.add_trace(go.Scatter(x=[mindate, maxdate, maxdate, mindate], y=[150.5,150.5, 250.5,250.5], fill='toself', mode="none", fillcolor="rgba(155, 115, 177, .3)", line=dict(color='rgba(0,0,0,0)'), showlegend=False, name='Very Unhealthy', hoverinfo='skip'))
-        fig.add_trace(go.Scatter(x=[mindate, maxdate, maxdate, mindate], y=[250.5,250.5, 500,500], fill='toself', mode="none", fillcolor="rgba(148, 107, 121, .3)", line=dict(color='rgba(0,0,0,0)'), showlegend=False, name='Hazardous', hoverinfo='skip'))
+        fig.update_layout(shapes=PM25_BAND_SHAPES)
 
     st.plotly_chart(fig)
-
-def query_all_aqi():    #select all aqi data, avg by country datetime and pollutant, so one row per pollutant per country, per day
-    query = """
-        SELECT datetime, countries.country_name AS country, pollutants.name AS pollutant, ROUND(AVG(value), 2) AS avg_value
-        FROM countries 
-        JOIN locations ON countries.id = locations.country_id
-        JOIN aqi ON locations.id = aqi.location_id
-        JOIN pollutants on aqi.pollutant_id = pollutants.id
-        GROUP BY datetime, country, pollutant
-            """
-    return query
-
-def query_avg_pm25_gdp():
-    query = """
-        SELECT countries.country_name AS country, pollutants.name AS pollutant, ROUND(AVG(value),2) AS 'avg_pm25', gdp_per_capita, region
-        FROM countries 
-        JOIN locations ON countries.id = locations.country_id
-        JOIN aqi ON locations.id = aqi.location_id
-        JOIN pollutants on aqi.pollutant_id = pollutants.id
-        WHERE pollutants.name = 'pm25'
-        AND value < 300
-        GROUP BY country
-        HAVING avg_pm25 >0
-        ORDER BY country;
-            """
-    return query
+    return aqi_df_plot
 
 if __name__ == '__main__':
     dashboard()
\ No newline at end of file